@@ -0,0 +1,158 @@
+# -------------------------------------------------------------------------------------------------------------
+
+from reachability import ReachabilityIndex
+from station_index import StationIndex
+from utils import region_distances
+
+# -------------------------------------------------------------------------------------------------------------
+
+NEAREST_STATIONS = 8
+
+# -------------------------------------------------------------------------------------------------------------
+
+class ChargingPlanner:
+    """
+    Batched, contention-aware charging decisions. Cars that decide where to charge are gathered
+    during a step and assigned together: the distance term of the score is precomputed for every
+    pair of regions, the status of each region is read once per batch, and every assignment claims
+    a charger of the chosen region. Cars with the least autonomy choose first, since they have the
+    fewest options.
+
+    The score of a region is the one used by Car.decide_charging,
+    distance_weight / (distance + 0.1) + availability_weight * chargers - queue_weight * queue,
+    except that the chargers are those left once the queued cars and the claims of the batch are
+    served: a busy region with a queue scores below zero on availability, instead of only losing
+    queue_weight per queued car, so that cars stop piling into the queue of the region they are in
+    when a region they can reach has free chargers, and every claim lowers the score of the region.
+
+    When the regions have individual stations (a station file is configured), the cars of the batch
+    choose among the NEAREST_STATIONS stations with a free charging point within their autonomy,
+    found with a spatial index, scored with the free points of the station instead of those of
+    the whole region. Cars without a free station in reach choose a region as above, counting the
+    stations claimed by the batch against the chargers of their regions, and so do the cars of the
+    vectorized engine, which only tracks the chargers of each region.
+
+    Attributes:
+        regions (list): The regions of the simulation.
+        region_index (dict): Maps region IDs to their index in the regions list.
+        reachability (ReachabilityIndex): The regions reachable from each region for a given autonomy.
+        proximity (list): proximity[origin][region] is the distance term of the score.
+        stations (StationIndex): The spatial index of the stations, or None without a station file.
+        distance_weight (float): Weight for distance.
+        availability_weight (float): Weight for charger availability.
+        queue_weight (float): Weight for queue size.
+        requests (list): The cars waiting for a decision in the current step.
+    """
+    def __init__(self, regions, config, reachability=None, distances=region_distances):
+        self.regions = regions
+        self.region_index = {region.id: r for r, region in enumerate(regions)}
+        self.reachability = reachability if reachability is not None else ReachabilityIndex(regions, distances)
+        self.proximity = [[config.distance_weight * (1 / (distances[a.id][b.id] + 0.1)) for b in regions] for a in regions]
+        self.stations = StationIndex([station for region in regions for station in region.stations]) if config.stations else None
+        self.distance_weight = config.distance_weight
+        self.availability_weight = config.availability_weight
+        self.queue_weight = config.queue_weight
+        self.requests = []
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def request(self, car):
+        """
+        Adds a car to the batch of the current step.
+
+        Args:
+            car (Car): A car in the [DecideCharging] state.
+        """
+        self.requests.append(car)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def plan(self, origins, autonomies, claimed=None):
+        """
+        Chooses the charging region of a batch of cars.
+
+        Args:
+            origins (list): The index of the region where each car is.
+            autonomies (list): The autonomy of each car in kilometers.
+            claimed (list): The number of chargers of each region already claimed in this batch
+                            (e.g. stations chosen by plan_stations), or None if there are none.
+
+        Returns:
+            list: The index of the chosen region of each car, or -1 if no region is reachable.
+        """
+        queued = [len(region.queue) for region in self.regions]
+        claimed = claimed if claimed is not None else [0] * len(self.regions)
+        status = [
+            self.availability_weight * (region.available_chargers - queue - claims) - self.queue_weight * queue
+            for region, queue, claims in zip(self.regions, queued, claimed)
+        ]
+        targets = [-1] * len(origins)
+        for i in sorted(range(len(origins)), key=autonomies.__getitem__):
+            origin = origins[i]
+            candidates = self.reachability.reachable_positions(self.regions[origin], autonomies[i])
+            if not candidates:
+                continue
+            row = self.proximity[origin]
+            best = max(candidates, key=lambda r: row[r] + status[r])
+            targets[i] = best
+            status[best] -= self.availability_weight
+        return targets
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def plan_stations(self, cars):
+        """
+        Sends each car of a batch to the best of the nearest stations with a free charging point
+        within its autonomy, in a region it can reach. Every assignment claims a charging point.
+
+        Args:
+            cars (list): The cars of the batch.
+
+        Returns:
+            tuple: The cars without a free station in reach, which are left to choose a region, and
+                   the number of charging points claimed in each region.
+        """
+        queued = [len(region.queue) for region in self.regions]
+        claimed = [0] * len(self.regions)
+        claims = {}
+        pending = []
+        for car in sorted(cars, key=lambda car: car.autonomy):
+            reachable = self.reachability.reachable_positions(car.current_region, car.autonomy)
+            def accept(station):
+                return station.available > claims.get(station, 0) and self.region_index[station.region.id] in reachable
+            found = self.stations.nearest(car.latitude, car.longitude, NEAREST_STATIONS, car.autonomy, accept)
+            if not found:
+                pending.append(car)
+                continue
+            def score(candidate):
+                distance, station = candidate
+                return (self.distance_weight / (distance + 0.1) + self.availability_weight * (station.available - claims.get(station, 0))
+                        - self.queue_weight * queued[self.region_index[station.region.id]])
+            station = max(found, key=score)[1]
+            claims[station] = claims.get(station, 0) + 1
+            claimed[self.region_index[station.region.id]] += 1
+            car.go_charging(station.region, station)
+        return pending, claimed
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def assign(self):
+        """
+        Decides the charging region (and station, with a station file) of every car requested in
+        this step and sends it there. Cars that cannot reach any region keep deciding.
+
+        Returns:
+            list: The cars of the batch.
+        """
+        cars = self.requests
+        if not cars:
+            return cars
+        self.requests = []
+        pending, claimed = self.plan_stations(cars) if self.stations is not None else (cars, None)
+        targets = self.plan([self.region_index[car.current_region.id] for car in pending], [car.autonomy for car in pending], claimed)
+        for car, target in zip(pending, targets):
+            if target >= 0:
+                car.go_charging(self.regions[target])
+        return cars
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
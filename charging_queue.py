@@ -0,0 +1,314 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import heapq
+
+from collections import deque
+from itertools import count
+
+# -------------------------------------------------------------------------------------------------------------
+
+QUEUE_DISCIPLINES = ("fifo", "lowest_battery", "reservation")
+
+# -------------------------------------------------------------------------------------------------------------
+
+class ChargingQueue:
+    """
+    The cars waiting for a charger of a region, served first come, first served. The simulation
+    runs in a single thread, so the queue is a plain deque: putting, getting and measuring it
+    take constant time and no lock.
+
+    Every queue keeps a clock, advanced by its region once per step, for the disciplines that
+    depend on time, and each car is stored with the key that orders it (unused here), so a
+    snapshot can put it back in the same place.
+
+    Attributes:
+        cars (deque): The queued cars, in order of arrival.
+        clock (int): The current step, as counted by the region.
+    """
+    __slots__ = ("cars", "clock")
+    discipline = "fifo"
+
+    def __init__(self):
+        self.cars = deque()
+        self.clock = 0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self.cars)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def __iter__(self):
+        return iter(self.cars)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def qsize(self):
+        """
+        Gets the number of queued cars.
+
+        Returns:
+            int: The size of the queue.
+        """
+        return len(self)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def empty(self):
+        """
+        Checks whether the queue is empty.
+
+        Returns:
+            bool: True if no car is queued.
+        """
+        return len(self) == 0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def ready(self):
+        """
+        Checks whether the next car may take a charger that is free.
+
+        Returns:
+            bool: True if a car is queued and its turn has come.
+        """
+        return bool(self.cars)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def put(self, car, key=None):
+        """
+        Queues a car.
+
+        Args:
+            car (Car): The car to queue.
+            key (float): The key that orders the car, e.g. from a snapshot, or None to compute it.
+        """
+        self.cars.append(car)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def get(self):
+        """
+        Removes the next car from the queue.
+
+        Returns:
+            Car: The next car.
+        """
+        return self.cars.popleft()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def peek(self):
+        """
+        Gets the next car without removing it.
+
+        Returns:
+            Car: The next car.
+        """
+        return self.cars[0]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def items(self):
+        """
+        Lists the queued cars with their keys, in the order they will be served.
+
+        Returns:
+            list: The (car, key) pairs.
+        """
+        return [(car, 0.0) for car in self.cars]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def advance(self):
+        """
+        Moves the clock of the queue to the next step.
+        """
+        self.clock += 1
+
+# -------------------------------------------------------------------------------------------------------------
+
+class LowestBatteryQueue(ChargingQueue):
+    """
+    Charging queue that serves the car with the lowest battery first, and the earliest of them on
+    a tie. Queued cars do not drive, so their battery level is taken once, when they are queued,
+    and the cars are kept in a binary heap of (battery, arrival, car) entries.
+
+    Attributes:
+        cars (list): The heap of queued cars.
+        clock (int): The current step, as counted by the region.
+        sequence (itertools.count): The arrival counter that breaks ties.
+    """
+    __slots__ = ("sequence",)
+    discipline = "lowest_battery"
+
+    def __init__(self):
+        super().__init__()
+        self.cars = []
+        self.sequence = count()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def __iter__(self):
+        return (car for car, _ in self.items())
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def key(self, car):
+        """
+        Gets the key that orders a car in the queue.
+
+        Args:
+            car (Car): The car being queued.
+
+        Returns:
+            float: The battery percentage of the car.
+        """
+        return car.get_battery_percentage()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def put(self, car, key=None):
+        """
+        Queues a car.
+
+        Args:
+            car (Car): The car to queue.
+            key (float): The key that orders the car, e.g. from a snapshot, or None to compute it.
+        """
+        heapq.heappush(self.cars, (self.key(car) if key is None else key, next(self.sequence), car))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def get(self):
+        """
+        Removes the next car from the queue.
+
+        Returns:
+            Car: The next car.
+        """
+        return heapq.heappop(self.cars)[2]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def peek(self):
+        """
+        Gets the next car without removing it.
+
+        Returns:
+            Car: The next car.
+        """
+        return self.cars[0][2]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def items(self):
+        """
+        Lists the queued cars with their keys, in the order they will be served.
+
+        Returns:
+            list: The (car, key) pairs.
+        """
+        return [(car, key) for key, _, car in sorted(self.cars, key=lambda entry: entry[:2])]
+
+# -------------------------------------------------------------------------------------------------------------
+
+class ReservationQueue(LowestBatteryQueue):
+    """
+    Charging queue of time-slot reservations. The day is split into slots of slot_steps steps and
+    each slot admits as many cars as the region has chargers: a queued car books the earliest
+    slot, from the current one on, that still has room, and it may only take a charger once its
+    slot has started. Cars are served by slot and then by arrival, so when the queue is long a
+    freed charger can stay idle until the next booked slot instead of going to the next car.
+
+    Attributes:
+        cars (list): The heap of (slot, arrival, car) entries.
+        clock (int): The current step, as counted by the region.
+        sequence (itertools.count): The arrival counter that breaks ties.
+        capacity (int): The number of cars admitted per slot.
+        slot_steps (int): The length of a slot in steps.
+        bookings (dict): Maps each current or future slot to the number of cars that booked it.
+    """
+    __slots__ = ("capacity", "slot_steps", "bookings")
+    discipline = "reservation"
+
+    def __init__(self, capacity, slot_steps):
+        super().__init__()
+        self.capacity = max(capacity, 1)
+        self.slot_steps = slot_steps
+        self.bookings = {}
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def key(self, car):
+        """
+        Books the earliest slot with room for a car.
+
+        Args:
+            car (Car): The car being queued.
+
+        Returns:
+            int: The booked slot.
+        """
+        slot = self.clock // self.slot_steps
+        while self.bookings.get(slot, 0) >= self.capacity:
+            slot += 1
+        return slot
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def put(self, car, key=None):
+        """
+        Queues a car in the earliest slot with room for it.
+
+        Args:
+            car (Car): The car to queue.
+            key (int): The slot booked by the car, e.g. from a snapshot, or None to book one.
+        """
+        slot = self.key(car) if key is None else int(key)
+        self.bookings[slot] = self.bookings.get(slot, 0) + 1
+        heapq.heappush(self.cars, (slot, next(self.sequence), car))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def ready(self):
+        """
+        Checks whether the next car may take a charger that is free.
+
+        Returns:
+            bool: True if a car is queued and its slot has started.
+        """
+        return bool(self.cars) and self.cars[0][0] * self.slot_steps <= self.clock
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def advance(self):
+        """
+        Moves the clock of the queue to the next step, forgetting the bookings of past slots.
+        """
+        self.clock += 1
+        if self.clock % self.slot_steps == 0:
+            self.bookings.pop(self.clock // self.slot_steps - 1, None)
+
+# -------------------------------------------------------------------------------------------------------------
+
+def create_queue(config, chargers):
+    """
+    Creates the charging queue of a region for the discipline of a configuration.
+
+    Args:
+        config (SimulationConfig): The configuration of the simulation.
+        chargers (int): The number of chargers of the region.
+
+    Returns:
+        ChargingQueue: The empty queue.
+    """
+    if config.queue_discipline == "lowest_battery":
+        return LowestBatteryQueue()
+    if config.queue_discipline == "reservation":
+        return ReservationQueue(chargers, config.reservation_slot_steps)
+    return ChargingQueue()
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,191 @@
+# -------------------------------------------------------------------------------------------------------------
+
+from bisect import bisect_left
+
+import numpy as np
+
+from reachability import ReachabilityIndex
+
+# -------------------------------------------------------------------------------------------------------------
+
+HOME_TRAFFIC = 30
+
+# -------------------------------------------------------------------------------------------------------------
+
+class DestinationSampler:
+    """
+    Samples the destination of a trip with Walker's alias method. A car travels to one of the
+    regions it can reach, other than the one it is in, weighted by the traffic of each region,
+    with its home region weighted by home_traffic. Those weights only depend on the origin, the
+    home region and how many regions are within the car's autonomy, so an alias table is built
+    the first time each (origin, home, reachable count) is seen and every draw after that takes
+    a single uniform value and constant time. The tables are also kept in flat arrays, so that
+    all the departures of a step can be drawn in one vectorized call.
+
+    Attributes:
+        regions (list): The regions of the simulation.
+        region_index (dict): Maps region IDs to their index in the regions list.
+        reachability (ReachabilityIndex): The regions reachable from each region for a given autonomy.
+        home_traffic (float): The traffic weight of a car's home region.
+        tables (list): The alias tables, as (regions, positions, probability, alias) tuples.
+        table_ids (dict): Maps (origin ID, home ID, reachable count) to the index of its table.
+        sorted_distances (np.ndarray): The ascending distances from each region to every region, by row.
+        keys (np.ndarray): The sorted flat keys of the (origin, home, reachable count) met by sample_many.
+        key_tables (np.ndarray): The table index of each of those keys.
+        flat (tuple): The tables concatenated into numpy arrays for bulk draws, or None until needed.
+    """
+    __slots__ = ("regions", "region_index", "reachability", "home_traffic", "tables", "table_ids", "sorted_distances", "keys", "key_tables", "flat")
+
+    def __init__(self, regions, reachability=None, home_traffic=HOME_TRAFFIC):
+        self.regions = regions
+        self.region_index = {region.id: r for r, region in enumerate(regions)}
+        self.reachability = reachability if reachability is not None else ReachabilityIndex(regions)
+        self.home_traffic = home_traffic
+        self.tables = []
+        self.table_ids = {}
+        self.sorted_distances = np.array([self.reachability.sorted_distances[region.id] for region in regions])
+        self.keys = np.empty(0, dtype=np.int64)
+        self.key_tables = np.empty(0, dtype=np.int64)
+        self.flat = None
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def sample(self, origin, home, autonomy, u):
+        """
+        Draws the destination of a trip.
+
+        Args:
+            origin (Region): The region where the car is.
+            home (Region): The home region of the car.
+            autonomy (float): The autonomy of the car in kilometers.
+            u (float): A uniform value in [0, 1).
+
+        Returns:
+            Region: The destination, or None if no other region is reachable.
+        """
+        count = bisect_left(self.reachability.sorted_distances[origin.id], autonomy)
+        table_id = self.table_ids.get((origin.id, home.id, count))
+        if table_id is None:
+            table_id = self.build(origin.id, home.id, count)
+        regions, _, probability, alias = self.tables[table_id]
+        if not regions:
+            return None
+        x = u * len(regions)
+        i = int(x)
+        return regions[i] if x - i < probability[i] else regions[alias[i]]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def sample_many(self, origins, homes, autonomies, uniforms):
+        """
+        Draws the destination of a batch of trips in one vectorized call.
+
+        Args:
+            origins (np.ndarray): The index of the region where each car is.
+            homes (np.ndarray): The index of the home region of each car.
+            autonomies (np.ndarray): The autonomy of each car in kilometers.
+            uniforms (np.ndarray): One uniform value in [0, 1) per car.
+
+        Returns:
+            np.ndarray: The index of the destination of each car, or -1 if no other region is reachable.
+        """
+        size = len(self.regions)
+        counts = (self.sorted_distances[origins] < autonomies[:, None]).sum(axis=1)
+        keys = (np.asarray(origins, dtype=np.int64) * size + homes) * (size + 1) + counts
+        index = np.searchsorted(self.keys, keys)
+        known = index < len(self.keys)
+        known[known] = self.keys[index[known]] == keys[known]
+        if not known.all():
+            new_keys = np.unique(keys[~known])
+            new_tables = []
+            for key in new_keys.tolist():
+                pair, count = divmod(key, size + 1)
+                origin, home = divmod(pair, size)
+                table_key = (self.regions[origin].id, self.regions[home].id, count)
+                table_id = self.table_ids.get(table_key)
+                new_tables.append(table_id if table_id is not None else self.build(*table_key))
+            order = np.argsort(np.concatenate((self.keys, new_keys)), kind="stable")
+            self.keys = np.concatenate((self.keys, new_keys))[order]
+            self.key_tables = np.concatenate((self.key_tables, np.array(new_tables, dtype=np.int64)))[order]
+            index = np.searchsorted(self.keys, keys)
+        table = self.key_tables[index]
+        if self.flat is None or len(self.flat[0]) != len(self.tables):
+            self.flatten()
+        offsets, sizes, positions, probability, alias = self.flat
+        n = sizes[table]
+        targets = np.full(len(table), -1, dtype=np.int64)
+        rows = np.flatnonzero(n > 0)
+        if len(rows):
+            x = uniforms[rows] * n[rows]
+            i = np.minimum(x.astype(np.int64), n[rows] - 1)
+            j = offsets[table[rows]] + i
+            targets[rows] = positions[np.where(x - i < probability[j], j, alias[j])]
+        return targets
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def build(self, origin_id, home_id, count):
+        """
+        Builds the alias table of an origin, a home region and a number of reachable regions.
+
+        Args:
+            origin_id (str): The ID of the region where the car is.
+            home_id (str): The ID of the home region of the car.
+            count (int): The number of regions closer than the car's autonomy.
+
+        Returns:
+            int: The index of the new table.
+        """
+        origin = self.region_index[origin_id]
+        home = self.region_index[home_id]
+        positions = tuple(p for p in self.reachability.positions((origin_id, count)) if p != origin)
+        weights = [self.home_traffic if p == home else self.regions[p].traffic for p in positions]
+        probability, alias = self.alias_table(weights)
+        self.tables.append((tuple(self.regions[p] for p in positions), positions, probability, alias))
+        table_id = self.table_ids[(origin_id, home_id, count)] = len(self.tables) - 1
+        return table_id
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def flatten(self):
+        """
+        Concatenates the alias tables into the numpy arrays used by sample_many, with the aliases
+        turned into indices of the concatenated arrays.
+        """
+        sizes = np.array([len(table[1]) for table in self.tables], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+        positions = np.array([p for table in self.tables for p in table[1]], dtype=np.int64)
+        probability = np.array([q for table in self.tables for q in table[2]], dtype=np.float64)
+        alias = np.array([offset + a for offset, table in zip(offsets.tolist(), self.tables) for a in table[3]], dtype=np.int64)
+        self.flat = (offsets, sizes, positions, probability, alias)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def alias_table(weights):
+        """
+        Builds a Walker alias table with Vose's method. Outcome i is drawn with probability
+        weights[i] / sum(weights), or uniformly if every weight is zero.
+
+        Args:
+            weights (list): The non-negative weight of each outcome.
+
+        Returns:
+            tuple: The probability of keeping each column and the alias of each column, as lists.
+        """
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights] if total > 0 else [1.0] * n
+        probability = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1]
+        large = [i for i, w in enumerate(scaled) if w >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            probability[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        return probability, alias
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,273 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import heapq
+import itertools
+
+import numpy as np
+
+from simulation import Simulation
+from entities.states import TRAVELING, IDLE, CHARGING, BEFORE_CHARGING, DECIDE_CHARGING, CHARGING_AT_HOME, IN_QUEUE
+
+# -------------------------------------------------------------------------------------------------------------
+
+class EventDrivenSimulation(Simulation):
+    """
+    Headless discrete-event simulation engine. Instead of running every car on every step, each car
+    is woken only when its next transition is due, using a priority queue ordered by step:
+    departures are sampled from the time-of-day idle probabilities, arrivals from the trip length,
+    and charging sessions are resolved in one go when they start. Cars in a queue are woken by the
+    region that dequeues them, and their wait time is derived from the enqueue timestamp. Cars that
+    decide where to charge are assigned together at the end of the step by the charging planner.
+    All the draws of a car come from its own random stream. Region metrics are still sampled on every step, so the region history keeps its shape.
+
+    Battery levels only change on arrival and at the end of a charging session, so the average
+    autonomy of a region moves in jumps rather than increasing during each charging step.
+
+    Attributes:
+        events (list): Heap of (step, sequence, car, payload) entries.
+        sequence (itertools.count): Tie-breaker that keeps same-step events in scheduling order.
+        labels (list): The time of day label of each step of a day.
+        idle_chances (np.ndarray): The chance of staying idle at each step of a day.
+        band_end (list): For each step of a day, the first step where the time of day label changes.
+        enqueued_at (dict): The step at which each queued car entered the queue.
+        started (bool): Whether the initial events have been scheduled.
+    """
+    engine = "event"
+
+    def __init__(self, cars, regions, config):
+        super().__init__(cars, regions, config, headless=True)
+        self.events = []
+        self.sequence = itertools.count()
+        self.labels = [self.getTimeOfDay(step) for step in range(self.steps_per_day)]
+        self.band_end = [0] * self.steps_per_day
+        end = self.steps_per_day
+        for step in reversed(range(self.steps_per_day)):
+            if step + 1 < self.steps_per_day and self.labels[step + 1] != self.labels[step]:
+                end = step + 1
+            self.band_end[step] = end
+        self.enqueued_at = {}
+        self.started = False
+        self.autonomy_tolerance = config.autonomy_tolerance
+        self.probability_of_charging = config.probability_of_charging
+        self.probability_of_charging_at_home = config.probability_of_charging_at_home
+        self.charging_per_step = config.charging_per_step
+        self.charging_per_step_home = config.charging_per_step_home
+        self.idle_probabilities = config.idle_probabilities
+        self.idle_chances = np.array([self.idle_probabilities.get(label, self.idle_probabilities["default"]) for label in self.labels])
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def run_step(self, step):
+        """
+        Processes the events due at the given step and samples the region metrics.
+
+        Args:
+            step (int): The current step number of the simulation.
+        """
+        if not self.started:
+            self.started = True
+            for car in self.cars:
+                self.schedule(car, step - 1)
+        while self.events and self.events[0][0] <= step:
+            _, _, car, payload = heapq.heappop(self.events)
+            self.handle(car, step, payload)
+        for car in self.planner.assign():
+            self.schedule(car, step)
+        for region in self.regions:
+            self.dispatch(region, step)
+            region.run()
+        self.history.record(step)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def push(self, step, car, payload=None):
+        """
+        Adds an event to the event queue.
+
+        Args:
+            step (int): The step at which the car must be woken.
+            car (Car): The car to wake.
+            payload: Extra information needed to handle the event.
+        """
+        heapq.heappush(self.events, (step, next(self.sequence), car, payload))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def schedule(self, car, step):
+        """
+        Schedules the next transition of a car that entered its current state at the given step.
+
+        Args:
+            car (Car): The car to schedule.
+            step (int): The step at which the car entered its current state.
+        """
+        if car.state == IDLE:
+            if car.get_battery_percentage() < self.autonomy_tolerance:
+                if self.probability_of_charging > 0:
+                    self.push(step + car.geometric(self.probability_of_charging), car, "charge")
+            else:
+                departure = self.sample_departure(car, step + 1)
+                if departure is not None:
+                    self.push(departure, car, "travel")
+        elif car.state == TRAVELING:
+            if car.stepsToTravel == 0:
+                car.traveling()
+            self.push(step + 1 + car.stepsToTravel - car.currentTripSteps, car)
+        elif car.state == IN_QUEUE:
+            self.enqueued_at[car] = step - car.wait_time
+        elif car.state in (DECIDE_CHARGING, BEFORE_CHARGING):
+            self.push(step + 1, car)
+        elif car.state in (CHARGING, CHARGING_AT_HOME):
+            self.push(*self.simulate_charging(car, step, car.state == CHARGING_AT_HOME))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def sample_departure(self, car, start):
+        """
+        Samples the step at which an idle car starts a trip, walking through the time of day bands.
+        Within a band the number of steps until departure is geometric; sampling restarts at the
+        band boundary, which is exact because the process is memoryless.
+
+        Args:
+            car (Car): The idle car.
+            start (int): The first step at which the car may depart.
+
+        Returns:
+            int: The departure step, or None if the car never departs.
+        """
+        if all(chance >= 1 for chance in self.idle_probabilities.values()):
+            return None
+        step = start
+        while True:
+            offset = step % self.steps_per_day
+            end = step - offset + self.band_end[offset]
+            chance = 1 - self.idle_chances[offset]
+            if chance > 0:
+                departure = step + car.geometric(chance) - 1
+                if departure < end:
+                    return departure
+            step = end
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def simulate_charging(self, car, step, at_home):
+        """
+        Resolves a whole charging session at once, following the per-step rules of Car.charging.
+
+        Args:
+            car (Car): The car that started charging.
+            step (int): The step at which the car started charging.
+            at_home (bool): Whether the car is charging at home.
+
+        Returns:
+            tuple: The step at which the session ends, the car and the session outcome
+                   (outcome, final autonomy, charging time, stop at home flag).
+        """
+        rate = self.charging_per_step_home if at_home else self.charging_per_step
+        remaining = max(car.full_autonomy - car.autonomy, 0)
+        increments = int(np.ceil(remaining / rate)) if remaining > 0 else 0
+        autonomy = car.autonomy + rate * np.arange(1, increments + 1)
+        battery = autonomy / car.full_autonomy * 100
+        draws = car.randoms(increments)
+        end = increments
+        outcome = ("full", car.full_autonomy, car.charging_time + increments, car.stop_charging_at_home)
+        if not at_home:
+            stops = np.flatnonzero(draws < np.where(battery < 50, 0, (battery - 50) / 1000))
+            if len(stops):
+                end = stops[0]
+                outcome = ("stop", autonomy[end], car.charging_time + end + 1, car.stop_charging_at_home)
+        else:
+            first = 0
+            if not car.stop_charging_at_home:
+                flags = np.flatnonzero(draws < np.where(battery < 30, 0, (battery - 30) / 100))
+                first = flags[0] + 1 if len(flags) else increments
+                if len(flags):
+                    outcome = outcome[:3] + (True,)
+            steps = (step + 1 + np.arange(first, increments)) % self.steps_per_day
+            leaves = np.flatnonzero(draws[first:] < self.idle_chances[steps])
+            if len(leaves):
+                end = first + leaves[0]
+                outcome = ("leave", autonomy[end], car.charging_time + end + 1, False)
+        return step + 1 + end, car, outcome
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def handle(self, car, step, payload):
+        """
+        Applies the transition of a car whose event is due and schedules its next one
+        (cars deciding where to charge are scheduled once the planner has assigned them).
+
+        Args:
+            car (Car): The car to wake.
+            step (int): The current step.
+            payload: The information stored with the event.
+        """
+        if car.state == IDLE:
+            if payload == "charge":
+                if car.current_region == car.home_region and car.random() < self.probability_of_charging_at_home:
+                    car.state = CHARGING_AT_HOME
+                    car.home_region.cars_home_charging += 1
+                else:
+                    car.state = DECIDE_CHARGING
+            else:
+                car.consider_traveling()
+        elif car.state == TRAVELING:
+            car.currentTripSteps = car.stepsToTravel - 1
+            car.traveling()
+        elif car.state == DECIDE_CHARGING:
+            self.planner.request(car)
+            return
+        elif car.state == BEFORE_CHARGING:
+            car.before_charging()
+        elif car.state in (CHARGING, CHARGING_AT_HOME):
+            self.finish_charging(car, step, payload)
+        self.schedule(car, step)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def finish_charging(self, car, step, outcome):
+        """
+        Ends a charging session, releasing the charger and waking the next car in the queue.
+
+        Args:
+            car (Car): The car that finished charging.
+            step (int): The current step.
+            outcome (tuple): The session outcome computed by simulate_charging.
+        """
+        kind, autonomy, charging_time, stop_at_home = outcome
+        at_home = car.state == CHARGING_AT_HOME
+        car.home_region.total_autonomy += (autonomy - car.autonomy) / car.full_autonomy * 100
+        car.autonomy = autonomy
+        car.stop_charging_at_home = stop_at_home
+        region = car.current_region
+        next_car = None
+        if not at_home and region.queue.ready():
+            next_car = region.queue.peek()
+            next_car.wait_time = step - self.enqueued_at.pop(next_car)
+        car.state = IDLE
+        region.stop_charging(charging_time, at_home, car.station)
+        car.charging_time = 0
+        car.station = None
+        if kind == "leave":
+            car.consider_traveling()
+        if next_car is not None:
+            self.schedule(next_car, step)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def dispatch(self, region, step):
+        """
+        Starts charging the queued cars of a region whose turn has come while chargers are free,
+        as Region.run would, after setting their wait time.
+
+        Args:
+            region (Region): The region.
+            step (int): The current step.
+        """
+        while region.available_chargers > 0 and region.queue.ready():
+            car = region.queue.peek()
+            car.wait_time = step - self.enqueued_at.pop(car)
+            region.dispatch()
+            self.schedule(car, step)
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,337 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+from simulation import Simulation
+from random_streams import RandomStreams
+from destination_sampler import DestinationSampler
+from entities.states import IDLE, TRAVELING, DECIDE_CHARGING, BEFORE_CHARGING, IN_QUEUE, CHARGING, CHARGING_AT_HOME
+
+# -------------------------------------------------------------------------------------------------------------
+
+# draw slots of the counter-based car streams within a step
+IDLE_SLOT = 0
+HOME_CHARGING_SLOT = 1
+TRAVEL_SLOT = 2
+CHARGING_SLOT = 3
+CHARGING_AT_HOME_SLOT = 4
+
+# -------------------------------------------------------------------------------------------------------------
+
+class QueuedCar:
+    """
+    Lightweight handle that lets a region queue hold a car of a vectorized fleet.
+
+    Attributes:
+        simulation (VectorizedSimulation): The simulation that owns the fleet.
+        index (int): The index of the car in the fleet.
+        station (Station): The station given to the car by the region. The fleet does not keep it,
+            so the region frees a charging point of its first busy station when the car stops.
+    """
+    __slots__ = ("simulation", "index", "station")
+
+    def __init__(self, simulation, index):
+        self.simulation = simulation
+        self.index = index
+        self.station = None
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def exit_queue(self):
+        """
+        Handles the logic for a car exiting the queue.
+        """
+        self.simulation.exit_queue(self.index)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def get_battery_percentage(self):
+        """
+        Gets the battery percentage of the car, used by the lowest battery first queues.
+
+        Returns:
+            float: The battery percentage of the car.
+        """
+        fleet = self.simulation.fleet
+        return float(fleet.autonomy[self.index] / fleet.full_autonomy[self.index] * 100)
+
+# -------------------------------------------------------------------------------------------------------------
+
+class VectorizedSimulation(Simulation):
+    """
+    Headless simulation engine that advances a structure-of-arrays Fleet instead of Car objects.
+    The state machine follows entities/car.py, but every state is processed as one batched
+    operation per step. Cars are grouped by the state they had at the start of the step, so
+    a car never runs two states in the same step. Random draws come from counter-based streams
+    keyed by car, so results do not depend on how the fleet is batched.
+
+    Attributes:
+        fleet (Fleet): The fleet of cars participating in the simulation.
+        step (int): The step being executed.
+        trip_distance (np.ndarray): Matrix of travelled distances between regions.
+        trip_steps (np.ndarray): Matrix of steps needed to travel between regions.
+        destinations (DestinationSampler): The alias tables used to draw the destination of trips.
+    """
+    engine = "vectorized"
+
+    def __init__(self, fleet, regions, config):
+        super().__init__([], regions, config, headless=True)
+        self.fleet = fleet
+        self.step = 0
+        self.destinations = DestinationSampler(regions, self.planner.reachability)
+        self.autonomy_tolerance = config.autonomy_tolerance
+        self.probability_of_charging = config.probability_of_charging
+        self.probability_of_charging_at_home = config.probability_of_charging_at_home
+        self.charging_per_step = config.charging_per_step
+        self.charging_per_step_home = config.charging_per_step_home
+        self.idle_probabilities = config.idle_probabilities
+        self.trip_distance, self.trip_steps = self.compute_trips()
+
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def compute_trips(self):
+        """
+        Gathers the distance and number of steps of a trip between every pair of regions from the
+        router, which uses the same movement model as Car.traveling.
+
+        Returns:
+            tuple: The trip distance matrix and the trip steps matrix.
+        """
+        size = len(self.regions)
+        distance = np.zeros((size, size))
+        steps = np.zeros((size, size), dtype=np.int32)
+        for i, origin in enumerate(self.regions):
+            for j, destination in enumerate(self.regions):
+                if i != j and (origin.id, destination.id) in self.router.trips:
+                    distance[i, j], steps[i, j] = self.router.trip(origin, destination)
+        return distance, steps
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def run_step(self, step):
+        """
+        Executes a single simulation step.
+
+        Args:
+            step (int): The current step number of the simulation.
+        """
+        self.step = step
+        state = self.fleet.state.copy()
+        self.charging(np.flatnonzero(state == CHARGING))
+        self.charging_at_home(np.flatnonzero(state == CHARGING_AT_HOME))
+        self.before_charging(np.flatnonzero(state == BEFORE_CHARGING))
+        self.decide_charging(np.flatnonzero(state == DECIDE_CHARGING))
+        self.idle(np.flatnonzero(state == IDLE))
+        self.traveling(np.flatnonzero(state == TRAVELING))
+        self.fleet.wait_time[(state == IN_QUEUE) & (self.fleet.state == IN_QUEUE)] += 1
+        if self.history.due(step):
+            totals = np.bincount(self.fleet.home, weights=self.fleet.get_battery_percentage(), minlength=len(self.regions))
+            for region, total in zip(self.regions, totals.tolist()):
+                region.total_autonomy = total
+        for region in self.regions:
+            region.run()
+        self.history.record(step)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def draw(self, cars, slot):
+        """
+        Draws one uniform value per car from the car streams, for the current step.
+
+        Args:
+            cars (np.ndarray): The indices of the cars.
+            slot (int): The draw slot within the step.
+
+        Returns:
+            np.ndarray: One uniform value in [0, 1) per car.
+        """
+        return RandomStreams.uniforms(self.fleet.key[cars], self.step, slot)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def idle(self, cars):
+        """
+        Idle cars with low battery consider charging, the others may start a trip.
+
+        Args:
+            cars (np.ndarray): The indices of the idle cars.
+        """
+        fleet = self.fleet
+        battery = fleet.get_battery_percentage()[cars]
+        draws = (self.draw(cars, IDLE_SLOT), self.draw(cars, HOME_CHARGING_SLOT))
+        low = battery < self.autonomy_tolerance
+        idle_chance = self.idle_probabilities.get(self.time_of_day, self.idle_probabilities["default"])
+        wants_charging = low & (draws[0] < self.probability_of_charging)
+        charging = cars[wants_charging]
+        at_home = (fleet.current[charging] == fleet.home[charging]) & (draws[1][wants_charging] < self.probability_of_charging_at_home)
+        fleet.state[charging[at_home]] = CHARGING_AT_HOME
+        fleet.state[charging[~at_home]] = DECIDE_CHARGING
+        for r, count in enumerate(np.bincount(fleet.home[charging[at_home]], minlength=len(self.regions))):
+            self.regions[r].cars_home_charging += int(count)
+        self.consider_traveling(cars[~low & (draws[0] >= idle_chance)])
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def consider_traveling(self, cars):
+        """
+        Picks the next region of each car, weighted by traffic among the reachable regions other than
+        the current one, with one bulk draw from the alias tables. Cars with no valid region are sent
+        to charge where they are.
+
+        Args:
+            cars (np.ndarray): The indices of the cars about to travel.
+        """
+        if len(cars) == 0:
+            return
+        fleet = self.fleet
+        targets = self.destinations.sample_many(fleet.current[cars], fleet.home[cars], fleet.autonomy[cars], self.draw(cars, TRAVEL_SLOT))
+        stuck = targets < 0
+        fleet.state[cars[stuck]] = BEFORE_CHARGING
+        moving = cars[~stuck]
+        fleet.next[moving] = targets[~stuck]
+        fleet.state[moving] = TRAVELING
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def traveling(self, cars):
+        """
+        Starts the trip of cars that have just departed and moves the others one step closer,
+        handling the arrival of the cars that reach their destination.
+
+        Args:
+            cars (np.ndarray): The indices of the travelling cars.
+        """
+        fleet = self.fleet
+        started = fleet.steps_to_travel[cars] != 0
+        starting, moving = cars[~started], cars[started]
+        origin, destination = fleet.current[starting], fleet.next[starting]
+        fleet.steps_to_travel[starting] = self.trip_steps[origin, destination]
+        fleet.trip_distance[starting] = self.trip_distance[origin, destination]
+        fleet.trip_steps[moving] += 1
+        arrived = moving[fleet.trip_steps[moving] >= fleet.steps_to_travel[moving]]
+        if len(arrived) == 0:
+            return
+        size = len(self.regions)
+        leaving = np.bincount(fleet.current[arrived], minlength=size)
+        entering = np.bincount(fleet.next[arrived], minlength=size)
+        for region, left, entered in zip(self.regions, leaving, entering):
+            region.cars_present += int(entered - left)
+        fleet.current[arrived] = fleet.next[arrived]
+        fleet.next[arrived] = -1
+        fleet.autonomy[arrived] -= fleet.trip_distance[arrived]
+        charge = fleet.charge_at_destination[arrived]
+        fleet.state[arrived] = np.where(charge, BEFORE_CHARGING, IDLE)
+        fleet.charge_at_destination[arrived] = False
+        fleet.steps_to_travel[arrived] = 0
+        fleet.trip_steps[arrived] = 0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def decide_charging(self, cars):
+        """
+        Sends each car to a reachable region with the best charging score, using the charging
+        planner so that the cars of the batch account for the chargers claimed by the others.
+
+        Args:
+            cars (np.ndarray): The indices of the cars deciding where to charge.
+        """
+        if len(cars) == 0:
+            return
+        fleet = self.fleet
+        current = fleet.current[cars]
+        targets = np.array(self.planner.plan(current.tolist(), fleet.autonomy[cars].tolist()), dtype=np.int32)
+        decided = targets >= 0
+        cars, targets, current = cars[decided], targets[decided], current[decided]
+        here = targets == current
+        fleet.state[cars[here]] = BEFORE_CHARGING
+        away = cars[~here]
+        fleet.charge_at_destination[away] = True
+        fleet.next[away] = targets[~here]
+        fleet.state[away] = TRAVELING
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def before_charging(self, cars):
+        """
+        Attempt to start charging each car in its current region, queueing it otherwise.
+
+        Args:
+            cars (np.ndarray): The indices of the cars about to charge.
+        """
+        for i in cars.tolist():
+            if self.regions[self.fleet.current[i]].start_charging(QueuedCar(self, i)):
+                self.exit_queue(i)
+            else:
+                self.fleet.state[i] = IN_QUEUE
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def exit_queue(self, i):
+        """
+        Handles the logic for a car exiting the queue.
+
+        Args:
+            i (int): The index of the car in the fleet.
+        """
+        self.regions[self.fleet.current[i]].update_wait_time(int(self.fleet.wait_time[i]))
+        self.fleet.wait_time[i] = 0
+        self.fleet.state[i] = CHARGING
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def charging(self, cars):
+        """
+        Charges the cars at public chargers, releasing the ones that are full or decide to stop.
+
+        Args:
+            cars (np.ndarray): The indices of the cars charging at public chargers.
+        """
+        fleet = self.fleet
+        full = fleet.autonomy[cars] >= fleet.full_autonomy[cars]
+        fleet.autonomy[cars[full]] = fleet.full_autonomy[cars[full]]
+        charging = cars[~full]
+        fleet.autonomy[charging] += self.charging_per_step
+        fleet.charging_time[charging] += 1
+        battery = fleet.get_battery_percentage()[charging]
+        probability = np.where(battery < 50, 0, (battery - 50) / 1000)
+        stopping = charging[self.draw(charging, CHARGING_SLOT) < probability]
+        for i in np.sort(np.concatenate((cars[full], stopping))).tolist():
+            fleet.state[i] = IDLE
+            self.regions[fleet.current[i]].stop_charging(int(fleet.charging_time[i]), False)
+            fleet.charging_time[i] = 0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def charging_at_home(self, cars):
+        """
+        Charges the cars at home. Once a car decides to stop, it leaves according to the idle probability
+        of the time of day and immediately considers travelling.
+
+        Args:
+            cars (np.ndarray): The indices of the cars charging at home.
+        """
+        fleet = self.fleet
+        full = fleet.autonomy[cars] >= fleet.full_autonomy[cars]
+        fleet.autonomy[cars[full]] = fleet.full_autonomy[cars[full]]
+        charging = cars[~full]
+        fleet.autonomy[charging] += self.charging_per_step_home
+        fleet.charging_time[charging] += 1
+        battery = fleet.get_battery_percentage()[charging]
+        draws = self.draw(charging, CHARGING_AT_HOME_SLOT)
+        flagged = fleet.stop_charging_at_home[charging]
+        probability = np.where(battery < 30, 0, (battery - 30) / 100)
+        fleet.stop_charging_at_home[charging[~flagged & (draws < probability)]] = True
+        idle_chance = self.idle_probabilities.get(self.time_of_day, self.idle_probabilities["default"])
+        leaving = charging[flagged & (draws < idle_chance)]
+        for i in cars[full].tolist():
+            fleet.state[i] = IDLE
+            self.regions[fleet.current[i]].stop_charging(int(fleet.charging_time[i]), True)
+            fleet.charging_time[i] = 0
+        for i in leaving.tolist():
+            self.regions[fleet.current[i]].stop_charging(int(fleet.charging_time[i]), True)
+            fleet.charging_time[i] = 0
+        fleet.stop_charging_at_home[leaving] = False
+        self.consider_traveling(leaving)
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
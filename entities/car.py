@@ -1,38 +1,59 @@
 # -------------------------------------------------------------------------------------------------------------
 
-import random
-import os
+from math import ceil, log1p
 
-from math import sin, cos, radians, ceil
+import numpy as np
 
-from utils import haversine_distance, calculate_angle, region_distances
 from logs.log import Logger
-from dotenv import load_dotenv
+from random_streams import RandomStreams, GOLDEN_GAMMA, MASK_64
+from reachability import ReachabilityIndex
+from routing import Router
+from destination_sampler import DestinationSampler
+from entities.states import IDLE, TRAVELING, DECIDE_CHARGING, BEFORE_CHARGING, IN_QUEUE, CHARGING, CHARGING_AT_HOME, STATE_NAMES
 
 # -------------------------------------------------------------------------------------------------------------
 
-os.environ.clear()
-load_dotenv()
+class FleetParameters:
+    """
+    Parameters and objects shared by all the cars of a simulation, so that each car only
+    holds a reference to them instead of its own copies.
 
-TRAVELING = "[Traveling]"
-IDLE = "[Idle]"
-CHARGING = "[Charging]"
-BEFORE_CHARGING = "[BeforeCharging]"
-DECIDE_CHARGING = "[DecideCharging]"
-CHARGING_AT_HOME = "[ChargingAtHome]"
-IN_QUEUE = "[InQueue]"
+    Attributes:
+        regions (list): List of all regions in the simulation.
+        config (SimulationConfig): The configuration of the simulation.
+        idle_probabilities (dict): Probabilities of a car staying idle at different times of the day.
+        logger (Logger): Logger instance for logging car activities.
+        router (Router): The routes, distances and trip lengths between regions.
+        reachability (ReachabilityIndex): The regions reachable from each region for a given autonomy.
+        destinations (DestinationSampler): The alias tables used to draw the destination of trips.
+        planner (ChargingPlanner): The planner that batches the charging decisions of the cars, or None
+            for each car to decide on its own.
+    """
+    __slots__ = ("regions", "config", "idle_probabilities", "logger", "router", "reachability", "destinations", "planner")
+
+    def __init__(self, regions, config):
+        self.regions = regions
+        self.config = config
+        self.idle_probabilities = config.idle_probabilities
+        self.logger = Logger(filename="cars", category="cars")
+        self.router = Router(regions, config)
+        self.reachability = ReachabilityIndex(regions, self.router.distances)
+        self.destinations = DestinationSampler(regions, self.reachability)
+        self.planner = None
 
 # -------------------------------------------------------------------------------------------------------------
 
 class Car:
     """
-    Represents a car in the simulation.
+    Represents a car in the simulation. Cars use __slots__ and keep the parameters they share
+    with the rest of the fleet in a single FleetParameters object, so that large fleets stay compact.
+    Every change of autonomy is also applied to the battery total of the car's home region, which
+    keeps the average battery of the region up to date without visiting every car on every step.
 
     Attributes:
         id (int): Unique identifier for the car.
         full_autonomy (float): The maximum autonomy of the car in kilometers.
         autonomy (float): The current autonomy of the car in kilometers.
-        velocity (float): The velocity of the car in kilometers per step.
         current_region (Region): The current region where the car is located.
         home_region (Region): The home region of the car.
         latitude (float): The current latitude of the car.
@@ -40,59 +61,148 @@ class Car:
         distance_travelled (float): The total distance travelled by the car.
         wait_time (int): The time the car has spent waiting.
         charging_time (int): The time the car has spent charging.
-        regions (list): List of all regions in the simulation.
         next_region (Region): The next region the car will travel to.
         charge_at_destination (bool): Whether the car will charge at the destination.
+        station (Station): The station where the car charges or is heading to charge, or None.
         stuck_at_region (bool): Whether the car is stuck at a region.
-        state (str): The current state of the car.
-        idle_probabilities (dict): Probabilities of the car staying idle at different times of the day.
+        state (int): The current state code of the car (see entities/states.py).
         displayed (bool): Whether the car is displayed in the simulation.
         stepsToTravel (int): The number of steps required to travel to the next region.
         currentTripSteps (int): The number of steps taken in the current trip.
         distanceToTravel (float): The distance to travel to the next region.
-        logger (Logger): Logger instance for logging car activities.
-        availabilityWeigh (float): Weight for availability in the decision-making process.
-        distanceWeight (float): Weight for distance in the decision-making process.
-        queueWeigh (float): Weight for queue size in the decision-making process.
         stop_charging_at_home (bool): Whether the car should stop charging at home.
+        key (int): The key of the car's own random stream.
+        draws (int): The number of values drawn so far from the car's random stream.
+        fleet (FleetParameters): The parameters shared by all the cars.
     """
-    def __init__(self, id, autonomy, velocity, current_region, regions):
+    __slots__ = (
+        "id", "key", "draws", "full_autonomy", "autonomy", "current_region", "home_region", "latitude", "longitude",
+        "distance_travelled", "wait_time", "charging_time", "next_region", "charge_at_destination", "station",
+        "stuck_at_region", "state", "displayed", "stepsToTravel", "currentTripSteps", "distanceToTravel",
+        "stop_charging_at_home", "fleet"
+    )
+
+    def __init__(self, id, autonomy, current_region, fleet, key=None, initial_autonomy=None):
         self.id = id
+        self.key = int(key) if key is not None else RandomStreams().key("car", id)
+        self.draws = 0
+        self.fleet = fleet
         self.full_autonomy = autonomy
-        self.autonomy = autonomy * random.uniform(0.5, 1.0)
-        self.velocity = velocity / (int(os.getenv("STEPS_PER_DAY")) / 24) # km/step
+        if initial_autonomy is None:
+            initial_autonomy = autonomy * (0.5 + 0.5 * RandomStreams.uniforms(np.uint64(self.key), -1, 0).item())
+        self.autonomy = initial_autonomy
         self.current_region = current_region
         self.current_region.cars_present += 1
+        self.current_region.total_autonomy += self.autonomy / autonomy * 100
         self.home_region = current_region
         self.latitude = current_region.latitude
         self.longitude = current_region.longitude
         self.distance_travelled = 0
         self.wait_time = 0
         self.charging_time = 0
-        self.regions = regions
         self.next_region = None
         self.charge_at_destination = False
+        self.station = None
         self.stuck_at_region = False
         self.state = IDLE
-        self.idle_probabilities = {
-            "rush_hour": float(os.getenv("CHANCE_OF_STAYING_IDLE_RUSH_HOUR")),
-            "lunch_time": float(os.getenv("CHANCE_OF_STAYING_IDLE_LUNCH_TIME")),
-            "night_time": float(os.getenv("CHANCE_OF_STAYING_IDLE_NIGHT_TIME")),
-            "dawn_time": float(os.getenv("CHANCE_OF_STAYING_IDLE_DAWN_TIME")),
-            "default": float(os.getenv("CHANCE_OF_STAYING_IDLE"))
-        }
         self.displayed = False
         self.stepsToTravel = 0
         self.currentTripSteps = 0
         self.distanceToTravel = 0
-        self.logger = Logger(filename="cars")
-        self.availabilityWeigh = float(os.getenv("AVAILABILITY_WEIGHT"))
-        self.distanceWeight = float(os.getenv("DISTANCE_WEIGHT"))
-        self.queueWeigh = float(os.getenv("QUEUE_WEIGHT"))
         self.stop_charging_at_home = False
         
     # ---------------------------------------------------------------------------------------------------------
 
+    @classmethod
+    def restore(cls, fleet, id, key, draws, state, home_region, current_region, next_region, full_autonomy, autonomy,
+                latitude, longitude, distance_travelled, distanceToTravel, wait_time, charging_time, stepsToTravel,
+                currentTripSteps, charge_at_destination, stuck_at_region, displayed, stop_charging_at_home):
+        """
+        Rebuilds a saved car from its fields, e.g. from a snapshot. Unlike the constructor, it leaves
+        the counters of the regions alone, since they are restored with the regions, and the car
+        starts without a station.
+
+        Returns:
+            Car: The restored car.
+        """
+        car = cls.__new__(cls)
+        car.id = id
+        car.key = key
+        car.draws = draws
+        car.fleet = fleet
+        car.full_autonomy = full_autonomy
+        car.autonomy = autonomy
+        car.current_region = current_region
+        car.home_region = home_region
+        car.latitude = latitude
+        car.longitude = longitude
+        car.distance_travelled = distance_travelled
+        car.wait_time = wait_time
+        car.charging_time = charging_time
+        car.next_region = next_region
+        car.charge_at_destination = charge_at_destination
+        car.station = None
+        car.stuck_at_region = stuck_at_region
+        car.state = state
+        car.displayed = displayed
+        car.stepsToTravel = stepsToTravel
+        car.currentTripSteps = currentTripSteps
+        car.distanceToTravel = distanceToTravel
+        car.stop_charging_at_home = stop_charging_at_home
+        return car
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def random(self):
+        """
+        Draws the next value of the car's random stream, the same value as RandomStreams.draws but
+        mixed on plain integers, since the object engine draws one value at a time.
+
+        Returns:
+            float: A uniform value in [0, 1).
+        """
+        self.draws += 1
+        x = (self.key + self.draws * GOLDEN_GAMMA) & MASK_64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+        return ((x ^ (x >> 31)) >> 11) * (1.0 / (1 << 53))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def randoms(self, count):
+        """
+        Draws the next values of the car's random stream at once.
+
+        Args:
+            count (int): The number of values to draw.
+
+        Returns:
+            np.ndarray: The uniform values in [0, 1).
+        """
+        values = RandomStreams.draws(self.key, self.draws, count)
+        self.draws += count
+        return values
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def geometric(self, probability):
+        """
+        Draws the number of trials up to the first success, each trial succeeding with the given
+        probability, by inverting the geometric distribution on one value of the car's stream.
+
+        Args:
+            probability (float): The probability of success of each trial, in (0, 1].
+
+        Returns:
+            int: The number of trials, at least 1.
+        """
+        value = self.random()
+        if probability >= 1:
+            return 1
+        return max(1, ceil(log1p(-value) / log1p(-probability)))
+
+    # ---------------------------------------------------------------------------------------------------------
+
     def get_battery_percentage(self):
         """
         Calculate the battery percentage of the car.
@@ -120,9 +230,9 @@ class Car:
         Determines the regions that are reachable from the current region based on the car's autonomy.
 
         Returns:
-            list: A list of regions that are within the car's autonomy range from the current region.
+            tuple: The regions that are within the car's autonomy range from the current region, in their original order.
         """
-        return [region for region in self.regions if region_distances[self.current_region.id][region.id] < self.autonomy]
+        return self.fleet.reachability.reachable(self.current_region, self.autonomy)
     
     # ---------------------------------------------------------------------------------------------------------
 
@@ -131,32 +241,12 @@ class Car:
         Selects the next region for the car to move to from the list of reachable regions, 
         excluding the current region. If no valid regions are available, returns None. 
         The selection is weighted by the traffic in each region, with the home region 
-        having a fixed traffic weight of 30.
+        having a fixed traffic weight of 30, and drawn from the fleet's alias tables.
 
         Returns:
             Region: The next region to move to, or None if no valid regions are available.
         """
-        valid_regions = [region for region in self.reachable_regions() if region != self.current_region]
-        if not valid_regions:
-            return None
-        traffic = [region.traffic if region != self.home_region else 30 for region in valid_regions]
-        return random.choices(valid_regions, weights=traffic, k=1)[0]
-    
-    # ---------------------------------------------------------------------------------------------------------
-
-    def next_pos(self, angle):
-        """
-        Calculate the next position of the car based on the given angle.
-
-        Args:
-            angle (float): The angle in radians at which the car is moving.
-
-        Returns:
-            tuple: A tuple containing the new latitude and longitude of the car.
-        """
-        new_latitude = self.latitude + self.velocity * sin(angle) / 111.2
-        new_longitude = self.longitude + self.velocity * cos(angle) / (111.2 * cos(radians(self.latitude)))
-        return new_latitude, new_longitude
+        return self.fleet.destinations.sample(self.current_region, self.home_region, self.autonomy, self.random())
     
     # ---------------------------------------------------------------------------------------------------------
 
@@ -167,11 +257,12 @@ class Car:
         Args:
             time_of_day (str): The current time of day, used to determine idle probabilities.
         """
-        battery_threshold = float(os.getenv("AUTONOMY_TOLERANCE"))
-        idle_chance = self.idle_probabilities.get(time_of_day, self.idle_probabilities["default"])
+        battery_threshold = self.fleet.config.autonomy_tolerance
+        idle_probabilities = self.fleet.idle_probabilities
+        idle_chance = idle_probabilities.get(time_of_day, idle_probabilities["default"])
         if self.get_battery_percentage() < battery_threshold:
             self.consider_charging()
-        elif random.random() >= idle_chance:
+        elif self.random() >= idle_chance:
             self.consider_traveling()
 
     # ---------------------------------------------------------------------------------------------------------
@@ -180,8 +271,9 @@ class Car:
         """
         Determine whether the car should start charging based on random probabilities and its current region.
         """
-        if random.random() < float(os.getenv("PROBABILITY_OF_CHARGING")):
-            if self.current_region == self.home_region and random.random() < float(os.getenv("PROBABILITY_OF_CHARGING_AT_HOME")):
+        config = self.fleet.config
+        if self.random() < config.probability_of_charging:
+            if self.current_region == self.home_region and self.random() < config.probability_of_charging_at_home:
                 self.state = CHARGING_AT_HOME
                 self.home_region.cars_home_charging += 1
             else:
@@ -198,67 +290,34 @@ class Car:
             self.next_region = next_region
             self.state = TRAVELING
         else:
-            self.stuckAtRegion = True
+            self.stuck_at_region = True
             self.state = BEFORE_CHARGING
                     
     # ---------------------------------------------------------------------------------------------------------
                         
     def traveling(self):
         """
-        Handles the movement of the car towards its next destination.
-
-        If the car is displayed, it calculates the angle and the next position,
-        then updates the car's latitude and longitude based on the calculated
-        future movement. It also updates the car's autonomy and distance travelled.
-        If the car reaches its destination, it updates the state accordingly.
-
-        If the car is not displayed and stepsToTravel is 0, it calculates the
-        distance to travel and the number of steps required to reach the destination.
-
-        If the car is not displayed and stepsToTravel is greater than 0, it updates
-        the current trip steps and checks if the car has reached its destination.
-        If the destination is reached, it updates the car's latitude, longitude,
-        autonomy, distance travelled, and state accordingly.
-        """
-        if(self.displayed):
-            angle = calculate_angle(
-                (self.latitude, self.longitude), (self.next_region.latitude, self.next_region.longitude))
-            next_lat, next_long = self.next_pos(angle)
-            future_movement = haversine_distance(
-                self.latitude, self.longitude, next_lat, next_long)
-            distance = haversine_distance(
-                self.latitude, self.longitude, self.next_region.latitude, self.next_region.longitude)
-            if future_movement >= distance:
-                self.latitude = self.next_region.latitude
-                self.longitude = self.next_region.longitude
-                self.autonomy -= distance
-                self.distance_travelled += distance
-                self.arrived_at_destination()
-                if self.charge_at_destination:
-                    self.charge_at_destination = False
-                    self.state = BEFORE_CHARGING
-                else:
-                    self.state = IDLE
-            else:
-                self.latitude = next_lat
-                self.longitude = next_long
-                self.autonomy -= future_movement
-                self.distance_travelled += future_movement
-        elif (self.stepsToTravel == 0):
-            angle = calculate_angle(
-                (self.latitude, self.longitude), (self.next_region.latitude, self.next_region.longitude))
-            next_lat, next_long = self.next_pos(angle)
-            future_movement = haversine_distance(
-                self.latitude, self.longitude, next_lat, next_long)
-            self.distanceToTravel = haversine_distance(
-                self.latitude, self.longitude, self.next_region.latitude, self.next_region.longitude)
-            self.stepsToTravel = ceil(self.distanceToTravel / future_movement)
+        Handles the movement of the car towards its next destination, along the route
+        given by the fleet's router. Displayed cars follow the same path: their position
+        during the trip is interpolated from the trip progress only when a frame is drawn
+        (see Router.positions).
+
+        If stepsToTravel is 0, it looks up the distance to travel and the number of steps
+        required to reach the destination.
+
+        If stepsToTravel is greater than 0, it updates the current trip steps and checks
+        if the car has reached its destination. If the destination is reached, it updates
+        the car's latitude, longitude, autonomy, distance travelled, and state accordingly.
+        """
+        if (self.stepsToTravel == 0):
+            self.distanceToTravel, self.stepsToTravel = self.fleet.router.trip(self.current_region, self.next_region)
         else:
             self.currentTripSteps += 1
             if self.currentTripSteps >= self.stepsToTravel:
                 self.latitude = self.next_region.latitude
                 self.longitude = self.next_region.longitude
                 self.autonomy -= self.distanceToTravel
+                self.home_region.total_autonomy -= self.distanceToTravel / self.full_autonomy * 100
                 self.distance_travelled += self.distanceToTravel
                 self.arrived_at_destination()
                 if self.charge_at_destination:
@@ -279,24 +338,48 @@ class Car:
         """
         reachable_regions = self.reachable_regions()
         responses = [(region, region.get_status()) for region in reachable_regions]
+        config = self.fleet.config
         def score(response):
             region, (chargers, queue_size) = response
-            distance = region_distances[self.current_region.id][region.id]
+            distance = self.fleet.router.distances[self.current_region.id][region.id]
             distance += 0.1
-            return self.distanceWeight * (1 / distance) + self.availabilityWeigh * chargers - self.queueWeigh * queue_size
+            return config.distance_weight * (1 / distance) + config.availability_weight * chargers - config.queue_weight * queue_size
         responses.sort(key=score, reverse=True)
         charging_region = responses[0][0] if responses else None
-        if self.current_region.id == charging_region.id:
+        self.go_charging(charging_region)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def go_charging(self, region, station=None):
+        """
+        Sends the car to charge in the given region, travelling there if it is not the current one.
+
+        Args:
+            region (Region): The region where the car will charge.
+            station (Station): The station of the region where the car wants to charge, or None for any.
+        """
+        self.station = station
+        if region is self.current_region:
             self.state = BEFORE_CHARGING
         else:
-            for region in self.regions:
-                if region.id == charging_region.id:
-                    self.charge_at_destination = True
-                    self.next_region = region
-                    self.state = TRAVELING
+            self.charge_at_destination = True
+            self.next_region = region
+            self.state = TRAVELING
                     
     # ---------------------------------------------------------------------------------------------------------
                     
+    def request_charging(self):
+        """
+        Asks the fleet's charging planner for a charging region, or decides alone when there is no planner.
+        """
+        planner = self.fleet.planner
+        if planner is None:
+            self.decide_charging()
+        else:
+            planner.request(self)
+
+    # ---------------------------------------------------------------------------------------------------------
+
     def before_charging(self):
         """
         Attempt to start charging the car in the current region.
@@ -337,21 +420,25 @@ class Car:
             at_home (bool): Indicates whether the car is charging at home. Defaults to False.
         """
         if self.autonomy >= self.full_autonomy:
+            self.home_region.total_autonomy += (self.full_autonomy - self.autonomy) / self.full_autonomy * 100
             self.autonomy = self.full_autonomy
-            self.current_region.stop_charging(self.charging_time, at_home)
+            self.current_region.stop_charging(self.charging_time, at_home, self.station)
             self.charging_time = 0
+            self.station = None
             self.state = IDLE
         else:
-            charging_rate = float(os.getenv("CHARGING_PER_STEP_HOME")) if at_home else float(os.getenv("CHARGING_PER_STEP"))
+            charging_rate = self.fleet.config.charging_per_step_home if at_home else self.fleet.config.charging_per_step
             self.autonomy += charging_rate
+            self.home_region.total_autonomy += charging_rate / self.full_autonomy * 100
             self.charging_time += 1
-            if not at_home and random.random() < self.stop_charging_probability():
-                self.current_region.stop_charging(self.charging_time, at_home)
+            if not at_home and self.random() < self.stop_charging_probability():
+                self.current_region.stop_charging(self.charging_time, at_home, self.station)
                 self.charging_time = 0
+                self.station = None
                 self.state = IDLE 
-            elif not self.stop_charging_at_home and at_home and random.random() < self.stop_charging_at_home_probability():
+            elif not self.stop_charging_at_home and at_home and self.random() < self.stop_charging_at_home_probability():
                 self.stop_charging_at_home = True
-            elif self.stop_charging_at_home and random.random() < self.idle_probabilities.get(time_of_day, self.idle_probabilities["default"]):
+            elif self.stop_charging_at_home and self.random() < self.fleet.idle_probabilities.get(time_of_day, self.fleet.idle_probabilities["default"]):
                 self.current_region.stop_charging(self.charging_time, at_home)
                 self.charging_time = 0
                 self.stop_charging_at_home = False
@@ -399,24 +486,22 @@ class Car:
         Executes the behavior of the car based on its current state and the time of day.
 
         Args:
-            time_of_day (int): The current time of day.
+            time_of_day (str): The current time of day.
         """
-        if self.state == IDLE:
-            self.idle(time_of_day)
-        elif self.state == TRAVELING:
-            self.traveling()
-        elif self.state == DECIDE_CHARGING:
-            self.decide_charging()
-        elif self.state == BEFORE_CHARGING:
-            self.before_charging()
-        elif self.state == IN_QUEUE:
-            self.in_queue()
-        elif self.state == CHARGING:
-            self.charging(time_of_day, at_home=False)
-        elif self.state == CHARGING_AT_HOME:
-            self.charging(time_of_day, at_home=True)
-        self.home_region.update_autonomy(self.get_battery_percentage())
+        STATE_HANDLERS[self.state](self, time_of_day)
         if self.displayed:
-            self.logger.log(f"{self.id} {self.state}")
+            self.fleet.logger.log("state", car=self.id, state=STATE_NAMES[self.state])
             
+# -------------------------------------------------------------------------------------------------------------
+
+STATE_HANDLERS = (
+    Car.idle,                                                                   # IDLE
+    lambda car, time_of_day: car.traveling(),                                   # TRAVELING
+    lambda car, time_of_day: car.request_charging(),                            # DECIDE_CHARGING
+    lambda car, time_of_day: car.before_charging(),                             # BEFORE_CHARGING
+    lambda car, time_of_day: car.in_queue(),                                    # IN_QUEUE
+    lambda car, time_of_day: car.charging(time_of_day, at_home=False),          # CHARGING
+    lambda car, time_of_day: car.charging(time_of_day, at_home=True)            # CHARGING_AT_HOME
+)
+
 # -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -1,51 +1,57 @@
 # -------------------------------------------------------------------------------------------------------------
 
 import numpy as np
-import random
-import os
 
-from dotenv import load_dotenv
-
-# -------------------------------------------------------------------------------------------------------------
-
-os.environ.clear()
-load_dotenv()
+from random_streams import RandomStreams
 
 # -------------------------------------------------------------------------------------------------------------
 
 class CarSeeder:
     """
     CarSeeder is responsible for estimating car purchases across different regions based on income and other factors.
+
+    The drivers of a region are simulated as arrays: their incomes, buy decisions and model choices
+    are each drawn in a single call, and the models a driver can afford are found by a binary
+    search of their budget in the sorted model prices, since the affordable models are always the
+    cheapest ones.
     
     Attributes:
         cars (list): A list of car objects available for purchase.
+        sorted_cars (list): The car objects sorted by price.
+        prices (np.ndarray): The ascending prices of the sorted cars.
         regions (list): A list of region objects where the calculations will be executed.
         salaryFluctuation (float): The fluctuation in salary, used to generate income variations.
         percWillingToSpend (float): The percentage of income that people are willing to spend on a car.
         probabilityOfBuying (float): The probability that a person will buy a car if they can afford it.
+        streams (RandomStreams): The random streams; each region is seeded from its own stream.
     """
-    def __init__(self, cars, regions, salary_fluctuation = float(os.getenv("SALARY_FLUCTUATION")), percentage_willing_to_spend = float(os.getenv("PERCENTAGE_WILLING_TO_SPEND")), probability_of_buying=float(os.getenv("PROBABILITY_OF_BUYING"))):
+    def __init__(self, cars, regions, config, salary_fluctuation=None, percentage_willing_to_spend=None, probability_of_buying=None, streams=None):
         self.cars = cars
+        self.sorted_cars = sorted(cars, key=lambda car: car.price)
+        self.prices = np.array([car.price for car in self.sorted_cars], dtype=np.float64)
         self.regions = regions
-        self.salaryFluctuation = salary_fluctuation
-        self.percWillingToSpend = percentage_willing_to_spend
-        self.probabilityOfBuying = probability_of_buying
+        self.streams = streams if streams is not None else RandomStreams()
+        self.salaryFluctuation = salary_fluctuation if salary_fluctuation is not None else config.salary_fluctuation
+        self.percWillingToSpend = percentage_willing_to_spend if percentage_willing_to_spend is not None else config.percentage_willing_to_spend
+        self.probabilityOfBuying = probability_of_buying if probability_of_buying is not None else config.probability_of_buying
         
     # ---------------------------------------------------------------------------------------------------------
 
-    def generate_income(self, avg_income):
+    def generate_income(self, avg_income, rng, size=None):
         """
-        Generates a random income based on a log-normal distribution.
+        Generates random incomes based on a log-normal distribution.
 
         Args:
             avg_income (float): The average income to base the distribution on.
+            rng (np.random.Generator): The random stream of the region.
+            size (int): The number of incomes to draw, or None for a single one.
 
         Returns:
-            float: A randomly generated income value.
+            float or np.ndarray: A randomly generated income value, or an array of size values.
         """
         sigma = np.sqrt(np.log(1 + (self.salaryFluctuation ** 2)))
         mu = np.log(avg_income) - (sigma**2 / 2)
-        return np.random.lognormal(mu, sigma)
+        return rng.lognormal(mu, sigma, size)
     
     # ---------------------------------------------------------------------------------------------------------
 
@@ -57,13 +63,24 @@ class CarSeeder:
             income (float): The income of the individual.
 
         Returns:
-            list: A list of cars that are affordable based on the income and the percentage willing to spend.
+            list: A list of cars that are affordable based on the income and the percentage willing to spend,
+                  cheapest first.
+        """
+        return self.sorted_cars[:self.affordable_counts(income)]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def affordable_counts(self, incomes):
         """
-        affordable = []
-        for car in self.cars:
-            if car.price <= income * self.percWillingToSpend:
-                affordable.append(car)
-        return affordable
+        Counts the affordable cars of incomes, with a binary search of each budget in the sorted prices.
+
+        Args:
+            incomes (float or np.ndarray): The incomes of the individuals.
+
+        Returns:
+            int or np.ndarray: The number of affordable cars of each income, which are the cheapest ones.
+        """
+        return np.searchsorted(self.prices, np.multiply(incomes, self.percWillingToSpend), side="right")
     
     # ---------------------------------------------------------------------------------------------------------
 
@@ -77,22 +94,24 @@ class CarSeeder:
         Returns:
             dict: A dictionary with car models as keys and the number of purchases as values.
         """
-        avg_income = region.avg_income
+        rng = self.streams.generator("seeder", region.id)
+        affordable = self.affordable_counts(self.generate_income(region.avg_income, rng, region.avg_drivers))
+        buyers = affordable[(affordable > 0) & (rng.random(region.avg_drivers) < self.probabilityOfBuying)]
+        purchases = np.bincount(rng.integers(buyers), minlength=len(self.sorted_cars)).tolist()
         results = {car: 0 for car in self.cars}
-        for _ in range(region.avg_drivers):
-            income = self.generate_income(avg_income)
-            affordable = self.affordable_cars(income)
-            if affordable and random.random() < self.probabilityOfBuying:
-                chosen_car = random.choice(affordable)
-                results[chosen_car] += 1
+        for car, count in zip(self.sorted_cars, purchases):
+            results[car] += count
         return results
     
     # ---------------------------------------------------------------------------------------------------------
 
-    def run(self):
+    def run(self, verbose=True):
         """
         Executes the calculations for all regions and prints the results.
 
+        Args:
+            verbose (bool): Whether to print the results of each region.
+
         Returns:
             dict: A dictionary where the keys are region IDs and the values are the results of the calculations for each region.
         """
@@ -100,9 +119,10 @@ class CarSeeder:
         for region in self.regions:
             region_result = self.simulate_region(region)
             all_results[region.id] = region_result
-            print('\n' + region.id)
-            for car in region_result:
-                print(f"{car.id}: {region_result[car]}")
+            if verbose:
+                print('\n' + region.id)
+                for car in region_result:
+                    print(f"{car.id}: {region_result[car]}")
         return all_results
 
 # -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,153 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+from random_streams import RandomStreams
+from entities.states import IDLE
+
+# -------------------------------------------------------------------------------------------------------------
+
+FLEET_RECORD = np.dtype([("model", np.int16), ("home", np.int32), ("key", np.uint64), ("autonomy", np.float64)])
+
+# -------------------------------------------------------------------------------------------------------------
+
+class Fleet:
+    """
+    Structure-of-arrays representation of all the cars in the simulation.
+    Each attribute holds one entry per car, indexed by the car's position in the fleet.
+
+    Attributes:
+        size (int): The number of cars in the fleet.
+        state (np.ndarray): The state code of each car (see entities/states.py).
+        autonomy (np.ndarray): The current autonomy of each car in kilometers.
+        full_autonomy (np.ndarray): The maximum autonomy of each car in kilometers.
+        key (np.ndarray): The random stream key of each car.
+        model (np.ndarray): The index of the car model of each car.
+        home (np.ndarray): The index of the home region of each car.
+        current (np.ndarray): The index of the region where each car currently is.
+        next (np.ndarray): The index of the region each car is travelling to, or -1.
+        steps_to_travel (np.ndarray): The number of steps required by the current trip, or 0 before it starts.
+        trip_steps (np.ndarray): The number of steps taken in the current trip.
+        trip_distance (np.ndarray): The distance of the current trip in kilometers.
+        wait_time (np.ndarray): The time each car has spent waiting in a queue.
+        charging_time (np.ndarray): The time each car has spent charging.
+        charge_at_destination (np.ndarray): Whether each car will charge at its destination.
+        stop_charging_at_home (np.ndarray): Whether each car should stop charging at home.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.state = np.full(size, IDLE, dtype=np.int8)
+        self.key = np.zeros(size, dtype=np.uint64)
+        self.autonomy = np.zeros(size, dtype=np.float64)
+        self.full_autonomy = np.zeros(size, dtype=np.float64)
+        self.model = np.zeros(size, dtype=np.int16)
+        self.home = np.zeros(size, dtype=np.int32)
+        self.current = np.zeros(size, dtype=np.int32)
+        self.next = np.full(size, -1, dtype=np.int32)
+        self.steps_to_travel = np.zeros(size, dtype=np.int32)
+        self.trip_steps = np.zeros(size, dtype=np.int32)
+        self.trip_distance = np.zeros(size, dtype=np.float64)
+        self.wait_time = np.zeros(size, dtype=np.int32)
+        self.charging_time = np.zeros(size, dtype=np.int32)
+        self.charge_at_destination = np.zeros(size, dtype=bool)
+        self.stop_charging_at_home = np.zeros(size, dtype=bool)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def records(cars_data, car_models, regions, streams):
+        """
+        Lists the cars of the per-region model counts produced by the CarSeeder, ordered by home
+        region, then model, then number. Every car starts with a random share of its full autonomy,
+        between half and all of it.
+
+        Args:
+            cars_data (dict): A dictionary mapping region IDs to {car model: count} dictionaries.
+            car_models (list): The list of car models, whose order defines the model indices.
+            regions (list): The list of regions, whose order defines the region indices.
+            streams (RandomStreams): The random streams that key each car.
+
+        Returns:
+            np.ndarray: One FLEET_RECORD (model, home region, stream key and initial autonomy) per car.
+        """
+        model_index = {car_model: i for i, car_model in enumerate(car_models)}
+        keys = []
+        models = []
+        homes = []
+        for r, region in enumerate(regions):
+            for car_model, count in cars_data[region.id].items():
+                keys.append(streams.car_keys(region.id, car_model.id, count))
+                models.append(np.full(count, model_index[car_model], dtype=np.int16))
+                homes.append(np.full(count, r, dtype=np.int32))
+        records = np.zeros(sum(len(m) for m in models), dtype=FLEET_RECORD)
+        if len(records) == 0:
+            return records
+        records["key"] = np.concatenate(keys)
+        records["model"] = np.concatenate(models)
+        records["home"] = np.concatenate(homes)
+        autonomies = np.array([car_model.autonomy for car_model in car_models], dtype=np.float64)
+        records["autonomy"] = autonomies[records["model"]] * (0.5 + 0.5 * RandomStreams.uniforms(records["key"], -1, 0))
+        return records
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def from_records(cls, records, car_models, regions):
+        """
+        Builds a fleet from its car records, e.g. freshly seeded or memory-mapped from the fleet cache.
+        Every car starts idle in its home region.
+
+        Args:
+            records (np.ndarray): The FLEET_RECORD of each car.
+            car_models (list): The list of car models, whose order defines the model indices.
+            regions (list): The list of regions, whose order defines the region indices.
+
+        Returns:
+            Fleet: The fleet.
+        """
+        fleet = cls(len(records))
+        counts = np.bincount(records["home"], minlength=len(regions)).tolist()
+        for region, count in zip(regions, counts):
+            region.total_cars = count
+            region.cars_present += count
+        if fleet.size == 0:
+            return fleet
+        fleet.key[:] = records["key"]
+        fleet.model[:] = records["model"]
+        fleet.home[:] = records["home"]
+        fleet.current[:] = fleet.home
+        autonomies = np.array([car_model.autonomy for car_model in car_models], dtype=np.float64)
+        fleet.full_autonomy[:] = autonomies[fleet.model]
+        fleet.autonomy[:] = records["autonomy"]
+        return fleet
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def from_seeder(cls, cars_data, car_models, regions, streams):
+        """
+        Builds a fleet from the per-region model counts produced by the CarSeeder.
+
+        Args:
+            cars_data (dict): A dictionary mapping region IDs to {car model: count} dictionaries.
+            car_models (list): The list of car models, whose order defines the model indices.
+            regions (list): The list of regions, whose order defines the region indices.
+            streams (RandomStreams): The random streams that key each car.
+
+        Returns:
+            Fleet: The generated fleet.
+        """
+        return cls.from_records(cls.records(cars_data, car_models, regions, streams), car_models, regions)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def get_battery_percentage(self):
+        """
+        Calculate the battery percentage of every car.
+
+        Returns:
+            np.ndarray: The current battery percentage of each car.
+        """
+        return (self.autonomy / self.full_autonomy) * 100
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
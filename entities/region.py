@@ -1,17 +1,10 @@
 # -------------------------------------------------------------------------------------------------------------
 
-import queue
-import json
-
+from charging_queue import ChargingQueue
+from streaming_stats import BandedStats
 from logs.log import Logger
-
-# -------------------------------------------------------------------------------------------------------------
-
-TRAVELING = "[Traveling]"
-IDLE = "[Idle]"
-CHARGING = "[Charging]"
-BEFORE_CHARGING = "[BeforeCharging]"
-DECIDE_CHARGING = "[DecideCharging]"
+from entities.station import Station
+from utils import haversine_distance
 
 # -------------------------------------------------------------------------------------------------------------
 
@@ -26,9 +19,10 @@ class Region:
         avg_drivers (int): The average number of drivers in the region.
         avg_income (int): The average income of the drivers in the region.
         chargers (int): The total number of chargers in the region.
+        stations (list): The charging stations of the region, nearest to its center first.
         traffic (int): The traffic level in the region.
         total_cars (int): The total number of cars from the region.
-        queue (queue.Queue): The queue of cars waiting to charge.
+        queue (ChargingQueue): The queue of cars waiting to charge.
         logger (Logger): The logger instance for logging events.
         cars_present (int): The number of cars currently present in the region.
         cars_home_charging (int): The number of cars charging at home.
@@ -36,7 +30,8 @@ class Region:
         available_chargers (int): The number of available chargers.
         queued_cars (int): The number of cars that queued for charging.
         cars_charged (int): The number of cars that have been charged.
-        total_autonomy (int): The total autonomy of all cars.
+        total_autonomy (float): The sum of the battery percentages of the cars of the region, kept up to
+            date by the cars whenever their autonomy changes.
         average_autonomy (float): The average autonomy of the cars.
         average_home_time (float): The average time cars spend charging at home.
         charger_utilization (float): The utilization rate of the chargers.
@@ -44,8 +39,19 @@ class Region:
         stress_metric (float): The stress metric of the region.
         average_wait_time (float): The average wait time for charging.
         average_charging_time (float): The average time spent charging.
-        history (dict): The history of various metrics over time.
+        time_of_day (str): The current time of day label, set by the simulation.
+        wait_time_stats (BandedStats): The streaming distribution of the wait times, overall and per time of day.
+        charging_time_stats (BandedStats): The streaming distribution of the charging times at the chargers.
+        home_time_stats (BandedStats): The streaming distribution of the charging times at home.
     """
+    __slots__ = (
+        "id", "latitude", "longitude", "avg_drivers", "avg_income", "chargers", "stations", "traffic", "total_cars", "queue",
+        "logger", "cars_present", "cars_home_charging", "home_charged", "available_chargers", "queued_cars",
+        "cars_charged", "total_autonomy", "average_autonomy", "average_home_time", "charger_utilization",
+        "average_queue_size", "stress_metric", "average_wait_time", "average_charging_time", "time_of_day",
+        "wait_time_stats", "charging_time_stats", "home_time_stats"
+    )
+
     def __init__(self, id, latitude, longitude, avg_drivers, avg_income, chargers, traffic):
         self.id = id
         self.latitude = latitude
@@ -53,10 +59,11 @@ class Region:
         self.avg_drivers = int(avg_drivers)
         self.avg_income = int(avg_income)
         self.chargers = chargers
+        self.stations = [Station(id, self, latitude, longitude, chargers)]
         self.traffic = traffic
         self.total_cars = 0
-        self.queue = queue.Queue()
-        self.logger = Logger(filename=str(id))
+        self.queue = ChargingQueue()
+        self.logger = Logger(filename=str(id), category="regions")
         
         # metrics
         self.cars_present = 0
@@ -75,57 +82,95 @@ class Region:
         self.stress_metric = 0
         self.average_wait_time = 0
         self.average_charging_time = 0
+
+        # distributions
+        self.time_of_day = "default"
+        self.wait_time_stats = BandedStats()
+        self.charging_time_stats = BandedStats()
+        self.home_time_stats = BandedStats()
         
-        # history
-        self.history = {
-            'cars_present': [],
-            'cars_home_charging': [],
-            'available_chargers': [],
-            'queued_cars': [],
-            'cars_charged': [],
-            'average_autonomy': [],
-            'average_home_time': [],
-            'charger_utilization': [],
-            'average_queue_size': [],
-            'stress_metric': [],
-            'average_wait_time': [],
-            'average_charging_time': []
-        }
-        
     # ---------------------------------------------------------------------------------------------------------
 
-    def stop_charging(self, charging_time, at_home):
+    def set_stations(self, stations):
+        """
+        Replaces the charger pool of the region by individual stations. The chargers of the region
+        become the charging points of its stations.
+
+        Args:
+            stations (list): The stations of the region.
+        """
+        self.stations = sorted(stations, key=lambda s: haversine_distance(self.latitude, self.longitude, s.latitude, s.longitude))
+        self.chargers = sum(station.capacity for station in stations)
+        self.available_chargers = sum(station.available for station in stations)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def take_station(self, preferred=None):
+        """
+        Takes a charging point of the region: the one of the preferred station if it has a free one,
+        or else the one of the free station nearest to the center of the region.
+
+        Args:
+            preferred (Station): The station the car headed to, or None.
+
+        Returns:
+            Station: The station of the charging point.
+        """
+        station = preferred
+        if station is None or station.region is not self or station.available <= 0:
+            station = next((s for s in self.stations if s.available > 0), self.stations[0])
+        station.available -= 1
+        return station
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def release_station(self, station=None):
+        """
+        Frees a charging point of the region.
+
+        Args:
+            station (Station): The station of the charging point, or None if unknown, in which case a
+                               charging point of the first busy station is freed.
+        """
+        if station is None or station.region is not self:
+            station = next((s for s in self.stations if s.available < s.capacity), self.stations[0])
+        station.available += 1
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def stop_charging(self, charging_time, at_home, station=None):
         """
         Stops the charging process for a car and updates relevant statistics.
 
         Args:
             charging_time (float): The time the car spent charging.
             at_home (bool): A flag indicating whether the car was charging at home.
+            station (Station): The station where the car was charging, or None if unknown.
         """
         if at_home:
             self.cars_home_charging -= 1
             self.home_charged += 1
             self.average_home_time = (self.average_home_time * (self.home_charged - 1) + charging_time) / self.home_charged
+            self.home_time_stats.add(charging_time, self.time_of_day)
         else:
             self.available_chargers += 1
+            self.release_station(station)
             self.cars_charged += 1
             self.average_charging_time = (self.average_charging_time * (self.cars_charged - 1) + charging_time) / self.cars_charged
-            self.logger.log("Car has stopped charging")
-            self.logger.log("Available chargers: " + str(self.available_chargers))
-            self.logger.log("Cars charged: " + str(self.cars_charged))
-            self.logger.log("")
-            if not self.queue.empty():
+            self.charging_time_stats.add(charging_time, self.time_of_day)
+            self.logger.log("charging_stopped", available_chargers=self.available_chargers, cars_charged=self.cars_charged)
+            if self.queue.ready():
                 next_car = self.queue.get()
                 next_car.exit_queue()
-                self.start_charging(next_car)
+                self.occupy_charger(next_car)
             
     # ---------------------------------------------------------------------------------------------------------
 
     def start_charging(self, car):
         """
-        Attempts to start charging a car. If there are available chargers, the car starts charging
-        and the number of available chargers is decremented. If no chargers are available, the car
-        is added to the queue.
+        Attempts to start charging a car. If there are available chargers and no car is waiting, the
+        car starts charging at a station of the region (the one it headed to, if it is free) and the
+        number of available chargers is decremented. Otherwise, the car is added to the queue.
 
         Args:
             car: The car object that is attempting to start charging.
@@ -133,21 +178,29 @@ class Region:
         Returns:
             bool: True if the car has started charging, False if the car has been queued.
         """
-        if self.available_chargers > 0:
-            self.available_chargers -= 1
-            self.logger.log("Car has started charging")
-            self.logger.log("Available chargers: " + str(self.available_chargers))
-            self.logger.log("")
+        if self.available_chargers > 0 and not self.queue:
+            self.occupy_charger(car)
             return True
         else:
             self.queue.put(car)
-            self.logger.log("Car has been queued")
-            self.logger.log("Queue size: " + str(self.queue.qsize()))
-            self.logger.log("")
+            self.logger.log("queued", queue_size=len(self.queue))
             return False
         
     # ---------------------------------------------------------------------------------------------------------
 
+    def occupy_charger(self, car):
+        """
+        Starts charging a car at a free charging point, of the station it headed to if possible.
+
+        Args:
+            car: The car that starts charging.
+        """
+        self.available_chargers -= 1
+        car.station = self.take_station(car.station)
+        self.logger.log("charging_started", available_chargers=self.available_chargers)
+
+    # ---------------------------------------------------------------------------------------------------------
+
     def get_status(self):
         """
         Get the current status of the region.
@@ -156,13 +209,13 @@ class Region:
             tuple: A tuple containing the number of available chargers (int) 
                    and the size of the queue (int).
         """
-        return self.available_chargers, self.queue.qsize()
+        return self.available_chargers, len(self.queue)
         
     # ---------------------------------------------------------------------------------------------------------
         
     def update_wait_time(self, wait_time):
         """
-        Update the average wait time for the region.
+        Update the average wait time and the wait time distribution of the region.
 
         Args:
             wait_time (float): The wait time to be added to the average wait time.
@@ -172,50 +225,84 @@ class Region:
         """
         self.queued_cars += 1
         self.average_wait_time = (self.average_wait_time * (self.queued_cars - 1) + wait_time) / self.queued_cars
+        self.wait_time_stats.add(wait_time, self.time_of_day)
         
     # ---------------------------------------------------------------------------------------------------------
         
-    def update_autonomy(self, autonomy):
+    def set_queue(self, queue):
         """
-        Updates the total autonomy of the region.
+        Replaces the charging queue of the region, e.g. by one with another discipline. The cars
+        of the current queue are moved to the new one, in the order they would have been served.
 
         Args:
-            autonomy (float): The amount of autonomy to add to the total autonomy.
+            queue (ChargingQueue): The new, empty queue.
         """
-        self.total_autonomy += autonomy
-        
+        queue.clock = self.queue.clock
+        for car in self.queue:
+            queue.put(car)
+        self.queue = queue
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def dispatch(self):
+        """
+        Starts charging the next queued car if a charger is free and its turn has come, which
+        only happens between sessions with disciplines that hold cars back, such as reservations.
+
+        Returns:
+            Car: The car that started charging, or None.
+        """
+        if self.available_chargers <= 0 or not self.queue.ready():
+            return None
+        car = self.queue.get()
+        car.exit_queue()
+        self.occupy_charger(car)
+        return car
+
     # ---------------------------------------------------------------------------------------------------------
         
     def run(self):
         """
-        Executes the main logic for updating the region's metrics and history.
+        Executes the main logic of the region at the end of a step: starts the queued cars whose
+        turn has come and moves the queue clock. The counters are kept up to date by the events
+        that change them, and the derived metrics are only computed when they are read.
+        """
+        while self.dispatch() is not None:
+            pass
+        self.queue.advance()
+        
+    # ---------------------------------------------------------------------------------------------------------
+
+    def update_metrics(self):
+        """
+        Computes the derived metrics of the region (average battery, charger utilization, average
+        queue size and stress) from its counters.
         """
+        queued = len(self.queue)
         self.average_autonomy = self.total_autonomy / self.total_cars
-        self.total_autonomy = 0
         self.charger_utilization = round((1 - (self.available_chargers / self.chargers)) * 100, 2)
-        self.average_queue_size = round(self.queue.qsize() / self.chargers, 2)
+        self.average_queue_size = round(queued / self.chargers, 2)
         ALFA = 1
-        self.stress_metric = round(1 - (self.available_chargers / self.chargers) + ALFA * (self.queue.qsize() / self.chargers), 2)
-        self.history['cars_present'].append(self.cars_present)
-        self.history['cars_home_charging'].append(self.cars_home_charging)
-        self.history['available_chargers'].append(self.available_chargers)
-        self.history['queued_cars'].append(self.queue.qsize())
-        self.history['cars_charged'].append(self.cars_charged)
-        self.history['average_autonomy'].append(round(self.average_autonomy, 2))
-        self.history['average_home_time'].append(round(self.average_home_time, 2))
-        self.history['charger_utilization'].append(round(self.charger_utilization, 2))
-        self.history['average_queue_size'].append(round(self.average_queue_size, 2))
-        self.history['stress_metric'].append(round(self.stress_metric, 2))
-        self.history['average_wait_time'].append(round(self.average_wait_time, 2))
-        self.history['average_charging_time'].append(round(self.average_charging_time, 2))
+        self.stress_metric = round(1 - (self.available_chargers / self.chargers) + ALFA * (queued / self.chargers), 2)
         
     # ---------------------------------------------------------------------------------------------------------
-        
-    def save_history(self):
+
+    def metrics(self):
         """
-        Saves the simulation history of the region to a JSON file.
+        Gets the metrics recorded in the history of the simulation, in the order of history.METRICS.
+
+        Returns:
+            tuple: The current value of each metric.
         """
-        with open('logs/outputs/' + self.id + '.json', 'w') as f:
-            json.dump(self.history, f)
+        self.update_metrics()
+        wait = self.wait_time_stats.overall.summary()
+        charging = self.charging_time_stats.overall.summary()
+        return (
+            self.cars_present, self.cars_home_charging, self.available_chargers, len(self.queue), self.cars_charged,
+            self.average_autonomy, self.average_home_time, self.charger_utilization, self.average_queue_size,
+            self.stress_metric, self.average_wait_time, self.average_charging_time,
+            wait["std"], wait["p50"], wait["p95"], wait["p99"],
+            charging["std"], charging["p50"], charging["p95"], charging["p99"]
+        )
 
 # -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,21 @@
+# -------------------------------------------------------------------------------------------------------------
+
+IDLE = 0
+TRAVELING = 1
+DECIDE_CHARGING = 2
+BEFORE_CHARGING = 3
+IN_QUEUE = 4
+CHARGING = 5
+CHARGING_AT_HOME = 6
+
+STATE_NAMES = [
+    "[Idle]",
+    "[Traveling]",
+    "[DecideCharging]",
+    "[BeforeCharging]",
+    "[InQueue]",
+    "[Charging]",
+    "[ChargingAtHome]"
+]
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
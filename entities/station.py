@@ -0,0 +1,26 @@
+# -------------------------------------------------------------------------------------------------------------
+
+class Station:
+    """
+    A public charging station of a region, with its own location and number of charging points.
+    Regions without a station file hold a single station at their center with all their chargers.
+
+    Attributes:
+        id (str): The unique identifier of the station.
+        region (Region): The region the station belongs to.
+        latitude (float): The latitude coordinate of the station.
+        longitude (float): The longitude coordinate of the station.
+        capacity (int): The number of charging points of the station.
+        available (int): The number of free charging points.
+    """
+    __slots__ = ("id", "region", "latitude", "longitude", "capacity", "available")
+
+    def __init__(self, id, region, latitude, longitude, capacity):
+        self.id = id
+        self.region = region
+        self.latitude = latitude
+        self.longitude = longitude
+        self.capacity = capacity
+        self.available = capacity
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
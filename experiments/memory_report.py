@@ -0,0 +1,195 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import argparse
+import gc
+import sys
+import tracemalloc
+
+import numpy as np
+
+from main import Application
+from entities.car import Car, FleetParameters
+from entities.states import STATE_NAMES, IDLE
+from logs.log import Logger
+from random_streams import RandomStreams
+from settings import SimulationConfig
+
+# -------------------------------------------------------------------------------------------------------------
+
+LAYOUTS = ("baseline", "slotted")
+
+# -------------------------------------------------------------------------------------------------------------
+
+class BaselineCar:
+    """
+    The car layout the slotted Car replaced, kept to measure it: a plain instance whose attribute
+    dictionary holds its own numpy Generator, its own logger, references to the regions and the
+    configuration, copies of the behaviour parameters and the state as a string.
+    """
+    def __init__(self, id, autonomy, current_region, regions, config, key, initial_autonomy):
+        self.id = id
+        self.rng = np.random.default_rng(key)
+        self.full_autonomy = autonomy
+        self.autonomy = initial_autonomy
+        self.velocity = config.velocity_per_step
+        self.current_region = current_region
+        self.home_region = current_region
+        self.latitude = current_region.latitude
+        self.longitude = current_region.longitude
+        self.distance_travelled = 0
+        self.wait_time = 0
+        self.charging_time = 0
+        self.regions = regions
+        self.next_region = None
+        self.charge_at_destination = False
+        self.stuck_at_region = False
+        self.state = STATE_NAMES[IDLE]
+        self.displayed = False
+        self.stepsToTravel = 0
+        self.currentTripSteps = 0
+        self.distanceToTravel = 0
+        self.stop_charging_at_home = False
+        self.config = config
+        self.idle_probabilities = config.idle_probabilities
+        self.logger = Logger(filename="cars")
+        self.availabilityWeigh = config.availability_weight
+        self.distanceWeight = config.distance_weight
+        self.queueWeigh = config.queue_weight
+
+# -------------------------------------------------------------------------------------------------------------
+
+def representation_bytes(cars):
+    """
+    Measures the memory held by the representation of the cars: the instances, their attribute
+    dictionaries (if any) and the numbers, strings, dictionaries and loggers they reference.
+    Every object is counted once, so tables shared by the whole fleet are amortized over it;
+    the regions and numpy generators are left out.
+
+    Args:
+        cars (list): The cars to measure.
+
+    Returns:
+        int: The number of bytes.
+    """
+    seen = set()
+    size = 0
+    def add(value):
+        nonlocal size
+        if id(value) not in seen:
+            seen.add(id(value))
+            size += sys.getsizeof(value)
+    for car in cars:
+        add(car)
+        values = [getattr(car, name) for name in getattr(car, "__slots__", ())]
+        if hasattr(car, "__dict__"):
+            add(car.__dict__)
+            values += list(car.__dict__.values())
+        for value in values:
+            if isinstance(value, (int, float, str, dict)):
+                add(value)
+            elif isinstance(value, Logger):
+                add(value)
+                if hasattr(value, "__dict__"):
+                    add(value.__dict__)
+    return size
+
+# -------------------------------------------------------------------------------------------------------------
+
+def stream_bytes(car):
+    """
+    Measures the memory of a car's random stream: its numpy Generator in the baseline layout,
+    its key and draw count in the slotted one.
+
+    Args:
+        car (BaselineCar | Car): The car to measure.
+
+    Returns:
+        int: The number of bytes.
+    """
+    if isinstance(car, BaselineCar):
+        return sys.getsizeof(car.rng) + sys.getsizeof(car.rng.bit_generator)
+    return sys.getsizeof(car.key) + sys.getsizeof(car.draws)
+
+# -------------------------------------------------------------------------------------------------------------
+
+def traced(build):
+    """
+    Builds a fleet while tracing allocations.
+
+    Args:
+        build (callable): Builds and returns the list of cars.
+
+    Returns:
+        tuple: The cars and the number of bytes still allocated once they are built.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cars = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return cars, size
+
+# -------------------------------------------------------------------------------------------------------------
+
+def report(config, seed=0):
+    """
+    Seeds the fleet of a scenario and measures how many bytes each car takes, once in the baseline
+    layout and once in the slotted one. Both layouts are built from the same fleet records, with
+    the fleet parameters shared by the slotted cars created beforehand.
+
+    Args:
+        config (SimulationConfig): The configuration of the scenario.
+        seed (int): The master seed of the fleet.
+
+    Returns:
+        dict: The number of cars and, for each layout, the traced bytes per car (everything allocated
+              while building the cars, including their random streams), the bytes of the car
+              representation alone and the bytes of a car's random stream.
+    """
+    regions, car_models = Application.load_inputs(config)
+    records = Application.seed_fleet(car_models, regions, config, RandomStreams(seed), verbose=False)
+    fleet = FleetParameters(regions, config)
+    rows = [
+        (regions[home], car_models[model], i, key, autonomy)
+        for i, (home, model, key, autonomy) in enumerate(zip(
+            records["home"].tolist(), records["model"].tolist(), records["key"].tolist(), records["autonomy"].tolist()
+        ))
+    ]
+    builders = {
+        "baseline": lambda: [
+            BaselineCar(f"{region.id}_{model.id}_{i}", model.autonomy, region, regions, config, key, autonomy)
+            for region, model, i, key, autonomy in rows
+        ],
+        "slotted": lambda: [
+            Car(f"{region.id}_{model.id}_{i}", model.autonomy, region, fleet, key, autonomy)
+            for region, model, i, key, autonomy in rows
+        ]
+    }
+    result = {"cars": len(rows)}
+    for layout in LAYOUTS:
+        cars, size = traced(builders[layout])
+        result[layout] = {
+            "traced": size / len(cars),
+            "representation": representation_bytes(cars) / len(cars),
+            "stream": stream_bytes(cars[0])
+        }
+        del cars
+    return result
+
+# -------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes per car of the object engine's fleet, baseline and slotted layouts.")
+    parser.add_argument("--config", default=".env", help="scenario .env file (default: .env)")
+    parser.add_argument("--seed", type=int, default=0, help="master seed of the fleet")
+    args = parser.parse_args()
+    result = report(SimulationConfig.from_env_file(args.config), args.seed)
+    baseline, slotted = result["baseline"], result["slotted"]
+    print(f"\n{result['cars']} cars                    baseline    slotted")
+    print(f"Traced allocations per car: {baseline['traced']:8.0f} {slotted['traced']:10.0f} bytes")
+    print(f"Car representation:         {baseline['representation']:8.0f} {slotted['representation']:10.0f} bytes")
+    print(f"Random stream per car:      {baseline['stream']:8.0f} {slotted['stream']:10.0f} bytes")
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
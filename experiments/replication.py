@@ -0,0 +1,208 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from multiprocessing import Pool
+from statistics import NormalDist
+
+from main import Application
+from settings import SimulationConfig
+from entities.region import Region
+from history import METRIC_NAMES
+from streaming_stats import BandedStats, STAT_NAMES
+
+# -------------------------------------------------------------------------------------------------------------
+
+_inputs = {}
+
+# -------------------------------------------------------------------------------------------------------------
+
+def load_scenario(scenario):
+    """
+    Loads the configuration of a scenario, given either its name (e.g. "future") or the path to its .env file.
+
+    Args:
+        scenario (str): The scenario name or path.
+
+    Returns:
+        SimulationConfig: The configuration of the scenario.
+    """
+    path = scenario if os.path.exists(scenario) else os.path.join("config", ".env." + scenario)
+    return SimulationConfig.from_env_file(path)
+
+# -------------------------------------------------------------------------------------------------------------
+
+def init_worker(config, region_specs, car_models, engine):
+    """
+    Initializes a worker process with the read-only inputs shared by every replication.
+
+    Args:
+        config (SimulationConfig): The configuration of the scenario.
+        region_specs (list): The constructor arguments of each region.
+        car_models (list): The list of car models.
+        engine (str): The simulation engine used by the replications.
+    """
+    _inputs.update(config=config, region_specs=region_specs, car_models=car_models, engine=engine)
+
+# -------------------------------------------------------------------------------------------------------------
+
+def simulate(config, regions, car_models, engine, seed):
+    """
+    Runs one headless simulation of a full configured run. Logging is disabled, since parallel runs
+    would write to the same log files.
+
+    Args:
+        config (SimulationConfig): The configuration of the run.
+        regions (list): Freshly created regions for this run.
+        car_models (list): The list of car models.
+        engine (str): The simulation engine.
+        seed (int): The master seed of the run.
+
+    Returns:
+        dict: Maps each region ID to a (metrics x steps) array with its history.
+    """
+    config = config.replace(log_categories="none")
+    simulation = Application.create_simulation(engine, config, car_models, regions, seed=seed, verbose=False)
+    for step in range(config.total_steps):
+        simulation.checkTimeOfDay(step)
+        simulation.run_step(step)
+    return {region.id: simulation.history.region(r) for r, region in enumerate(regions)}
+
+# -------------------------------------------------------------------------------------------------------------
+
+def run_replication(seed):
+    """
+    Runs one independent replication of the scenario loaded in the worker.
+
+    Args:
+        seed (int): The seed of the replication.
+
+    Returns:
+        tuple: Maps each region ID to a (metrics x steps) array with its history, and maps each region ID
+               to the streaming statistics (BandedStats) of its durations, by name.
+    """
+    regions = [Region(*spec) for spec in _inputs["region_specs"]]
+    if _inputs["config"].stations:
+        Application.read_station_data(_inputs["config"].stations, regions)
+    histories = simulate(_inputs["config"], regions, _inputs["car_models"], _inputs["engine"], seed)
+    return histories, {region.id: {name: getattr(region, name + "_stats") for name in STAT_NAMES} for region in regions}
+
+# -------------------------------------------------------------------------------------------------------------
+
+def summarize(runs, metrics, confidence):
+    """
+    Computes the mean and the confidence band of every metric of every region, step by step.
+    The band uses the normal approximation of the sampling distribution of the mean.
+
+    Args:
+        runs (list): The histories returned by run_replication for each seed.
+        metrics (list): The names of the metrics, in the order of the history arrays.
+        confidence (float): The confidence level of the bands.
+
+    Returns:
+        dict: Maps each region ID and metric to its "mean", "lower" and "upper" series.
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    summary = {}
+    for region_id in runs[0]:
+        samples = np.stack([run[region_id] for run in runs])
+        mean = samples.mean(axis=0)
+        if len(runs) > 1:
+            half_width = z * samples.std(axis=0, ddof=1) / np.sqrt(len(runs))
+        else:
+            half_width = np.zeros_like(mean)
+        summary[region_id] = {
+            metric: {
+                'mean': np.round(mean[m], 4).tolist(),
+                'lower': np.round(mean[m] - half_width[m], 4).tolist(),
+                'upper': np.round(mean[m] + half_width[m], 4).tolist()
+            }
+            for m, metric in enumerate(metrics)
+        }
+    return summary
+
+# -------------------------------------------------------------------------------------------------------------
+
+def summarize_percentiles(runs):
+    """
+    Merges the streaming statistics of the durations of every replication, per region and for the
+    whole city ("all"), and computes their distribution over all the replications.
+
+    Args:
+        runs (list): The statistics returned by run_replication for each seed.
+
+    Returns:
+        dict: Maps each region ID and "all" to each duration name, then to "all" and each time of
+              day label, then to the count, mean, std, p50, p95 and p99.
+    """
+    merged = {"all": {name: BandedStats() for name in STAT_NAMES}}
+    for run in runs:
+        for region_id, stats in run.items():
+            region = merged.setdefault(region_id, {name: BandedStats() for name in STAT_NAMES})
+            for name in STAT_NAMES:
+                region[name].merge(stats[name])
+                merged["all"][name].merge(stats[name])
+    return {
+        region_id: {name: {band: {key: round(value, 4) for key, value in values.items()} for band, values in stats.summary().items()}
+                    for name, stats in durations.items()}
+        for region_id, durations in merged.items()
+    }
+
+# -------------------------------------------------------------------------------------------------------------
+
+def replicate(scenario, replications, engine="vectorized", workers=None, seed=0, confidence=0.95):
+    """
+    Runs independent replications of a scenario across a process pool and summarizes them.
+
+    Args:
+        scenario (str): The scenario name or path to its .env file.
+        replications (int): The number of independent seeds to run.
+        engine (str): The simulation engine used by the replications.
+        workers (int): The number of worker processes, defaulting to every core.
+        seed (int): The seed of the first replication; the others use the following integers.
+        confidence (float): The confidence level of the bands.
+
+    Returns:
+        dict: The summary computed by summarize, the duration percentiles computed by summarize_percentiles
+              and the scenario metadata.
+    """
+    config = load_scenario(scenario)
+    regions, car_models = Application.load_inputs(config)
+    region_specs = [(r.id, r.latitude, r.longitude, r.avg_drivers, r.avg_income, r.chargers, r.traffic) for r in regions]
+    metrics = list(METRIC_NAMES)
+    seeds = list(range(seed, seed + replications))
+    with Pool(workers or os.cpu_count(), init_worker, (config, region_specs, car_models, engine)) as pool:
+        runs = pool.map(run_replication, seeds, chunksize=1)
+    histories = [histories for histories, _ in runs]
+    return {
+        'scenario': scenario,
+        'engine': engine,
+        'seeds': seeds,
+        'confidence': confidence,
+        'regions': summarize(histories, metrics, confidence),
+        'percentiles': summarize_percentiles([stats for _, stats in runs])
+    }
+
+# -------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo replications of a scenario.")
+    parser.add_argument("scenario", help="scenario name (baseline, future, ...) or path to a .env file")
+    parser.add_argument("-n", "--replications", type=int, default=10, help="number of independent seeds")
+    parser.add_argument("--engine", choices=["object", "vectorized", "event"], default="vectorized")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first replication")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the bands")
+    parser.add_argument("--output", default=None, help="output file (default: logs/outputs/replications_<scenario>.json)")
+    args = parser.parse_args()
+    result = replicate(args.scenario, args.replications, args.engine, args.workers, args.seed, args.confidence)
+    output = args.output or os.path.join("logs", "outputs", "replications_" + os.path.basename(args.scenario).replace(".env.", "") + ".json")
+    with open(output, 'w') as f:
+        json.dump(result, f)
+    print(f"\n{args.replications} replications summarized in {output}")
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
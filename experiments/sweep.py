@@ -0,0 +1,188 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import argparse
+import csv
+import itertools
+import json
+import os
+
+import numpy as np
+
+from multiprocessing import Pool
+
+from main import Application
+from settings import SimulationConfig
+from history import METRIC_NAMES
+from experiments.replication import load_scenario, simulate
+
+# -------------------------------------------------------------------------------------------------------------
+
+SCENARIOS = ["baseline", "future", "inner", "outer", "balanced"]
+
+# -------------------------------------------------------------------------------------------------------------
+
+def format_value(value):
+    """
+    Formats a parameter value the way it is written in a .env file, so that equal values
+    always produce the same configuration.
+
+    Args:
+        value (float or int or str): The parameter value.
+
+    Returns:
+        str: The formatted value.
+    """
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return f"{float(value):.10g}"
+    return str(value)
+
+# -------------------------------------------------------------------------------------------------------------
+
+def grid_points(parameters):
+    """
+    Builds the full factorial grid of the given parameter values.
+
+    Args:
+        parameters (dict): Maps each parameter name to the list of values to test.
+
+    Returns:
+        list: A list of {parameter: value} dictionaries.
+    """
+    names = list(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+# -------------------------------------------------------------------------------------------------------------
+
+def latin_hypercube_points(parameters, samples, rng):
+    """
+    Draws a Latin hypercube sample of the given parameter ranges. Each range is split into
+    `samples` strata and every stratum is used exactly once. Parameters whose bounds are both
+    integers are rounded to integers.
+
+    Args:
+        parameters (dict): Maps each parameter name to its [low, high] range.
+        samples (int): The number of points to draw.
+        rng (np.random.Generator): The random generator used for the sample.
+
+    Returns:
+        list: A list of {parameter: value} dictionaries.
+    """
+    points = [{} for _ in range(samples)]
+    for name, (low, high) in parameters.items():
+        strata = (rng.permutation(samples) + rng.random(samples)) / samples
+        values = low + strata * (high - low)
+        if isinstance(low, int) and isinstance(high, int):
+            values = np.rint(values).astype(int)
+        for point, value in zip(points, values):
+            point[name] = value
+    return points
+
+# -------------------------------------------------------------------------------------------------------------
+
+def build_tasks(spec):
+    """
+    Expands a sweep specification into the configurations to simulate, merging identical ones.
+
+    Args:
+        spec (dict): The sweep specification (see the module usage in the README).
+
+    Returns:
+        tuple: The list of (point id, scenario, parameters, configuration key) rows and the dictionary
+               mapping each configuration key to its (configuration, seed) task.
+
+    Raises:
+        ValueError: If a parameter is unknown or a point gives an invalid configuration.
+    """
+    rng = np.random.default_rng(spec.get("seed", 0))
+    if spec.get("method", "grid") == "lhs":
+        points = latin_hypercube_points(spec["parameters"], spec["samples"], rng)
+    else:
+        points = grid_points(spec["parameters"])
+    replications = spec.get("replications", 1)
+    rows = []
+    tasks = {}
+    for scenario in spec.get("scenarios", SCENARIOS):
+        base = load_scenario(scenario).to_values()
+        for point_id, point in enumerate(points):
+            unknown = [name for name in point if name not in base]
+            if unknown:
+                raise ValueError(f"Unknown parameters for scenario {scenario}: {', '.join(unknown)}")
+            config = SimulationConfig.from_values(dict(base, **{name: format_value(value) for name, value in point.items()}))
+            for seed in range(spec.get("seed", 0), spec.get("seed", 0) + replications):
+                key = (config, seed)
+                tasks[key] = (config, seed)
+                rows.append((point_id, scenario, {name: format_value(value) for name, value in point.items()}, key))
+    return rows, tasks
+
+# -------------------------------------------------------------------------------------------------------------
+
+def run_point(task):
+    """
+    Simulates one configuration of the sweep in a worker process.
+
+    Args:
+        task (tuple): The configuration, its seed and the simulation engine.
+
+    Returns:
+        dict: Maps each region ID to {metric: (time mean, final value)}.
+    """
+    config, seed, engine = task
+    regions, car_models = Application.load_inputs(config)
+    metrics = list(METRIC_NAMES)
+    histories = simulate(config, regions, car_models, engine, seed)
+    return {
+        region_id: {metric: (float(history[m].mean()), float(history[m][-1])) for m, metric in enumerate(metrics)}
+        for region_id, history in histories.items()
+    }
+
+# -------------------------------------------------------------------------------------------------------------
+
+def sweep(spec, workers=None, output="logs/outputs/sweep.csv"):
+    """
+    Runs every distinct configuration of a sweep on a process pool and writes one result table,
+    with a row per point, scenario, seed and region and the time mean and final value of each metric.
+
+    Args:
+        spec (dict): The sweep specification.
+        workers (int): The number of worker processes, defaulting to every core.
+        output (str): The path of the CSV result table.
+
+    Returns:
+        int: The number of distinct configurations simulated.
+    """
+    rows, tasks = build_tasks(spec)
+    keys = list(tasks)
+    engine = spec.get("engine", "vectorized")
+    print(f"\n{len(rows)} sweep points, {len(keys)} distinct configurations.")
+    with Pool(workers or os.cpu_count()) as pool:
+        results = dict(zip(keys, pool.map(run_point, [tasks[key] + (engine,) for key in keys], chunksize=1)))
+    parameters = list(spec["parameters"])
+    with open(output, "w", newline="") as f:
+        writer = None
+        for point_id, scenario, point, key in rows:
+            for region_id, metrics in results[key].items():
+                if writer is None:
+                    header = ["point", "scenario"] + parameters + ["seed", "region"]
+                    header += [f"{metric}_{kind}" for metric in metrics for kind in ("mean", "final")]
+                    writer = csv.writer(f, delimiter=";")
+                    writer.writerow(header)
+                values = [value for mean_final in metrics.values() for value in mean_final]
+                writer.writerow([point_id, scenario] + [point[name] for name in parameters] + [key[1], region_id] + [round(value, 4) for value in values])
+    return len(keys)
+
+# -------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep over the scenario knobs.")
+    parser.add_argument("spec", help="JSON sweep specification")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--output", default="logs/outputs/sweep.csv", help="result table")
+    args = parser.parse_args()
+    with open(args.spec) as f:
+        spec = json.load(f)
+    sweep(spec, args.workers, args.output)
+    print(f"\nSweep results written to {args.output}")
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
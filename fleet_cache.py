@@ -0,0 +1,106 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from entities.fleet import FLEET_RECORD
+from routing import CACHE_FOLDER
+
+# -------------------------------------------------------------------------------------------------------------
+
+FORMAT_VERSION = 1
+
+# -------------------------------------------------------------------------------------------------------------
+
+class FleetCache:
+    """
+    Content-addressed cache of generated fleets. A fleet only depends on the regions, the car models,
+    the parameters of the CarSeeder and the master seed, so it is stored once in a .npy file named
+    after the hash of those inputs, as one FLEET_RECORD per car. Later runs of the same scenario and
+    seed memory-map the file instead of seeding the fleet again, whatever their other parameters.
+
+    Attributes:
+        folder (str): The folder of the cached fleets.
+    """
+    __slots__ = ("folder",)
+
+    def __init__(self, folder=CACHE_FOLDER):
+        self.folder = folder
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def key(car_models, regions, config, seed):
+        """
+        Hashes the inputs of a fleet.
+
+        Args:
+            car_models (list): The car models, in the order of the model indices.
+            regions (list): The regions, in the order of the region indices.
+            config (SimulationConfig): The configuration, of which the seeder parameters are used.
+            seed (int): The master seed of the run.
+
+        Returns:
+            str: The hash of the inputs.
+        """
+        inputs = [
+            FORMAT_VERSION, seed,
+            [(region.id, region.avg_drivers, region.avg_income) for region in regions],
+            [(car_model.id, car_model.autonomy, car_model.price) for car_model in car_models],
+            [config.salary_fluctuation, config.percentage_willing_to_spend, config.probability_of_buying]
+        ]
+        return hashlib.blake2b(json.dumps(inputs).encode(), digest_size=8).hexdigest()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def path(self, key):
+        """
+        Gets the path of a cached fleet.
+
+        Args:
+            key (str): The hash of the inputs of the fleet.
+
+        Returns:
+            str: The path of its .npy file.
+        """
+        return os.path.join(self.folder, f"fleet_{key}.npy")
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def load(self, key):
+        """
+        Memory-maps a cached fleet.
+
+        Args:
+            key (str): The hash of the inputs of the fleet.
+
+        Returns:
+            np.ndarray: The read-only records of the fleet, or None if it is not cached or unreadable.
+        """
+        try:
+            records = np.load(self.path(key), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        return records if records.dtype == FLEET_RECORD else None
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def store(self, key, records):
+        """
+        Writes a fleet to the cache. The file is written under a temporary name and then renamed,
+        so that parallel runs never read a partial fleet.
+
+        Args:
+            key (str): The hash of the inputs of the fleet.
+            records (np.ndarray): The records of the fleet.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(key)
+        partial = f"{path[:-len('.npy')]}.{os.getpid()}.tmp.npy"
+        np.save(partial, records)
+        os.replace(partial, path)
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
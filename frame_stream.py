@@ -0,0 +1,103 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+# -------------------------------------------------------------------------------------------------------------
+
+REGION_FIELDS = (
+    ("cars_present", 0), ("home_charging", 0), ("available_chargers", 0), ("queued_cars", 0), ("cars_charged", 0),
+    ("autonomy", 0), ("home_time", 0), ("charger_utilization", 0), ("queue_size", 0), ("stress_metric", 1),
+    ("wait_time", 0), ("charging_time", 0), ("wait_time_p95", 0), ("wait_time_p99", 0), ("charging_time_p95", 0)
+)
+REGION_FIELD_NAMES = tuple(name for name, _ in REGION_FIELDS)
+
+# -------------------------------------------------------------------------------------------------------------
+
+class FrameEncoder:
+    """
+    Delta encoder of the frames of the map. The static data (region names and positions, the fields
+    of a region and the names of the displayed cars) is sent once, in the init message; every frame
+    then only carries the region fields and car positions that changed since the previous frame, as
+    typed arrays: the flat (region x field) index of each changed field with its new value, and the
+    index of each moved car with its new latitude and longitude. Values are rounded to the decimals
+    shown on the map before they are compared, so that changes too small to see are not sent. A
+    keyframe, with every value, is sent after each init message, e.g. when a client connects.
+
+    Attributes:
+        region_values (np.ndarray): The (regions x fields) values of the last frame.
+        car_positions (np.ndarray): The (cars x 2) latitude and longitude of the last frame.
+        keyframe (bool): Whether the next frame must carry every value, after a new init message.
+    """
+    __slots__ = ("region_values", "car_positions", "keyframe")
+
+    def __init__(self, regions, cars):
+        self.region_values = np.zeros((regions, len(REGION_FIELDS)), dtype=np.float32)
+        self.car_positions = np.zeros((cars, 2), dtype=np.float32)
+        self.keyframe = True
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def request_keyframe(self):
+        """
+        Makes the next frame a keyframe, preceded by an init message.
+        """
+        self.keyframe = True
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def init_message(regions, cars):
+        """
+        Builds the init message with the static data of the map.
+
+        Args:
+            regions (list): The regions, in the order of the frames.
+            cars (list): The displayed cars, in the order of the frames.
+
+        Returns:
+            dict: The names and positions of the regions, the names and decimals of the region fields
+                  and the names of the cars.
+        """
+        return {
+            'regions': [{'name': region.id, 'lat': region.latitude, 'lng': region.longitude} for region in regions],
+            'fields': list(REGION_FIELD_NAMES),
+            'decimals': [decimals for _, decimals in REGION_FIELDS],
+            'cars': [car.id for car in cars]
+        }
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def encode(self, region_values, car_positions):
+        """
+        Encodes the changes since the previous frame, or every value for a keyframe.
+
+        Args:
+            region_values (np.ndarray): The (regions x fields) values of the regions, in the order of REGION_FIELDS.
+            car_positions (np.ndarray): The (cars x 2) latitude and longitude of the displayed cars.
+
+        Returns:
+            dict: The frame, with "keyframe", "region_index" (uint32), "region_value" (float32),
+                  "car_index" (uint32) and "car_position" (float32 latitude, longitude pairs) as bytes.
+        """
+        decimals = np.array([10.0 ** places for _, places in REGION_FIELDS])
+        values = (np.round(region_values * decimals) / decimals).astype(np.float32)
+        positions = np.asarray(car_positions, dtype=np.float32).reshape(-1, 2)
+        if self.keyframe:
+            region_index = np.arange(values.size, dtype=np.uint32)
+            car_index = np.arange(len(positions), dtype=np.uint32)
+        else:
+            region_index = np.flatnonzero(values != self.region_values).astype(np.uint32)
+            car_index = np.flatnonzero((positions != self.car_positions).any(axis=1)).astype(np.uint32)
+        frame = {
+            'keyframe': self.keyframe,
+            'region_index': region_index.tobytes(),
+            'region_value': values.ravel()[region_index].tobytes(),
+            'car_index': car_index.tobytes(),
+            'car_position': positions[car_index].tobytes()
+        }
+        self.region_values = values
+        self.car_positions = positions
+        self.keyframe = False
+        return frame
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,204 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import json
+import math
+import os
+
+import numpy as np
+
+# -------------------------------------------------------------------------------------------------------------
+
+OUTPUT_FOLDER = "logs/outputs/"
+HISTORY_FILE = "history.npz"
+
+METRICS = (
+    ("cars_present", np.int32),
+    ("cars_home_charging", np.int32),
+    ("available_chargers", np.int32),
+    ("queued_cars", np.int32),
+    ("cars_charged", np.int32),
+    ("average_autonomy", np.float64),
+    ("average_home_time", np.float64),
+    ("charger_utilization", np.float64),
+    ("average_queue_size", np.float64),
+    ("stress_metric", np.float64),
+    ("average_wait_time", np.float64),
+    ("average_charging_time", np.float64),
+    ("wait_time_std", np.float64),
+    ("wait_time_p50", np.float64),
+    ("wait_time_p95", np.float64),
+    ("wait_time_p99", np.float64),
+    ("charging_time_std", np.float64),
+    ("charging_time_p50", np.float64),
+    ("charging_time_p95", np.float64),
+    ("charging_time_p99", np.float64)
+)
+METRIC_NAMES = tuple(name for name, _ in METRICS)
+
+# -------------------------------------------------------------------------------------------------------------
+
+class HistoryRecorder:
+    """
+    Columnar history of the region metrics. Every metric is a preallocated (samples x regions) block
+    of its own type, sized to the configured run and grown only if the simulation runs longer, so
+    recording a sample writes one row per metric for all the regions at once. The metrics are
+    sampled every interval steps, and the derived ones are only computed for the samples. The
+    history is saved as a compressed NumPy archive, with a per-region JSON export for older tools.
+
+    Attributes:
+        regions (list): The regions of the simulation, in column order.
+        interval (int): The number of steps between two samples.
+        columns (dict): Maps each metric name to its (capacity x regions) block.
+        steps (np.ndarray): The step of each sample.
+        length (int): The number of recorded samples.
+    """
+    __slots__ = ("regions", "interval", "columns", "steps", "length")
+
+    def __init__(self, regions, steps, interval=1):
+        self.regions = regions
+        self.interval = interval
+        samples = max(self.samples(steps), 1)
+        self.columns = {name: np.zeros((samples, len(regions)), dtype=dtype) for name, dtype in METRICS}
+        self.steps = np.zeros(samples, dtype=np.int64)
+        self.length = 0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def samples(self, steps):
+        """
+        Counts the samples taken over a number of consecutive steps, at most.
+
+        Args:
+            steps (int): The number of steps.
+
+        Returns:
+            int: The number of samples, one every interval steps.
+        """
+        return math.ceil(steps / self.interval)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def reserve(self, samples):
+        """
+        Grows the blocks so that they hold at least a given number of samples.
+
+        Args:
+            samples (int): The number of samples to hold.
+        """
+        capacity = len(self.steps)
+        if samples <= capacity:
+            return
+        capacity = max(samples, 2 * capacity)
+        for name, block in self.columns.items():
+            grown = np.zeros((capacity, block.shape[1]), dtype=block.dtype)
+            grown[:self.length] = block[:self.length]
+            self.columns[name] = grown
+        steps = np.zeros(capacity, dtype=np.int64)
+        steps[:self.length] = self.steps[:self.length]
+        self.steps = steps
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def due(self, step):
+        """
+        Checks whether the metrics of a step are sampled.
+
+        Args:
+            step (int): The simulation step.
+
+        Returns:
+            bool: True if the step is a multiple of the interval.
+        """
+        return step % self.interval == 0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def record(self, step):
+        """
+        Records the current metrics of every region as the next sample of the history, if the
+        step is sampled.
+
+        Args:
+            step (int): The simulation step that just ran.
+        """
+        if not self.due(step):
+            return
+        self.reserve(self.length + 1)
+        values = np.array([region.metrics() for region in self.regions], dtype=np.float64).reshape(len(self.regions), len(METRICS))
+        for m, name in enumerate(METRIC_NAMES):
+            self.columns[name][self.length] = values[:, m]
+        self.steps[self.length] = step
+        self.length += 1
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def metric(self, name):
+        """
+        Gets the recorded history of a metric.
+
+        Args:
+            name (str): The name of the metric.
+
+        Returns:
+            np.ndarray: A (samples x regions) view of the recorded values.
+        """
+        return self.columns[name][:self.length]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def region(self, r):
+        """
+        Gets the recorded history of a region.
+
+        Args:
+            r (int): The index of the region.
+
+        Returns:
+            np.ndarray: A (metrics x samples) array, in the order of METRICS.
+        """
+        return np.array([self.columns[name][:self.length, r] for name in METRIC_NAMES], dtype=np.float64)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def restore(self, history):
+        """
+        Replaces the recorded history, e.g. with the one of a snapshot.
+
+        Args:
+            history (dict): Maps each metric name to its (samples x regions) values, and "step" to the
+                            step of each sample.
+        """
+        samples = len(history["step"])
+        self.length = 0
+        self.reserve(samples)
+        for name in METRIC_NAMES:
+            self.columns[name][:samples] = history[name]
+        self.steps[:samples] = history["step"]
+        self.length = samples
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def save(self, folder=OUTPUT_FOLDER, json_export=False):
+        """
+        Writes the history to folder/history.npz: one (samples x regions) array per metric, the
+        region IDs in column order, the step of each sample and the sampling interval. Optionally,
+        also writes the former folder/<region ID>.json files, with the values rounded to two decimals.
+
+        Args:
+            folder (str): The output folder.
+            json_export (bool): Whether to write the per-region JSON files too.
+        """
+        os.makedirs(folder, exist_ok=True)
+        arrays = {name: self.metric(name) for name in METRIC_NAMES}
+        np.savez_compressed(
+            os.path.join(folder, HISTORY_FILE), region_id=np.array([region.id for region in self.regions]),
+            step=self.steps[:self.length], interval=np.array(self.interval), **arrays
+        )
+        if not json_export:
+            return
+        for r, region in enumerate(self.regions):
+            history = {name: [round(value, 2) for value in values[:, r].tolist()] for name, values in arrays.items()}
+            with open(os.path.join(folder, region.id + ".json"), "w") as file:
+                json.dump(history, file)
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -1,35 +1,236 @@
 # -------------------------------------------------------------------------------------------------------------
 
-import logging
+import atexit
+import os
+import queue
+import threading
+
+# -------------------------------------------------------------------------------------------------------------
+
+CATEGORIES = ("cars", "regions")
+
+# -------------------------------------------------------------------------------------------------------------
+
+class LogCategory:
+    """
+    A switch shared by all the loggers of a category, so that a whole category can be
+    enabled or disabled at any time.
+
+    Attributes:
+        name (str): The name of the category.
+        enabled (bool): Whether the loggers of the category write their records.
+    """
+    __slots__ = ("name", "enabled")
+
+    def __init__(self, name, enabled=True):
+        self.name = name
+        self.enabled = enabled
+
+# -------------------------------------------------------------------------------------------------------------
+
+class LogWriter:
+    """
+    Background writer shared by every logger of the process. Records are put on a queue by the
+    simulation and formatted and written by a daemon thread, in batches grouped by file.
+
+    Attributes:
+        folder (str): The folder where the log files are written.
+        batch_size (int): The maximum number of records written per batch.
+        records (queue.SimpleQueue): The queue of pending (filename, event, fields) records.
+        files (dict): The open log files, by filename.
+        pid (int): The process that owns the writer thread.
+        thread (threading.Thread): The writer thread.
+    """
+    def __init__(self, folder="logs/outputs/", batch_size=4096):
+        self.folder = folder
+        self.batch_size = batch_size
+        self.records = queue.SimpleQueue()
+        self.files = {}
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.work, name="log-writer", daemon=True)
+        self.thread.start()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def submit(self, filename, event, fields):
+        """
+        Queues a record for writing.
+
+        Args:
+            filename (str): The log file, without folder and extension.
+            event (str): The name of the event.
+            fields (dict): The values recorded with the event.
+        """
+        self.records.put((filename, event, fields))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def work(self):
+        """
+        Writes the queued records until the writer is closed. Each batch takes every record already
+        queued (up to batch_size) and issues one write per file.
+        """
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            lines = {}
+            markers = []
+            for filename, event, fields in batch:
+                if filename is None:
+                    markers.append(event)
+                    running = running and event is not None
+                    continue
+                text = event + "".join(f" {key}={value}" for key, value in fields.items()) if fields else event
+                lines.setdefault(filename, []).append(text)
+            for filename, texts in lines.items():
+                file = self.files.get(filename)
+                if file is None:
+                    file = self.files[filename] = open(os.path.join(self.folder, filename + ".log"), "a")
+                file.write("\n".join(texts) + "\n")
+            for file in self.files.values():
+                file.flush()
+            for marker in markers:
+                if marker is not None:
+                    marker.set()
+        for file in self.files.values():
+            file.close()
+        self.files.clear()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def flush(self):
+        """
+        Blocks until every record queued so far has been written.
+        """
+        done = threading.Event()
+        self.records.put((None, done, None))
+        done.wait()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def close(self):
+        """
+        Writes the pending records, closes the files and stops the writer thread.
+        """
+        self.records.put((None, None, None))
+        self.thread.join()
 
 # -------------------------------------------------------------------------------------------------------------
 
 class Logger:
     """
-    A simple logger class that writes log messages to a file.
+    A logger that writes structured records to a file through the shared background writer.
+    When its category is disabled, logging is a no-op that returns before any formatting.
 
     Attributes:
-        logger (logging.Logger): The logger instance used to log messages.
+        filename (str): The log file, without folder and extension.
+        category (LogCategory): The category switch of the logger.
     """
-    def __init__(self, *, filename : str) -> None:
-        self.logger = logging.getLogger(filename)
-        filepath = "logs/outputs/" + filename + ".log"
-        if not self.logger.handlers:
-            handler = logging.FileHandler(filepath)
-            formatter = logging.Formatter("%(message)s")
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-            self.logger.setLevel(logging.INFO)
-            
-    # ---------------------------------------------------------------------------------------------------------
-    
-    def log(self, message):
-        """
-        Logs a message with the info level.
+    __slots__ = ("filename", "category")
+
+    _categories = {}
+    _writer = None
+    _lock = threading.Lock()
+
+    def __init__(self, *, filename : str, category : str = None) -> None:
+        self.filename = filename
+        self.category = Logger.get_category(category or filename)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def log(self, event, **fields):
+        """
+        Logs an event with the values that describe it, e.g. log("charging_started", available_chargers=3).
+
+        Args:
+            event (str): The name of the event.
+            **fields: The values recorded with the event.
+        """
+        if not self.category.enabled:
+            return
+        writer = Logger._writer
+        if writer is None or writer.pid != os.getpid():
+            writer = Logger.start_writer()
+        writer.submit(self.filename, event, fields)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def get_category(name):
+        """
+        Gets the switch of a category, creating it (enabled) the first time.
+
+        Args:
+            name (str): The name of the category.
+
+        Returns:
+            LogCategory: The category switch.
+        """
+        category = Logger._categories.get(name)
+        if category is None:
+            category = Logger._categories[name] = LogCategory(name)
+        return category
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def configure(enabled):
+        """
+        Enables the given categories and disables every other one.
 
         Args:
-            message (str): The message to log.
+            enabled (iterable): The names of the categories to enable.
         """
-        self.logger.info(message)    
-        
+        enabled = set(enabled)
+        for name in set(CATEGORIES) | set(Logger._categories):
+            Logger.get_category(name).enabled = name in enabled
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def start_writer():
+        """
+        Starts the background writer of the current process (a forked process gets its own).
+
+        Returns:
+            LogWriter: The writer.
+        """
+        with Logger._lock:
+            if Logger._writer is None or Logger._writer.pid != os.getpid():
+                Logger._writer = LogWriter()
+            return Logger._writer
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def flush():
+        """
+        Blocks until every record logged so far has been written.
+        """
+        writer = Logger._writer
+        if writer is not None and writer.pid == os.getpid():
+            writer.flush()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def close():
+        """
+        Writes the pending records and stops the background writer.
+        """
+        with Logger._lock:
+            writer = Logger._writer
+            Logger._writer = None
+        if writer is not None and writer.pid == os.getpid():
+            writer.close()
+
+# -------------------------------------------------------------------------------------------------------------
+
+atexit.register(Logger.close)
+
 # -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -1,37 +1,77 @@
 # -------------------------------------------------------------------------------------------------------------
 
+import argparse
 import csv
+import multiprocessing
 import os
-import threading
 
-from dotenv import load_dotenv
-from flask import Flask, render_template
-from flask_socketio import SocketIO
-from flask_cors import CORS
+import numpy as np
 
-from simulation import Simulation
+from settings import SimulationConfig
+from simulation import Simulation, SharedStateVisualization, TIME_LABELS
+from shared_state import SharedState, FrameServer
+from frame_stream import FrameEncoder
+from replay import ReplayFile, ReplayServer
+from engines.vectorized import VectorizedSimulation
+from engines.event_driven import EventDrivenSimulation
+from entities.fleet import Fleet
+from fleet_cache import FleetCache
 from entities.region import Region
+from entities.station import Station
 from entities.car_model import CarModel
 from entities.car_seeder import CarSeeder
-from entities.car import Car
-
-# -------------------------------------------------------------------------------------------------------------
-
-os.environ.clear()
-load_dotenv()
+from entities.car import Car, FleetParameters
+from random_streams import RandomStreams
 
 # -------------------------------------------------------------------------------------------------------------
  
 class Application:
     '''
     The Application class initializes and runs a Flask web application with SocketIO support.
+    In headless mode no web server is created and Flask is never imported. Otherwise the simulation
+    runs in its own process and publishes the state of the map to shared memory, from where this
+    process serves it, so the server and the simulation do not compete for the GIL. In replay mode
+    nothing is simulated: a recorded replay file is played on the map instead.
     
     Attributes:
-        app (Flask): The Flask web application instance.
-        socketio (SocketIO): The SocketIO instance for real-time communication.
+        config (SimulationConfig): The configuration of the run.
+        headless (bool): Whether the simulation runs without visualization.
+        engine (str): The simulation engine, either "object", "vectorized" or "event" (the last two are always headless).
+        seed (int): The master seed of the run, or None for a random one.
+        snapshot (str): Path of a snapshot to resume from instead of generating the cars, or None.
+        save_snapshot (str): Path where a snapshot is saved at the end of the run, or None.
+        record (str): Path of a replay file where the map of every step is recorded, or None.
+        replay (str): Path of a replay file to play instead of simulating, or None.
+        app (Flask): The Flask web application instance, or None in headless mode.
+        socketio (SocketIO): The SocketIO instance for real-time communication, or None in headless mode.
     '''
-    def __init__(self):
-        self.delete_logs()
+    def __init__(self, config, headless=False, engine="object", seed=None, snapshot=None, save_snapshot=None,
+                 record=None, replay=None):
+        if replay is None:
+            self.delete_logs()
+        self.config = config
+        self.engine = engine
+        self.seed = seed
+        self.snapshot = snapshot
+        self.save_snapshot = save_snapshot
+        self.record = record
+        self.replay = replay
+        self.headless = replay is None and (headless or engine != "object")
+        self.app = None
+        self.socketio = None
+        if not self.headless:
+            self.create_server()
+            
+    # ---------------------------------------------------------------------------------------------------------
+    
+    def create_server(self):
+        """
+        Creates the Flask application and the SocketIO server used by the visualization.
+        The web dependencies are imported here so that headless runs do not pay for them.
+        """
+        from flask import Flask, render_template
+        from flask_socketio import SocketIO
+        from flask_cors import CORS
         self.app = Flask(__name__)
         CORS(self.app, resources={r"/*": {"origins": "*"}})
         self.socketio = SocketIO(self.app)
@@ -56,7 +96,8 @@ class Application:
                     
     # ---------------------------------------------------------------------------------------------------------
 
-    def read_region_data(self, filename, regions):
+    @staticmethod
+    def read_region_data(filename, regions):
         """
         Reads region data from a CSV file and appends it to the provided regions list.
 
@@ -80,7 +121,39 @@ class Application:
                 
     # ---------------------------------------------------------------------------------------------------------
 
-    def read_car_model_data(self, filename, cars):
+    @staticmethod
+    def read_station_data(filename, regions):
+        """
+        Reads the charging stations from a CSV file and gives them to their regions. Each region listed
+        in the file replaces its charger pool by its stations; the other regions keep their pool.
+
+        Args:
+            filename (str): The path to the CSV file containing the station data.
+            regions (list): The regions of the simulation.
+
+        Raises:
+            ValueError: If a station belongs to an unknown region.
+        """
+        by_id = {region.id: region for region in regions}
+        stations = {}
+        with open(filename, "r") as csvfile:
+            reader = csv.reader(csvfile, delimiter=";")
+            next(reader)
+            for row in reader:
+                station_id, region_id, latitude, longitude, capacity = [value.strip() for value in row]
+                region = by_id.get(region_id)
+                if region is None:
+                    raise ValueError(f"Station {station_id} of {filename} belongs to an unknown region: {region_id}")
+                latitude = float(latitude.replace(",", "."))
+                longitude = float(longitude.replace(",", "."))
+                stations.setdefault(region_id, []).append(Station(station_id, region, latitude, longitude, int(capacity)))
+        for region_id, region_stations in stations.items():
+            by_id[region_id].set_stations(region_stations)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def read_car_model_data(filename, cars):
         """
         Reads car model data from a CSV file and appends it to the provided list of car models.
 
@@ -99,62 +172,332 @@ class Application:
                 
     # ---------------------------------------------------------------------------------------------------------
     
-    def generate_cars(self, car_models, regions):
+    @staticmethod
+    def seed_fleet(car_models, regions, config, streams, verbose=True, cached=False):
         """
-        Generates a list of Car objects based on the provided car models and regions.
+        Gets the records of the cars of a run: seeded with the CarSeeder, or memory-mapped from the
+        fleet cache when cached and the same inputs were already seeded.
 
         Args:
             car_models (list): A list of car model objects to be used for generating cars.
             regions (list): A list of region objects where the cars will be generated.
+            config (SimulationConfig): The configuration of the run.
+            streams (RandomStreams): The random streams of the run.
+            verbose (bool): Whether to print the number of cars of each model per region.
+            cached (bool): Whether to use the fleet cache; only reproducible (seeded) runs should.
+
+        Returns:
+            np.ndarray: One FLEET_RECORD per car, ordered by home region, then model, then number.
+        """
+        cache = FleetCache() if cached and config.fleet_cache else None
+        key = FleetCache.key(car_models, regions, config, streams.seed) if cache else None
+        records = cache.load(key) if cache else None
+        if records is not None:
+            if verbose:
+                print(f"\nFleet loaded from {cache.path(key)}")
+            return records
+        cars_data = CarSeeder(car_models, regions, config, streams=streams).run(verbose)
+        records = Fleet.records(cars_data, car_models, regions, streams)
+        if cache:
+            cache.store(key, records)
+        return records
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def generate_cars(car_models, regions, config, streams, verbose=True, cached=False):
+        """
+        Generates a list of Car objects based on the provided car models and regions. The cars start
+        with the initial autonomy of their record, as in the vectorized engine.
+
+        Args:
+            car_models (list): A list of car model objects to be used for generating cars.
+            regions (list): A list of region objects where the cars will be generated.
+            config (SimulationConfig): The configuration of the run.
+            streams (RandomStreams): The random streams of the run; each car gets its own stream.
+            verbose (bool): Whether to print the number of cars of each model per region.
+            cached (bool): Whether to use the fleet cache.
 
         Returns:
             list: A list of Car objects generated for the specified regions and car models.
         """
-        cars_data = CarSeeder(car_models, regions).run()
+        records = Application.seed_fleet(car_models, regions, config, streams, verbose, cached)
+        homes = records["home"].tolist()
+        models = records["model"].tolist()
+        keys = records["key"].tolist()
+        autonomies = records["autonomy"].tolist()
+        fleet = FleetParameters(regions, config)
         cars = []
-        for region in regions:
-            for car_model in cars_data[region.id]:
-                for i in range(cars_data[region.id][car_model]):
-                    id = region.id + '_' + car_model.id + '_' + str(i)
-                    car = Car(id, car_model.autonomy, int(os.getenv("CAR_VELOCITY")), region, regions)
-                    cars.append(car)
-            region.total_cars = sum(cars_data[region.id].values())
+        number = 0
+        for i, (home, model, key, autonomy) in enumerate(zip(homes, models, keys, autonomies)):
+            number = number + 1 if i and homes[i - 1] == home and models[i - 1] == model else 0
+            region, car_model = regions[home], car_models[model]
+            id = region.id + '_' + car_model.id + '_' + str(number)
+            cars.append(Car(id, car_model.autonomy, region, fleet, key, autonomy))
+        for region, count in zip(regions, np.bincount(records["home"], minlength=len(regions)).tolist()):
+            region.total_cars = count
         return cars
     
     # ---------------------------------------------------------------------------------------------------------
+    
+    @staticmethod
+    def generate_fleet(car_models, regions, config, streams, verbose=True, cached=False):
+        """
+        Generates a structure-of-arrays Fleet based on the provided car models and regions.
 
-    def main(self):
+        Args:
+            car_models (list): A list of car model objects to be used for generating cars.
+            regions (list): A list of region objects where the cars will be generated.
+            config (SimulationConfig): The configuration of the run.
+            streams (RandomStreams): The random streams of the run.
+            verbose (bool): Whether to print the number of cars of each model per region.
+            cached (bool): Whether to use the fleet cache.
+
+        Returns:
+            Fleet: The fleet of cars generated for the specified regions and car models.
+        """
+        records = Application.seed_fleet(car_models, regions, config, streams, verbose, cached)
+        return Fleet.from_records(records, car_models, regions)
+    
+    # ---------------------------------------------------------------------------------------------------------
+    
+    @staticmethod
+    def load_inputs(config):
         """
-        Main function to initialize and run the simulation.
+        Reads the regions of the configured scenario, with their charging stations if a station file
+        is configured, and the available car models.
+
+        Args:
+            config (SimulationConfig): The configuration of the scenario.
+
+        Returns:
+            tuple: The list of Region objects and the list of CarModel objects.
         """
         region_file = "data/regions.csv"
-        improvement_level = int(os.getenv("REGION_IMPROVEMENT"))
+        improvement_level = config.region_improvement
         if (improvement_level != 0):
             region_file = "data/regions_improved_" + str(improvement_level) + ".csv"
         regions = []
         if os.path.exists(region_file):
-            self.read_region_data(region_file, regions)
+            Application.read_region_data(region_file, regions)
+        if config.stations:
+            Application.read_station_data(config.stations, regions)
         
         car_file = "data/cars.csv"
         car_models = []
         if os.path.exists(car_file):
-            self.read_car_model_data(car_file, car_models)
-            
-        cars = self.generate_cars(car_models, regions)
-        print(f"\n{len(cars)} cars generated.")
+            Application.read_car_model_data(car_file, car_models)
+        return regions, car_models
+    
+    # ---------------------------------------------------------------------------------------------------------
+    
+    @staticmethod
+    def create_simulation(engine, config, car_models, regions, app=None, socketio=None, headless=True, seed=None, verbose=True):
+        """
+        Generates the cars and creates the simulation for the selected engine.
+
+        Args:
+            engine (str): The simulation engine, either "object", "vectorized" or "event".
+            config (SimulationConfig): The configuration of the run.
+            car_models (list): A list of car model objects to be used for generating cars.
+            regions (list): A list of region objects where the cars will be generated.
+            app (Flask): The Flask web application instance used by the visualization.
+            socketio (SocketIO): The SocketIO instance used by the visualization.
+            headless (bool): Whether the object engine runs without visualization.
+            seed (int): The master seed of the run's random streams, or None for a random one. Seeded runs
+                        reuse the fleet of earlier runs with the same inputs from the fleet cache.
+            verbose (bool): Whether to print the generated cars.
+
+        Returns:
+            Simulation: The simulation ready to run.
+        """
+        streams = RandomStreams(seed)
+        if verbose:
+            print(f"\nMaster seed: {streams.seed}")
+        if engine == "vectorized":
+            fleet = Application.generate_fleet(car_models, regions, config, streams, verbose, cached=seed is not None)
+            if verbose:
+                print(f"\n{fleet.size} cars generated.")
+            return VectorizedSimulation(fleet, regions, config)
+        cars = Application.generate_cars(car_models, regions, config, streams, verbose, cached=seed is not None)
+        if verbose:
+            print(f"\n{len(cars)} cars generated.")
+        if engine == "event":
+            return EventDrivenSimulation(cars, regions, config)
+        return Simulation(cars, regions, config, app, socketio, headless=headless, streams=streams)
+    
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def restore_simulation(engine, path, config, regions, app=None, socketio=None, headless=True):
+        """
+        Creates the simulation for the selected engine from a snapshot, in the regions of the configured scenario.
+
+        Args:
+            engine (str): The simulation engine, either "object" or "event".
+            path (str): The path of the snapshot file.
+            config (SimulationConfig): The configuration to resume with.
+            regions (list): The regions of the configured scenario.
+            app (Flask): The Flask web application instance used by the visualization.
+            socketio (SocketIO): The SocketIO instance used by the visualization.
+            headless (bool): Whether the object engine runs without visualization.
 
-        simulation = Simulation(cars, regions, self.app, self.socketio)
+        Returns:
+            Simulation: The simulation ready to resume.
+        """
+        if engine == "event":
+            simulation = EventDrivenSimulation.load_snapshot(path, config, regions)
+        else:
+            simulation = Simulation.load_snapshot(path, config, regions, app=app, socketio=socketio, headless=headless)
+        print(f"\n{len(simulation.cars)} cars restored from {path} at step {simulation.current_step}.")
+        return simulation
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def build_simulation(engine, config, seed=None, snapshot=None, app=None, socketio=None, headless=True):
+        """
+        Reads the inputs of the configured scenario and creates the simulation, from a snapshot or
+        with freshly generated cars.
+
+        Args:
+            engine (str): The simulation engine, either "object", "vectorized" or "event".
+            config (SimulationConfig): The configuration of the run.
+            seed (int): The master seed of the run, or None for a random one.
+            snapshot (str): Path of a snapshot to resume from, or None.
+            app (Flask): The Flask web application instance used by an in-process visualization.
+            socketio (SocketIO): The SocketIO instance used by an in-process visualization.
+            headless (bool): Whether the object engine runs without an in-process visualization.
+
+        Returns:
+            Simulation: The simulation ready to run.
+        """
+        regions, car_models = Application.load_inputs(config)
+        if snapshot:
+            return Application.restore_simulation(engine, snapshot, config, regions, app, socketio, headless)
+        return Application.create_simulation(engine, config, car_models, regions, app, socketio, headless, seed)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def simulate_and_publish(config, engine, seed, snapshot, save_snapshot, record, connection):
+        """
+        Runs the simulation in the simulation process, publishing the state of the map to shared memory.
+        The name of the shared memory block and the init message of the map are sent to the web
+        process once the simulation is created.
+
+        Args:
+            config (SimulationConfig): The configuration of the run.
+            engine (str): The simulation engine.
+            seed (int): The master seed of the run, or None for a random one.
+            snapshot (str): Path of a snapshot to resume from, or None.
+            save_snapshot (str): Path where a snapshot is saved at the end of the run, or None.
+            record (str): Path of a replay file where the map of every step is recorded, or None.
+            connection (multiprocessing.connection.Connection): The connection to the web process.
+        """
+        simulation = Application.build_simulation(engine, config, seed, snapshot)
+        visualization = SharedStateVisualization(simulation.regions, simulation.cars, config, simulation.streams, simulation.router)
+        simulation.visualization = visualization
+        connection.send((visualization.state.name, FrameEncoder.init_message(simulation.regions, visualization.displayed_cars)))
+        connection.close()
+        print("\nStarting simulation...")
+        simulation.run(steps=config.total_steps, snapshot=save_snapshot, record=record)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def serve(self):
+        """
+        Starts the simulation process and serves the map from this process until the simulation ends.
+        """
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=Application.simulate_and_publish,
+            args=(self.config, self.engine, self.seed, self.snapshot, self.save_snapshot, self.record, sender)
+        )
+        process.start()
+        sender.close()
+        try:
+            name, init = receiver.recv()
+        except EOFError:
+            process.join()
+            raise SystemExit("The simulation process ended before starting the simulation.")
+        state = SharedState(len(init['regions']), len(init['cars']), name)
+        server = FrameServer(self.socketio, state, init, TIME_LABELS, self.config, process)
+        print(f"Visualization running at http://localhost:8000")
+        self.socketio.start_background_task(server.serve)
+        try:
+            self.socketio.run(self.app, port=8000)
+        finally:
+            process.join()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def serve_replay(self):
+        """
+        Plays the replay file on the map until the server is stopped.
+        """
+        replay = ReplayFile(self.replay)
+        print(f"\nReplaying steps {replay.first_step} to {replay.last_step} of {self.replay}")
+        server = ReplayServer(self.socketio, replay, self.config)
+        print(f"Visualization running at http://localhost:8000")
+        self.socketio.start_background_task(server.serve)
+        try:
+            self.socketio.run(self.app, port=8000)
+        finally:
+            replay.close()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def main(self):
+        """
+        Main function to initialize and run the simulation, or to play a replay.
+        """
+        if self.replay:
+            self.serve_replay()
+            return
+        if not self.headless:
+            self.serve()
+            return
+        simulation = self.build_simulation(self.engine, self.config, self.seed, self.snapshot)
         print("\nStarting simulation...")
-        simulation.run(steps=int(os.getenv("STEPS_PER_DAY"))*int(os.getenv("NUMBER_OF_DAYS"))) 
+        simulation.run(steps=self.config.total_steps, snapshot=self.save_snapshot, record=self.record) 
         
 # -------------------------------------------------------------------------------------------------------------
 
 if __name__ == "__main__":
-    app = Application()
-    server_thread = threading.Thread(
-        target=app.socketio.run, args=(app.app,), kwargs={'port': 8000})
-    server_thread.start()
+    parser = argparse.ArgumentParser(description="Recharging stations distribution simulation.")
+    parser.add_argument("--config", default=".env",
+                        help="scenario .env file with the simulation parameters (default: .env)")
+    parser.add_argument("--headless", action="store_true",
+                        help="run at maximum speed without the web visualization")
+    parser.add_argument("--engine", choices=["object", "vectorized", "event"], default="object",
+                        help="simulation engine; the vectorized and event engines always run headless")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="master seed; runs with the same seed are reproducible")
+    parser.add_argument("--snapshot", default=None,
+                        help="resume from a snapshot instead of generating the cars (object and event engines)")
+    parser.add_argument("--save-snapshot", default=None,
+                        help="save a snapshot of the final state to this file (object engine)")
+    parser.add_argument("--record", default=None,
+                        help="record the map of every step to this replay file (object engine)")
+    parser.add_argument("--replay", default=None,
+                        help="play a replay file on the map instead of simulating")
+    args = parser.parse_args()
+    if args.snapshot and args.engine == "vectorized":
+        parser.error("--snapshot is only supported by the object and event engines")
+    if args.save_snapshot and args.engine != "object":
+        parser.error("--save-snapshot is only supported by the object engine")
+    if args.record and args.engine != "object":
+        parser.error("--record is only supported by the object engine")
+    if args.replay and args.headless:
+        parser.error("--replay needs the web visualization")
+    try:
+        config = SimulationConfig.from_env_file(args.config)
+    except ValueError as e:
+        parser.error(f"{args.config}: {e}")
+    app = Application(config, headless=args.headless, engine=args.engine, seed=args.seed,
+                      snapshot=args.snapshot, save_snapshot=args.save_snapshot, record=args.record, replay=args.replay)
     app.main()
-    server_thread.join()
     
 # -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
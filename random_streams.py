@@ -0,0 +1,137 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import hashlib
+
+import numpy as np
+
+# -------------------------------------------------------------------------------------------------------------
+
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+MASK_64 = (1 << 64) - 1
+
+# -------------------------------------------------------------------------------------------------------------
+
+def splitmix64(x):
+    """
+    Applies the SplitMix64 mixing function to an array of 64-bit integers.
+
+    Args:
+        x (np.ndarray): The values to mix, as an array of np.uint64.
+
+    Returns:
+        np.ndarray: The mixed values, as an array of np.uint64.
+    """
+    with np.errstate(over="ignore"):
+        x = np.asarray(x, dtype=np.uint64) + np.uint64(GOLDEN_GAMMA)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+# -------------------------------------------------------------------------------------------------------------
+
+class RandomStreams:
+    """
+    Independent, reproducible random streams derived from a single master seed.
+
+    Every stream is keyed by what it drives (a car, a region, the seeder of a region, ...) instead of
+    by creation order, so a run gives the same draws no matter how the fleet is split across threads
+    or processes. Cars draw from counter-based generators keyed by the car key instead of holding a
+    generator each: object cars number their draws, and the vectorized engine counts steps and slots
+    so that a whole batch of cars can be drawn at once.
+
+    Attributes:
+        seed (int): The master seed. A random one is drawn when none is given.
+    """
+    def __init__(self, seed=None):
+        self.seed = int(seed) if seed is not None else int(np.random.SeedSequence().entropy)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def key(self, kind, name):
+        """
+        Derives the 64-bit key of a stream from the master seed.
+
+        Args:
+            kind (str): The kind of stream, e.g. "car", "region", "seeder" or "display".
+            name (str): The identifier of the stream within its kind.
+
+        Returns:
+            int: The key of the stream.
+        """
+        digest = hashlib.blake2b(f"{self.seed}:{kind}:{name}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def generator(self, kind, name):
+        """
+        Creates the numpy Generator of a stream.
+
+        Args:
+            kind (str): The kind of stream.
+            name (str): The identifier of the stream within its kind.
+
+        Returns:
+            np.random.Generator: The generator of the stream.
+        """
+        return np.random.default_rng(self.key(kind, name))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def car_keys(self, region_id, model_id, count):
+        """
+        Derives the keys of the cars of a given model seeded in a region, numbered from 0.
+
+        Args:
+            region_id (str): The ID of the home region of the cars.
+            model_id (str): The ID of the car model.
+            count (int): The number of cars.
+
+        Returns:
+            np.ndarray: The key of each car, as np.uint64.
+        """
+        base = np.uint64(self.key("car", region_id + '_' + model_id))
+        return splitmix64(base + np.arange(count, dtype=np.uint64))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def draws(key, counter, count):
+        """
+        Draws values of a car's own stream: value number n is the SplitMix64 output
+        splitmix64(key + n * GOLDEN_GAMMA), so any run of values can be drawn at once
+        (Car.random computes the same values one at a time on plain integers).
+
+        Args:
+            key (int): The key of the car.
+            counter (int): The number of values the car has drawn so far.
+            count (int): The number of values to draw.
+
+        Returns:
+            np.ndarray: The uniform values in [0, 1).
+        """
+        with np.errstate(over="ignore"):
+            counters = np.uint64(counter) + np.arange(count, dtype=np.uint64)
+            values = splitmix64(np.uint64(key) + counters * np.uint64(GOLDEN_GAMMA))
+        return (values >> np.uint64(11)) * (1.0 / (1 << 53))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def uniforms(keys, step, slot):
+        """
+        Counter-based uniform draws in [0, 1): each value depends only on the car key, the step and
+        the slot, so any subset of cars can be drawn in one vectorized call with the same result.
+
+        Args:
+            keys (np.ndarray): The keys of the cars.
+            step (int): The simulation step.
+            slot (int): Distinguishes the independent draws made for a car within a step.
+
+        Returns:
+            np.ndarray: One uniform value per key.
+        """
+        counter = splitmix64(np.uint64((step + 1) * 16 + slot))
+        return (splitmix64(keys ^ counter) >> np.uint64(11)) * (1.0 / (1 << 53))
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,92 @@
+# -------------------------------------------------------------------------------------------------------------
+
+from bisect import bisect_left
+
+from utils import region_distances
+
+# -------------------------------------------------------------------------------------------------------------
+
+class ReachabilityIndex:
+    """
+    Per-origin index of the regions reachable with a given autonomy.
+
+    For every origin the destinations are sorted by distance once, so the number of regions
+    closer than an autonomy comes from a single binary search. Each (origin, count) reachable
+    set is built the first time it is asked for and cached as a tuple that keeps the regions
+    in their original order, so callers iterate it exactly as they would iterate the full list.
+
+    Attributes:
+        regions (list): The regions of the simulation, in their original order.
+        sorted_distances (dict): Maps each origin ID to the ascending distances to every region.
+        sorted_positions (dict): Maps each origin ID to the positions of the regions in that ascending order.
+        cache (dict): Maps (origin ID, count) to the cached tuple of reachable regions.
+        position_cache (dict): Maps (origin ID, count) to the cached tuple of reachable region positions.
+    """
+    __slots__ = ("regions", "sorted_distances", "sorted_positions", "cache", "position_cache")
+
+    def __init__(self, regions, distances=region_distances):
+        self.regions = regions
+        self.sorted_distances = {}
+        self.sorted_positions = {}
+        self.cache = {}
+        self.position_cache = {}
+        for origin in regions:
+            row = distances[origin.id]
+            order = sorted(range(len(regions)), key=lambda i: row[regions[i].id])
+            self.sorted_distances[origin.id] = [row[regions[i].id] for i in order]
+            self.sorted_positions[origin.id] = order
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def reachable(self, origin, autonomy):
+        """
+        Gets the regions that are closer to the origin than the given autonomy.
+
+        Args:
+            origin (Region): The region where the car is.
+            autonomy (float): The autonomy of the car in kilometers.
+
+        Returns:
+            tuple: The reachable regions, in their original order.
+        """
+        count = bisect_left(self.sorted_distances[origin.id], autonomy)
+        key = (origin.id, count)
+        reachable = self.cache.get(key)
+        if reachable is None:
+            reachable = self.cache[key] = tuple(self.regions[i] for i in self.positions(key))
+        return reachable
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def reachable_positions(self, origin, autonomy):
+        """
+        Gets the positions, in the regions list, of the regions that are closer to the origin than the given autonomy.
+
+        Args:
+            origin (Region): The region where the car is.
+            autonomy (float): The autonomy of the car in kilometers.
+
+        Returns:
+            tuple: The positions of the reachable regions, in ascending order.
+        """
+        return self.positions((origin.id, bisect_left(self.sorted_distances[origin.id], autonomy)))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def positions(self, key):
+        """
+        Gets the cached positions of the first regions of an origin by distance.
+
+        Args:
+            key (tuple): The origin ID and the number of regions.
+
+        Returns:
+            tuple: The positions of those regions, in ascending order.
+        """
+        positions = self.position_cache.get(key)
+        if positions is None:
+            origin_id, count = key
+            positions = self.position_cache[key] = tuple(sorted(self.sorted_positions[origin_id][:count]))
+        return positions
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,390 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import json
+import time
+import zipfile
+
+from collections import OrderedDict
+
+import numpy as np
+
+from frame_stream import FrameEncoder, REGION_FIELDS
+from utils import stepsToTime
+
+# -------------------------------------------------------------------------------------------------------------
+
+KEYFRAME_INTERVAL = 240
+CACHED_CHUNKS = 4
+LIVE_STEPS_PER_SECOND = 60
+CHUNK_ARRAYS = ("step", "label", "region_count", "region_index", "region_value", "car_count", "car_index", "car_position")
+
+# -------------------------------------------------------------------------------------------------------------
+
+class ReplayRecorder:
+    """
+    Records the frames of the map of a run into a replay file, to watch it later without simulating.
+
+    The file is a NumPy .npz archive written as the run goes: the frames are grouped in chunks of
+    keyframe_interval steps, whose first frame is a keyframe and the others only hold what changed
+    (see FrameEncoder), concatenated into one set of arrays per chunk ("chunk<n>_<array>" with the
+    arrays of CHUNK_ARRAYS; the counts give the number of region and car entries of each frame). The
+    archive ends with the index, the first and last step of every chunk, and the metadata (init
+    message of the map, time of day labels and steps per day), so that a reader seeks to any step
+    by decompressing a single chunk.
+
+    Attributes:
+        path (str): The path of the replay file.
+        view (SimulationVisualization): The visualization whose map state is recorded.
+        steps_per_day (int): Number of simulation steps per day.
+        keyframe_interval (int): The number of frames of a chunk.
+        archive (zipfile.ZipFile): The archive being written.
+        encoder (FrameEncoder): The delta encoder of the frames.
+        labels (list): The time of day labels met so far; frames store the index of theirs.
+        frames (list): The (step, label, region index, region value, car index, car position) of the
+            frames of the current chunk.
+        chunk_starts (list): The first step of every written chunk.
+        chunk_ends (list): The last step of every written chunk.
+    """
+    __slots__ = ("path", "view", "steps_per_day", "keyframe_interval", "archive", "encoder", "labels", "frames",
+                 "chunk_starts", "chunk_ends")
+
+    def __init__(self, path, view, config, keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.view = view
+        self.steps_per_day = config.steps_per_day
+        self.keyframe_interval = keyframe_interval
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.encoder = FrameEncoder(len(view.regions), len(view.displayed_cars))
+        self.labels = []
+        self.frames = []
+        self.chunk_starts = []
+        self.chunk_ends = []
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def write(self, name, array):
+        """
+        Writes an array to the archive.
+
+        Args:
+            name (str): The name of the array.
+            array (np.ndarray): The array.
+        """
+        with self.archive.open(name + ".npy", "w", force_zip64=True) as file:
+            np.lib.format.write_array(file, np.asanyarray(array), allow_pickle=False)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def record(self, step, time_of_day):
+        """
+        Records the current state of the map as the frame of a step.
+
+        Args:
+            step (int): The simulation step that just ran.
+            time_of_day (str): The time of day of the step.
+        """
+        if time_of_day not in self.labels:
+            self.labels.append(time_of_day)
+        if not self.frames:
+            self.encoder.request_keyframe()
+        frame = self.encoder.encode(*self.view.map_state())
+        self.frames.append((
+            step, self.labels.index(time_of_day),
+            frame['region_index'], frame['region_value'], frame['car_index'], frame['car_position']
+        ))
+        if len(self.frames) == self.keyframe_interval:
+            self.flush()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def flush(self):
+        """
+        Writes the frames of the current chunk, if any, and starts a new chunk.
+        """
+        if not self.frames:
+            return
+        steps, labels, region_index, region_value, car_index, car_position = zip(*self.frames)
+        region_index = [np.frombuffer(data, dtype=np.uint32) for data in region_index]
+        car_index = [np.frombuffer(data, dtype=np.uint32) for data in car_index]
+        prefix = f"chunk{len(self.chunk_starts)}_"
+        self.write(prefix + "step", np.array(steps, dtype=np.int64))
+        self.write(prefix + "label", np.array(labels, dtype=np.int8))
+        self.write(prefix + "region_count", np.array([len(index) for index in region_index], dtype=np.int32))
+        self.write(prefix + "region_index", np.concatenate(region_index))
+        self.write(prefix + "region_value", np.frombuffer(b"".join(region_value), dtype=np.float32))
+        self.write(prefix + "car_count", np.array([len(index) for index in car_index], dtype=np.int32))
+        self.write(prefix + "car_index", np.concatenate(car_index))
+        self.write(prefix + "car_position", np.frombuffer(b"".join(car_position), dtype=np.float32).reshape(-1, 2))
+        self.chunk_starts.append(steps[0])
+        self.chunk_ends.append(steps[-1])
+        self.frames = []
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def close(self):
+        """
+        Writes the last chunk, the index and the metadata, and closes the file.
+        """
+        self.flush()
+        self.write("chunk_start", np.array(self.chunk_starts, dtype=np.int64))
+        self.write("chunk_end", np.array(self.chunk_ends, dtype=np.int64))
+        meta = {
+            'init': FrameEncoder.init_message(self.view.regions, self.view.displayed_cars),
+            'labels': self.labels,
+            'steps_per_day': self.steps_per_day
+        }
+        self.write("meta", np.array(json.dumps(meta)))
+        self.archive.close()
+
+# -------------------------------------------------------------------------------------------------------------
+
+class ReplayFile:
+    """
+    Random access reader of a replay file (see ReplayRecorder). Only the index and the metadata are
+    read when opening; the state at a step is rebuilt from the chunk that holds it, which is
+    decompressed and decoded at once into the full state of each of its frames, and kept in a small
+    cache so that playing and seeking around a step do not decode it again.
+
+    Attributes:
+        archive (np.lib.npyio.NpzFile): The lazily read archive.
+        init (dict): The init message of the map.
+        labels (list): The time of day label of each code.
+        steps_per_day (int): Number of simulation steps per day.
+        chunk_starts (np.ndarray): The first step of every chunk.
+        chunk_ends (np.ndarray): The last step of every chunk.
+        regions (int): The number of regions.
+        cars (int): The number of displayed cars.
+        chunks (OrderedDict): The decoded chunks by number, least recently used first.
+    """
+    __slots__ = ("archive", "init", "labels", "steps_per_day", "chunk_starts", "chunk_ends", "regions", "cars", "chunks")
+
+    def __init__(self, path):
+        self.archive = np.load(path)
+        meta = json.loads(str(self.archive["meta"]))
+        self.init = meta['init']
+        self.labels = meta['labels']
+        self.steps_per_day = meta['steps_per_day']
+        self.chunk_starts = self.archive["chunk_start"]
+        self.chunk_ends = self.archive["chunk_end"]
+        if len(self.chunk_starts) == 0:
+            raise ValueError(f"The replay file {path} has no frames")
+        self.regions = len(self.init['regions'])
+        self.cars = len(self.init['cars'])
+        self.chunks = OrderedDict()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def first_step(self):
+        """
+        int: The first recorded step.
+        """
+        return int(self.chunk_starts[0])
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def last_step(self):
+        """
+        int: The last recorded step.
+        """
+        return int(self.chunk_ends[-1])
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def expand(counts, index, values, size, width):
+        """
+        Rebuilds the full values of every frame of a chunk from its keyframe and deltas: each value
+        is scattered to the frame that set it, and then carried forward until the next change.
+
+        Args:
+            counts (np.ndarray): The number of entries of each frame.
+            index (np.ndarray): The flat index of each entry within a frame.
+            values (np.ndarray): The (entries x width) values of the entries.
+            size (int): The number of entries of a keyframe.
+            width (int): The number of values of an entry.
+
+        Returns:
+            np.ndarray: The (frames x size x width) values of every frame.
+        """
+        frames = len(counts)
+        frame = np.repeat(np.arange(frames), counts)
+        full = np.zeros((frames, size, width), dtype=np.float32)
+        full[frame, index] = values.reshape(-1, width)
+        source = np.full((frames, size), -1, dtype=np.int64)
+        source[frame, index] = frame
+        source = np.maximum.accumulate(source, axis=0)
+        return full[source, np.arange(size)]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def chunk(self, number):
+        """
+        Gets a decoded chunk.
+
+        Args:
+            number (int): The number of the chunk.
+
+        Returns:
+            tuple: The steps, time of day codes, (frames x regions x fields) values and (frames x cars x 2)
+                   positions of the frames of the chunk.
+        """
+        if number in self.chunks:
+            self.chunks.move_to_end(number)
+            return self.chunks[number]
+        data = {name: self.archive[f"chunk{number}_{name}"] for name in CHUNK_ARRAYS}
+        region_values = self.expand(data["region_count"], data["region_index"], data["region_value"], self.regions * len(REGION_FIELDS), 1)
+        car_positions = self.expand(data["car_count"], data["car_index"], data["car_position"], self.cars, 2)
+        decoded = (
+            data["step"], data["label"],
+            region_values.reshape(len(data["step"]), self.regions, len(REGION_FIELDS)),
+            car_positions.reshape(len(data["step"]), self.cars, 2)
+        )
+        self.chunks[number] = decoded
+        if len(self.chunks) > CACHED_CHUNKS:
+            self.chunks.popitem(last=False)
+        return decoded
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def state_at(self, step):
+        """
+        Gets the state of the map at a step: that of the last frame recorded at or before it.
+
+        Args:
+            step (int): The simulation step, clamped to the recorded steps.
+
+        Returns:
+            tuple: The step of the frame, its time of day label, the (regions x fields) values of the
+                   regions and the (cars x 2) positions of the displayed cars.
+        """
+        step = min(max(step, self.first_step), self.last_step)
+        number = int(np.searchsorted(self.chunk_starts, step, side="right")) - 1
+        steps, labels, region_values, car_positions = self.chunk(number)
+        i = int(np.searchsorted(steps, step, side="right")) - 1
+        return int(steps[i]), self.labels[labels[i]], region_values[i], car_positions[i]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self.chunks.clear()
+        self.archive.close()
+
+# -------------------------------------------------------------------------------------------------------------
+
+class ReplayServer:
+    """
+    Plays a replay file on the map. A background task of the SocketIO server sends the frames of
+    the recorded steps frame_rate times per second, delta-encoded like those of a live run, while
+    the clients play, pause, seek and change the speed with "replay_control" messages. The playback
+    is shared by every client, which is told about each change with a "replay_status" message.
+    Speeds are relative to the pace of a live run, LIVE_STEPS_PER_SECOND steps per second.
+
+    Attributes:
+        socketio (SocketIO): The SocketIO instance.
+        replay (ReplayFile): The replay file.
+        frame_interval (float): The time between two frames in seconds.
+        encoder (FrameEncoder): The delta encoder of the frames.
+        position (float): The step being shown, with the fraction of the next one played so far.
+        playing (bool): Whether the replay is playing.
+        speed (float): The speed of the replay, relative to a live run.
+        changed (bool): Whether the playback changed since the last status message.
+    """
+    def __init__(self, socketio, replay, config):
+        self.socketio = socketio
+        self.replay = replay
+        self.frame_interval = 1 / config.frame_rate
+        self.encoder = FrameEncoder(replay.regions, replay.cars)
+        self.position = float(replay.first_step)
+        self.playing = False
+        self.speed = 1.0
+        self.changed = True
+        socketio.on_event('connect', lambda auth=None: self.encoder.request_keyframe())
+        socketio.on_event('replay_control', self.control)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def control(self, message):
+        """
+        Handles a "replay_control" message of a client. Malformed messages are ignored.
+
+        Args:
+            message (dict): The "action", either "play", "pause", "seek" (with the "step" to go to)
+                            or "speed" (with the relative "speed", which must be positive).
+        """
+        if not isinstance(message, dict):
+            return
+        action = message.get('action')
+        try:
+            if action == 'play':
+                if self.position >= self.replay.last_step:
+                    self.position = float(self.replay.first_step)
+                self.playing = True
+            elif action == 'pause':
+                self.playing = False
+            elif action == 'seek':
+                self.position = float(min(max(int(message['step']), self.replay.first_step), self.replay.last_step))
+            elif action == 'speed' and float(message['speed']) > 0:
+                self.speed = float(message['speed'])
+            else:
+                return
+        except (KeyError, TypeError, ValueError):
+            return
+        self.changed = True
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def status(self):
+        """
+        Builds the status of the playback.
+
+        Returns:
+            dict: The first and last recorded steps, the steps per day, the step being shown, whether
+                  the replay is playing and its speed.
+        """
+        return {
+            'first_step': self.replay.first_step,
+            'last_step': self.replay.last_step,
+            'steps_per_day': self.replay.steps_per_day,
+            'step': int(self.position),
+            'playing': self.playing,
+            'speed': self.speed
+        }
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def serve(self):
+        """
+        Advances the playback and emits a frame whenever the step shown changes, forever.
+        """
+        shown = None
+        last = time.perf_counter()
+        while True:
+            self.socketio.sleep(self.frame_interval)
+            now = time.perf_counter()
+            if self.playing:
+                self.position += (now - last) * self.speed * LIVE_STEPS_PER_SECOND
+                if self.position >= self.replay.last_step:
+                    self.position = float(self.replay.last_step)
+                    self.playing = False
+                    self.changed = True
+            last = now
+            keyframe = self.encoder.keyframe
+            if keyframe:
+                self.socketio.emit('map_init', self.replay.init)
+            if keyframe or self.changed:
+                self.changed = False
+                self.socketio.emit('replay_status', self.status())
+            step = int(self.position)
+            if keyframe or step != shown:
+                shown = step
+                step, label, region_values, car_positions = self.replay.state_at(step)
+                frame = self.encoder.encode(region_values, car_positions)
+                frame.update(step=step, time=stepsToTime(step, self.replay.steps_per_day), rush_hour=label)
+                self.socketio.emit('map_frame', frame)
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,287 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+
+from math import sin, cos, radians, ceil
+
+import numpy as np
+
+from utils import haversine_distance, calculate_angle, region_distances
+
+# -------------------------------------------------------------------------------------------------------------
+
+GRAPH_PATH = "data/city_graph.json"
+CACHE_FOLDER = "data/cache/"
+ROUTING_MODES = ("straight", "graph")
+
+# -------------------------------------------------------------------------------------------------------------
+
+class RoadNetwork:
+    """
+    All-pairs shortest paths of the road graph of the city. The graph lists the regions and the
+    roads between neighbouring regions; the weight of a road in the graph file is its traffic
+    intensity, while its length is the distance between the centers of the two regions. The paths
+    are computed once per graph (Floyd-Warshall) and stored in a cache file named after the hash of
+    the graph and road lengths, so later runs load them instead of recomputing them.
+
+    Attributes:
+        nodes (list): The region IDs of the graph.
+        distance (np.ndarray): distance[a][b] is the length of the shortest path from node a to node b,
+            or inf if b cannot be reached.
+        next_hop (np.ndarray): next_hop[a][b] is the node after a on the shortest path to b, or -1.
+        graph_hash (str): The hash of the graph and road lengths.
+        paths (dict): Maps (origin ID, destination ID) to the IDs of the regions of the path, origin excluded.
+    """
+    _loaded = {}
+
+    def __init__(self, nodes, distance, next_hop, graph_hash):
+        self.nodes = nodes
+        self.distance = distance
+        self.next_hop = next_hop
+        self.graph_hash = graph_hash
+        self.paths = {}
+        for a, origin in enumerate(nodes):
+            for b, destination in enumerate(nodes):
+                path = []
+                hop = a
+                while hop != b and next_hop[hop][b] >= 0:
+                    hop = int(next_hop[hop][b])
+                    path.append(nodes[hop])
+                self.paths[(origin, destination)] = tuple(path) if hop == b else None
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def load(cls, path=GRAPH_PATH, lengths=region_distances, cache_folder=CACHE_FOLDER):
+        """
+        Loads the shortest paths of a road graph, from memory or from the cache folder if they were
+        already computed for the same graph, or computes and caches them otherwise. The cache file is
+        written under a temporary name and then renamed, so that parallel runs never read a partial file.
+
+        Args:
+            path (str): The path of the graph file, with "nodes" and "edges" ([region, region, traffic]) lists.
+            lengths (dict): The length of the road between two regions, by region IDs.
+            cache_folder (str): The folder of the cached paths.
+
+        Returns:
+            RoadNetwork: The road network.
+
+        Raises:
+            ValueError: If a road joins a region missing from the lengths table.
+        """
+        with open(path) as file:
+            graph = json.load(file)
+        nodes = list(graph["nodes"])
+        try:
+            edges = [(a, b, float(lengths[a][b])) for a, b, _ in graph["edges"]]
+        except KeyError as error:
+            raise ValueError(f"The road graph {path} joins a region without a known distance: {error}") from None
+        graph_hash = hashlib.blake2b(json.dumps([nodes, edges]).encode(), digest_size=8).hexdigest()
+        network = cls._loaded.get(graph_hash)
+        if network is not None:
+            return network
+        cache_path = os.path.join(cache_folder, f"routes_{graph_hash}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as data:
+                distance, next_hop = data["distance"], data["next_hop"]
+        else:
+            distance, next_hop = cls.shortest_paths(nodes, edges)
+            os.makedirs(cache_folder, exist_ok=True)
+            partial = f"{cache_path[:-len('.npz')]}.{os.getpid()}.tmp.npz"
+            np.savez(partial, distance=distance, next_hop=next_hop)
+            os.replace(partial, cache_path)
+        network = cls._loaded[graph_hash] = cls(nodes, distance, next_hop, graph_hash)
+        return network
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def shortest_paths(nodes, edges):
+        """
+        Computes the shortest paths between every pair of nodes of an undirected graph with Floyd-Warshall.
+
+        Args:
+            nodes (list): The node IDs.
+            edges (list): The (node, node, length) roads.
+
+        Returns:
+            tuple: The distance matrix and the next hop matrix.
+        """
+        index = {node: i for i, node in enumerate(nodes)}
+        size = len(nodes)
+        distance = np.full((size, size), np.inf)
+        next_hop = np.full((size, size), -1, dtype=np.int32)
+        np.fill_diagonal(distance, 0)
+        np.fill_diagonal(next_hop, np.arange(size))
+        for a, b, length in edges:
+            i, j = index[a], index[b]
+            if length < distance[i, j]:
+                distance[i, j] = distance[j, i] = length
+                next_hop[i, j], next_hop[j, i] = j, i
+        for k in range(size):
+            via = distance[:, k, None] + distance[None, k, :]
+            shorter = via < distance
+            distance = np.where(shorter, via, distance)
+            next_hop = np.where(shorter, next_hop[:, k, None], next_hop)
+        return distance, next_hop
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def distance_table(self):
+        """
+        Gets the shortest path lengths in the format of utils.region_distances.
+
+        Returns:
+            dict: The length of the shortest path between two regions, by region IDs.
+        """
+        return {a: {b: float(self.distance[i, j]) for j, b in enumerate(self.nodes)} for i, a in enumerate(self.nodes)}
+
+# -------------------------------------------------------------------------------------------------------------
+
+class Router:
+    """
+    The routes and trip lengths of the cars. With "straight" routing cars drive in a straight line
+    between region centers, as measured by utils.region_distances; with "graph" routing they follow
+    the shortest path of the road network through the centers of the regions on the way. Every
+    route, distance and trip duration is precomputed for every pair of regions, so a lookup during
+    the simulation is a single dictionary access. The routes are also kept as padded arrays of
+    points, so that the positions of many travelling cars can be interpolated in one call.
+
+    Attributes:
+        network (RoadNetwork): The road network, or None with straight routing.
+        distances (dict): The travelled distance between two regions, by region IDs.
+        routes (dict): Maps (origin ID, destination ID) to the regions to drive through, destination included.
+        trips (dict): Maps (origin ID, destination ID) to the distance and number of steps of the trip.
+        route_rows (dict): Maps (origin ID, destination ID) to the row of the route in the point arrays.
+        point_latitudes (np.ndarray): The latitude of the points of each route, origin first, padded with the destination.
+        point_longitudes (np.ndarray): The longitude of the points of each route, padded likewise.
+        point_progress (np.ndarray): The share of the trip steps at which each point is reached, padded with 1.
+    """
+    __slots__ = ("network", "distances", "routes", "trips", "route_rows", "point_latitudes", "point_longitudes", "point_progress")
+
+    def __init__(self, regions, config):
+        self.network = RoadNetwork.load() if config.routing == "graph" else None
+        self.distances = self.network.distance_table() if self.network else region_distances
+        by_id = {region.id: region for region in regions}
+        velocity = config.velocity_per_step
+        self.routes = {}
+        self.trips = {}
+        self.route_rows = {}
+        steps = []
+        for origin in regions:
+            for destination in regions:
+                key = (origin.id, destination.id)
+                if self.network is None:
+                    route = (destination,)
+                else:
+                    path = self.network.paths.get(key)
+                    if path is None:
+                        continue
+                    route = tuple(by_id[region_id] for region_id in path)
+                legs = self.legs(origin, route, velocity)
+                self.routes[key] = route
+                self.trips[key] = (sum(distance for _, distance, _ in legs), sum(count for _, _, count in legs))
+                self.route_rows[key] = len(steps)
+                steps.append([count for _, _, count in legs])
+        width = 1 + max((len(route) for route in self.routes.values()), default=0)
+        self.point_latitudes = np.zeros((len(steps), width))
+        self.point_longitudes = np.zeros((len(steps), width))
+        self.point_progress = np.ones((len(steps), width))
+        for key, row in self.route_rows.items():
+            path = [by_id[key[0]]] + [region for region in self.routes[key] if region.id != key[0]]
+            path += [path[-1]] * (width - len(path))
+            self.point_latitudes[row] = [region.latitude for region in path]
+            self.point_longitudes[row] = [region.longitude for region in path]
+            total = self.trips[key][1]
+            self.point_progress[row, 0] = 0
+            if total:
+                self.point_progress[row, 1:len(steps[row]) + 1] = np.cumsum(steps[row]) / total
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def legs(origin, route, velocity):
+        """
+        Measures the legs of a trip with the movement model of the cars: each leg takes as many steps
+        as a car needs to reach the next region center, moving velocity kilometers per step towards it.
+
+        Args:
+            origin (Region): The region where the trip starts.
+            route (tuple): The regions to drive through, destination included.
+            velocity (float): The velocity of the cars in kilometers per step.
+
+        Returns:
+            list: The (region reached, distance, steps) of each leg.
+        """
+        legs = []
+        for destination in route:
+            if destination is origin:
+                continue
+            angle = calculate_angle((origin.latitude, origin.longitude), (destination.latitude, destination.longitude))
+            next_lat = origin.latitude + velocity * sin(angle) / 111.2
+            next_long = origin.longitude + velocity * cos(angle) / (111.2 * cos(radians(origin.latitude)))
+            movement = haversine_distance(origin.latitude, origin.longitude, next_lat, next_long)
+            distance = haversine_distance(origin.latitude, origin.longitude, destination.latitude, destination.longitude)
+            legs.append((destination, distance, ceil(distance / movement)))
+            origin = destination
+        return legs
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def route(self, origin, destination):
+        """
+        Gets the regions a car drives through from a region to another.
+
+        Args:
+            origin (Region): The region where the trip starts.
+            destination (Region): The region where the trip ends.
+
+        Returns:
+            tuple: The regions on the way, destination included.
+        """
+        return self.routes[(origin.id, destination.id)]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def trip(self, origin, destination):
+        """
+        Gets the length of a trip from a region to another.
+
+        Args:
+            origin (Region): The region where the trip starts.
+            destination (Region): The region where the trip ends.
+
+        Returns:
+            tuple: The distance in kilometers and the number of steps of the trip.
+        """
+        return self.trips[(origin.id, destination.id)]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def positions(self, trips):
+        """
+        Interpolates the positions of travelling cars along their routes, in one vectorized call.
+
+        Args:
+            trips (list): The (origin, destination, progress) of each car, where progress is the share
+                          of the trip steps already done, between 0 and 1.
+
+        Returns:
+            tuple: The latitudes and the longitudes of the cars, as arrays.
+        """
+        if not trips:
+            return np.zeros(0), np.zeros(0)
+        rows = np.array([self.route_rows[(origin.id, destination.id)] for origin, destination, _ in trips])
+        progress = np.array([done for _, _, done in trips], dtype=np.float64)
+        reached = self.point_progress[rows]
+        leg = np.clip((reached <= progress[:, None]).sum(axis=1) - 1, 0, reached.shape[1] - 2)
+        cars = np.arange(len(trips))
+        start, end = reached[cars, leg], reached[cars, leg + 1]
+        share = np.clip(np.divide(progress - start, end - start, out=np.zeros(len(trips)), where=end > start), 0, 1)
+        latitudes, longitudes = self.point_latitudes[rows], self.point_longitudes[rows]
+        return (latitudes[cars, leg] + share * (latitudes[cars, leg + 1] - latitudes[cars, leg]),
+                longitudes[cars, leg] + share * (longitudes[cars, leg + 1] - longitudes[cars, leg]))
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,263 @@
+# -------------------------------------------------------------------------------------------------------------
+
+from dataclasses import dataclass, field, fields, replace, MISSING
+
+from dotenv import dotenv_values
+
+from logs.log import CATEGORIES
+from routing import ROUTING_MODES
+from charging_queue import QUEUE_DISCIPLINES
+
+# -------------------------------------------------------------------------------------------------------------
+
+BOOLEANS = {"true": True, "yes": True, "on": True, "1": True, "false": False, "no": False, "off": False, "0": False}
+
+# -------------------------------------------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class SimulationConfig:
+    """
+    Immutable configuration of a simulation, parsed and validated once from a scenario .env file.
+    Every field maps to the upper-case variable of the same name (e.g. steps_per_day to STEPS_PER_DAY).
+    Configurations are hashable, so they can key caches and be compared across runs.
+
+    Attributes:
+        steps_per_day (int): Number of steps representing a full day.
+        number_of_days (int): Number of days to simulate.
+        car_velocity (float): The velocity of the cars in kilometers per hour.
+        salary_fluctuation (float): The fluctuation in salary used by the CarSeeder.
+        percentage_willing_to_spend (float): The share of income that people are willing to spend on a car.
+        probability_of_buying (float): The probability that a person buys a car they can afford.
+        region_improvement (int): The charger improvement level of the regions file (0 for the current one).
+        autonomy_tolerance (float): The battery percentage under which cars consider charging.
+        probability_of_charging (float): The probability per step that a car under the tolerance decides to charge.
+        probability_of_charging_at_home (float): The probability that a car in its home region charges at home.
+        chance_of_staying_idle (float): The chance per step that an idle car stays idle.
+        chance_of_staying_idle_rush_hour (float): The chance of staying idle during rush hour.
+        chance_of_staying_idle_lunch_time (float): The chance of staying idle during lunch time.
+        chance_of_staying_idle_night_time (float): The chance of staying idle during the night.
+        chance_of_staying_idle_dawn_time (float): The chance of staying idle during dawn.
+        distance_weight (float): Weight for distance when choosing where to charge.
+        availability_weight (float): Weight for charger availability when choosing where to charge.
+        queue_weight (float): Weight for queue size when choosing where to charge.
+        charging_per_step (float): Kilometers of autonomy charged per step at a charger.
+        charging_per_step_home (float): Kilometers of autonomy charged per step at home.
+        log_categories (str): Comma-separated log categories to write ("cars", "regions"), "all" or "none".
+            Optional, defaults to "all".
+        routing (str): How cars drive between regions: "straight" between region centers, or "graph" along
+            the shortest paths of the road network in data/city_graph.json. Optional, defaults to "straight".
+        displayed_cars_per_region (int): The number of cars of each region shown on the map. Optional, defaults to 2.
+        stations (str): The path of a charging station file (id; region; lat; long; capacity). Optional; when
+            empty, each region has a single pool of chargers at its center.
+        queue_discipline (str): The order in which queued cars get a charger: "fifo", "lowest_battery" first, or
+            "reservation" of time slots. Optional, defaults to "fifo".
+        reservation_slot_hours (float): The length of a reservation slot in hours. Optional, defaults to 1.
+        history_interval (int): The number of steps between two samples of the region metrics in the history.
+            Optional, defaults to 1 (every step).
+        history_json (bool): Whether to also export the region history as one JSON file per region, next to
+            logs/outputs/history.npz. Optional, defaults to false.
+        frame_rate (float): The maximum number of frames per second sent to the map. Optional, defaults to 10.
+        fleet_cache (bool): Whether seeded runs store their generated fleet in data/cache/ and load it from there
+            when the regions, car models, seeder parameters and seed are the same. Optional, defaults to true.
+        idle_probabilities (dict): The chance of staying idle of each time of day label, with a "default" entry.
+    """
+    steps_per_day: int
+    number_of_days: int
+    car_velocity: float
+    salary_fluctuation: float
+    percentage_willing_to_spend: float
+    probability_of_buying: float
+    region_improvement: int
+    autonomy_tolerance: float
+    probability_of_charging: float
+    probability_of_charging_at_home: float
+    chance_of_staying_idle: float
+    chance_of_staying_idle_rush_hour: float
+    chance_of_staying_idle_lunch_time: float
+    chance_of_staying_idle_night_time: float
+    chance_of_staying_idle_dawn_time: float
+    distance_weight: float
+    availability_weight: float
+    queue_weight: float
+    charging_per_step: float
+    charging_per_step_home: float
+    log_categories: str = "all"
+    routing: str = "straight"
+    stations: str = ""
+    displayed_cars_per_region: int = 2
+    queue_discipline: str = "fifo"
+    reservation_slot_hours: float = 1.0
+    history_interval: int = 1
+    history_json: bool = False
+    frame_rate: float = 10.0
+    fleet_cache: bool = True
+    idle_probabilities: dict = field(init=False, repr=False, compare=False)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def __post_init__(self):
+        """
+        Validates the configuration and builds the idle probabilities table.
+
+        Raises:
+            ValueError: If a value is out of its valid range.
+        """
+        probabilities = [
+            "percentage_willing_to_spend", "probability_of_buying", "probability_of_charging",
+            "probability_of_charging_at_home", "chance_of_staying_idle", "chance_of_staying_idle_rush_hour",
+            "chance_of_staying_idle_lunch_time", "chance_of_staying_idle_night_time", "chance_of_staying_idle_dawn_time"
+        ]
+        positives = [
+            "steps_per_day", "number_of_days", "car_velocity", "charging_per_step", "charging_per_step_home",
+            "reservation_slot_hours", "history_interval", "frame_rate"
+        ]
+        errors = [f"{name.upper()} must be between 0 and 1" for name in probabilities if not 0 <= getattr(self, name) <= 1]
+        errors += [f"{name.upper()} must be positive" for name in positives if getattr(self, name) <= 0]
+        if not 0 <= self.autonomy_tolerance <= 100:
+            errors.append("AUTONOMY_TOLERANCE must be a battery percentage between 0 and 100")
+        if self.region_improvement < 0 or self.salary_fluctuation < 0:
+            errors.append("REGION_IMPROVEMENT and SALARY_FLUCTUATION cannot be negative")
+        if self.displayed_cars_per_region < 0:
+            errors.append("DISPLAYED_CARS_PER_REGION cannot be negative")
+        unknown = [name for name in self.logged_categories if name not in CATEGORIES]
+        if unknown:
+            errors.append(f"LOG_CATEGORIES must list categories among {', '.join(CATEGORIES)}, got {', '.join(unknown)}")
+        if self.routing not in ROUTING_MODES:
+            errors.append(f"ROUTING must be one of {', '.join(ROUTING_MODES)}, got {self.routing!r}")
+        if self.queue_discipline not in QUEUE_DISCIPLINES:
+            errors.append(f"QUEUE_DISCIPLINE must be one of {', '.join(QUEUE_DISCIPLINES)}, got {self.queue_discipline!r}")
+        if errors:
+            raise ValueError("Invalid configuration: " + "; ".join(errors))
+        object.__setattr__(self, "idle_probabilities", {
+            "rush_hour": self.chance_of_staying_idle_rush_hour,
+            "lunch_time": self.chance_of_staying_idle_lunch_time,
+            "night_time": self.chance_of_staying_idle_night_time,
+            "dawn_time": self.chance_of_staying_idle_dawn_time,
+            "default": self.chance_of_staying_idle
+        })
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Parses a configuration from the variables of a .env file. Extra variables are ignored
+        and optional ones take their default when missing.
+
+        Args:
+            values (dict): Maps variable names (e.g. "STEPS_PER_DAY") to their string values.
+
+        Returns:
+            SimulationConfig: The parsed configuration.
+
+        Raises:
+            ValueError: If a variable is missing, is not a number or a boolean as expected, or is out of its valid range.
+        """
+        parsed = {}
+        errors = []
+        for f in fields(cls):
+            if not f.init:
+                continue
+            raw = values.get(f.name.upper())
+            if raw is None and f.default is not MISSING:
+                continue
+            if raw is None or (str(raw).strip() == "" and f.type is not str):
+                errors.append(f"{f.name.upper()} is missing")
+                continue
+            if f.type is bool:
+                value = str(raw).strip().lower()
+                if value not in BOOLEANS:
+                    errors.append(f"{f.name.upper()} must be true or false, got {raw!r}")
+                    continue
+                parsed[f.name] = BOOLEANS[value]
+                continue
+            try:
+                parsed[f.name] = f.type(str(raw).strip())
+            except ValueError:
+                errors.append(f"{f.name.upper()} must be {'an integer' if f.type is int else 'a number'}, got {raw!r}")
+        if errors:
+            raise ValueError("Invalid configuration: " + "; ".join(errors))
+        return cls(**parsed)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def from_env_file(cls, path=".env"):
+        """
+        Parses a configuration from a .env file, without touching the process environment.
+
+        Args:
+            path (str): The path of the .env file.
+
+        Returns:
+            SimulationConfig: The parsed configuration.
+        """
+        return cls.from_values(dotenv_values(path))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def to_values(self):
+        """
+        Formats the configuration as the variables of a .env file.
+
+        Returns:
+            dict: Maps variable names to their string values.
+        """
+        return {f.name.upper(): str(getattr(self, f.name)) for f in fields(self) if f.init}
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def replace(self, **changes):
+        """
+        Creates a validated copy of the configuration with some fields changed.
+
+        Args:
+            **changes: The new values, by field name.
+
+        Returns:
+            SimulationConfig: The new configuration.
+        """
+        return replace(self, **changes)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def total_steps(self):
+        """
+        int: The number of steps of a full run.
+        """
+        return self.steps_per_day * self.number_of_days
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def logged_categories(self):
+        """
+        tuple: The names of the log categories to write.
+        """
+        value = self.log_categories.strip().lower()
+        if value == "all":
+            return CATEGORIES
+        if value in ("", "none"):
+            return ()
+        return tuple(name.strip() for name in value.split(",") if name.strip())
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def velocity_per_step(self):
+        """
+        float: The velocity of the cars in kilometers per step.
+        """
+        return self.car_velocity / (self.steps_per_day / 24)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def reservation_slot_steps(self):
+        """
+        int: The length of a reservation slot in steps, at least one.
+        """
+        return max(1, round(self.reservation_slot_hours * self.steps_per_day / 24))
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
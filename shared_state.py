@@ -0,0 +1,201 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import os
+
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from frame_stream import FrameEncoder, REGION_FIELDS
+from utils import stepsToTime
+
+# -------------------------------------------------------------------------------------------------------------
+
+VERSION, LATEST, FINISHED, SEQUENCE = 0, 1, 2, 3
+HEADER_SIZE = 5
+
+# -------------------------------------------------------------------------------------------------------------
+
+class SharedState:
+    """
+    Double-buffered snapshot of the state shown on the map (the step, the time of day, the region
+    fields and the displayed car positions), in shared memory, written by the simulation process
+    and read by the web process without locks.
+
+    The single writer fills the buffer that is not the latest one and then publishes it. Each
+    buffer has a sequence number (seqlock) that is odd while it is being written: a reader copies
+    the latest buffer and keeps the copy only if the sequence number was even and unchanged, and
+    retries otherwise, which only happens if the writer published twice during the copy. The
+    memory is a header of int64 words (version, latest buffer, finished flag and the two sequence
+    numbers) followed by the two buffers of float64 values.
+
+    Attributes:
+        memory (SharedMemory): The shared memory block.
+        header (np.ndarray): The header words.
+        buffers (np.ndarray): The (2 x values) buffers; each holds the step, the time of day code, the
+            (regions x fields) values and the (cars x 2) positions.
+        regions (int): The number of regions.
+        cars (int): The number of displayed cars.
+        owner (bool): Whether this process created the block, and unlinks it when closing.
+    """
+    __slots__ = ("memory", "header", "buffers", "regions", "cars", "owner")
+
+    def __init__(self, regions, cars, name=None):
+        self.regions = regions
+        self.cars = cars
+        self.owner = name is None
+        size = 2 + regions * len(REGION_FIELDS) + 2 * cars
+        if self.owner:
+            self.memory = SharedMemory(create=True, size=8 * (HEADER_SIZE + 2 * size))
+        else:
+            self.memory = SharedMemory(name=name)
+        self.header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=self.memory.buf)
+        self.buffers = np.ndarray((2, size), dtype=np.float64, buffer=self.memory.buf, offset=8 * HEADER_SIZE)
+        if self.owner:
+            self.header[:] = 0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def name(self):
+        """
+        str: The name of the shared memory block, to attach to it from another process.
+        """
+        return self.memory.name
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def finished(self):
+        """
+        bool: Whether the simulation has ended; the last state was published before.
+        """
+        return bool(self.header[FINISHED])
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def write(self, step, label, region_values, car_positions):
+        """
+        Publishes a new state. Only one process may write.
+
+        Args:
+            step (int): The simulation step.
+            label (int): The code of the time of day.
+            region_values (np.ndarray): The (regions x fields) values of the regions.
+            car_positions (np.ndarray): The (cars x 2) latitude and longitude of the displayed cars.
+        """
+        b = 1 - int(self.header[LATEST])
+        buffer = self.buffers[b]
+        self.header[SEQUENCE + b] += 1
+        buffer[0] = step
+        buffer[1] = label
+        buffer[2:2 + region_values.size] = region_values.ravel()
+        buffer[2 + region_values.size:] = car_positions.ravel()
+        self.header[SEQUENCE + b] += 1
+        self.header[LATEST] = b
+        self.header[VERSION] += 1
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def read(self, version=-1):
+        """
+        Copies the latest state, if it is newer than a given version.
+
+        Args:
+            version (int): The version of the last state read, or -1.
+
+        Returns:
+            tuple: The version, step, time of day code, (regions x fields) values and (cars x 2)
+                   positions, or None if no newer state was published.
+        """
+        while True:
+            latest = int(self.header[VERSION])
+            if latest == version or latest == 0:
+                return None
+            b = int(self.header[LATEST])
+            sequence = int(self.header[SEQUENCE + b])
+            if sequence % 2:
+                continue
+            buffer = self.buffers[b].copy()
+            if int(self.header[SEQUENCE + b]) == sequence:
+                break
+        values = buffer[2:2 + self.regions * len(REGION_FIELDS)].reshape(self.regions, len(REGION_FIELDS))
+        positions = buffer[2 + values.size:].reshape(self.cars, 2)
+        return latest, int(buffer[0]), int(buffer[1]), values, positions
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def finish(self):
+        """
+        Marks the end of the simulation, after its last state was published.
+        """
+        self.header[FINISHED] = 1
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def close(self):
+        """
+        Detaches from the shared memory block, and frees it if this process created it. The other
+        process keeps its own mapping until it closes it too.
+        """
+        self.header = None
+        self.buffers = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+# -------------------------------------------------------------------------------------------------------------
+
+class FrameServer:
+    """
+    Sends the frames of the map from the web process. A background task of the SocketIO server
+    reads the state published by the simulation process frame_rate times per second, delta-encodes
+    it (see FrameEncoder) and emits it, so serialization and networking never run in the process of
+    the simulation. When the simulation ends, the clients are told and the web process exits.
+
+    Attributes:
+        socketio (SocketIO): The SocketIO instance.
+        state (SharedState): The state published by the simulation.
+        init (dict): The init message of the map, see FrameEncoder.init_message.
+        labels (tuple): The time of day label of each code.
+        steps_per_day (int): Number of simulation steps per day.
+        frame_interval (float): The time between two reads of the state in seconds.
+        encoder (FrameEncoder): The delta encoder of the frames.
+        process (multiprocessing.Process): The simulation process.
+    """
+    def __init__(self, socketio, state, init, labels, config, process):
+        self.socketio = socketio
+        self.state = state
+        self.init = init
+        self.labels = labels
+        self.steps_per_day = config.steps_per_day
+        self.frame_interval = 1 / config.frame_rate
+        self.encoder = FrameEncoder(state.regions, state.cars)
+        self.process = process
+        socketio.on_event('connect', lambda auth=None: self.encoder.request_keyframe())
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def serve(self):
+        """
+        Emits a frame whenever a new state was published, until the simulation ends.
+        """
+        version = -1
+        while True:
+            self.socketio.sleep(self.frame_interval)
+            finished = self.state.finished
+            published = self.state.read(version)
+            if published is not None:
+                version, step, label, region_values, car_positions = published
+                if self.encoder.keyframe:
+                    self.socketio.emit('map_init', self.init)
+                frame = self.encoder.encode(region_values, car_positions)
+                frame.update(step=step, time=stepsToTime(step, self.steps_per_day), rush_hour=self.labels[label])
+                self.socketio.emit('map_frame', frame)
+            elif finished:
+                self.socketio.emit('simulation_end', {})
+                self.process.join()
+                self.state.close()
+                os._exit(0)
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
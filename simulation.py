@@ -1,32 +1,81 @@
 # -------------------------------------------------------------------------------------------------------------
 
+import inspect
 import time
 import os
-import random
 
+import numpy as np
+
+from random_streams import RandomStreams
+from charging_planner import ChargingPlanner
+from routing import Router
+from charging_queue import create_queue
+from history import HistoryRecorder, OUTPUT_FOLDER
+from streaming_stats import save_region_stats
+from frame_stream import FrameEncoder
+from shared_state import SharedState
+from replay import ReplayRecorder
+from snapshot import SimulationSnapshot
+from logs.log import Logger
+from entities.states import TRAVELING
 from utils import stepsToTime, isBetweenHours
 
 # -------------------------------------------------------------------------------------------------------------
 
+TIME_RANGES = [
+    ((7.5, 9), "rush_hour"),
+    ((17, 19), "rush_hour"),
+    ((12, 14), "lunch_time"),
+    ((21, 23.99), "night_time"),
+    ((0, 6), "dawn_time"),
+]
+TIME_LABELS = ("default",) + tuple(dict.fromkeys(label for _, label in TIME_RANGES))
+SNAPSHOT_SAVING_ENGINES = ("object",)
+SNAPSHOT_LOADING_ENGINES = ("object", "event")
+
+# -------------------------------------------------------------------------------------------------------------
+
 class Simulation:
     '''
     Simulation class to manage and run a traffic simulation.
     
     Attributes:
+        engine (str): The name of the engine, a class attribute: "object" here, "event" and "vectorized" in engines/.
         cars (list): List of car objects participating in the simulation.
         regions (list): List of region objects in the simulation.
-        visualization (SimulationVisualization): Object to handle the visualization of the simulation.
+        visualization (SimulationVisualization): Object to handle the visualization of the simulation, or None when headless.
         running (bool): Flag to indicate if the simulation is running.
         time_of_day (str): Current time of day in the simulation.
+        config (SimulationConfig): The configuration of the simulation.
         steps_per_day (int): Number of steps representing a full day in the simulation.
+        current_step (int): The next step to run; non-zero when the simulation was resumed from a snapshot.
+        streams (RandomStreams): The random streams of the run, or None if unknown.
+        router (Router): The routes, distances and trip lengths between regions.
+        planner (ChargingPlanner): The planner that assigns the charging regions of the cars once per step.
+        history (HistoryRecorder): The metrics of every region at every step.
     '''
-    def __init__(self, cars, regions, app, socketio):
+    engine = "object"
+
+    def __init__(self, cars, regions, config, app=None, socketio=None, headless=False, streams=None):
         self.cars = cars
         self.regions = regions
-        self.visualization = SimulationVisualization(app, socketio, regions, cars)
+        self.config = config
+        self.router = Router(regions, config)
+        self.visualization = None if headless else SimulationVisualization(app, socketio, regions, cars, config, streams, self.router)
         self.running = True
         self.time_of_day = "default"
-        self.steps_per_day = int(os.getenv("STEPS_PER_DAY"))
+        self.steps_per_day = config.steps_per_day
+        self.current_step = 0
+        self.streams = streams
+        Logger.configure(config.logged_categories)
+        self.planner = ChargingPlanner(regions, config, distances=self.router.distances)
+        for fleet in {id(car.fleet): car.fleet for car in cars}.values():
+            fleet.planner = self.planner
+        self.history = HistoryRecorder(regions, config.total_steps, config.history_interval)
+        for region in regions:
+            region.time_of_day = self.time_of_day
+            if region.queue.discipline != config.queue_discipline:
+                region.set_queue(create_queue(config, region.chargers))
         
     # ---------------------------------------------------------------------------------------------------------
 
@@ -39,18 +88,40 @@ class Simulation:
         """
         for car in self.cars:
             car.run(self.time_of_day)
+        self.planner.assign()
         for region in self.regions:
             region.run()
-        self.visualization.update_visualization(step, self.time_of_day)
+        self.history.record(step)
+        if self.visualization:
+            self.visualization.update_visualization(step, self.time_of_day)
     
     # ---------------------------------------------------------------------------------------------------------
     
     def checkTimeOfDay(self, step):
         """
         Determines the time of day based on the current simulation step and updates the `time_of_day` attribute accordingly.
+        The regions are told when it changes, so that they file their wait and charging times by time of day.
 
         Args:
             step (int): The current simulation step.
+        """
+        time_of_day = self.getTimeOfDay(step)
+        if time_of_day != self.time_of_day:
+            self.time_of_day = time_of_day
+            for region in self.regions:
+                region.time_of_day = time_of_day
+        
+    # ---------------------------------------------------------------------------------------------------------
+    
+    def getTimeOfDay(self, step):
+        """
+        Determines the time of day label of a simulation step.
+
+        Args:
+            step (int): The simulation step.
+
+        Returns:
+            str: The time of day label.
 
         Time ranges and their corresponding labels:
             - (7.5, 9): "rush_hour"
@@ -59,42 +130,107 @@ class Simulation:
             - (21, 23.99): "night_time"
             - (0, 6): "dawn_time"
         """
-        time_ranges = [
-            ((7.5, 9), "rush_hour"),
-            ((17, 19), "rush_hour"),
-            ((12, 14), "lunch_time"),
-            ((21, 23.99), "night_time"),
-            ((0, 6), "dawn_time"),
-        ]
-        for (start, end), label in time_ranges:
+        for (start, end), label in TIME_RANGES:
             if isBetweenHours(start, end, step, self.steps_per_day):
-                self.time_of_day = label
-                return
-        self.time_of_day = "default"
+                return label
+        return "default"
             
     # ---------------------------------------------------------------------------------------------------------
 
-    def run(self, steps):
+    def save_snapshot(self, path):
+        """
+        Saves the full state of the simulation (cars, regions, queues, history, step counter and
+        random stream states) to a compact binary snapshot. Only the object engine keeps every car up
+        to date after every step: the event engine updates cars when their events are handled, and the
+        vectorized engine has no car objects.
+
+        Args:
+            path (str): The path of the snapshot file.
+
+        Raises:
+            ValueError: If the engine cannot save snapshots.
+        """
+        if self.engine not in SNAPSHOT_SAVING_ENGINES:
+            raise ValueError(f"Snapshots cannot be saved with the {self.engine} engine, only with the object engine")
+        SimulationSnapshot.save(self, path)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def load_snapshot(cls, path, config, regions=None, **kwargs):
         """
-        Runs the simulation for a given number of steps.
+        Creates a simulation resumed from a snapshot. The cars follow the parameters of the
+        given configuration, so a warm-up snapshot can be reused across scenarios.
+
+        Args:
+            path (str): The path of the snapshot file.
+            config (SimulationConfig): The configuration to resume with.
+            regions (list): The regions of the scenario to resume in, or None to use those of the snapshot.
+            **kwargs: Extra arguments of the simulation class (e.g. app, socketio and headless).
+
+        Returns:
+            Simulation: The restored simulation, ready to run from the saved step.
+
+        Raises:
+            ValueError: If the engine cannot load snapshots, which hold car objects.
+        """
+        if cls.engine not in SNAPSHOT_LOADING_ENGINES:
+            raise ValueError(f"Snapshots cannot be loaded by the {cls.engine} engine, only by the object and event engines")
+        cars, regions, step, seed, history = SimulationSnapshot.load(path, config, regions)
+        if seed is not None and "streams" in inspect.signature(cls).parameters:
+            kwargs.setdefault("streams", RandomStreams(seed))
+        simulation = cls(cars, regions, config, **kwargs)
+        simulation.current_step = step
+        simulation.history.restore(history)
+        if simulation.streams is None and seed is not None:
+            simulation.streams = RandomStreams(seed)
+        return simulation
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def run(self, steps, snapshot=None, record=None):
+        """
+        Runs the simulation for a given number of steps, starting from the current step.
+        Steps are paced for the visualization, or run back-to-back when headless.
 
         Args:
             steps (int): The number of steps to run the simulation.
+            snapshot (str): Path where a snapshot is saved once all the steps have run, or None.
+            record (str): Path of a replay file where the map of every step is recorded, or None.
+                          The cars must be up to date after every step, which is the case for the object engine.
         """
+        self.history.reserve(self.history.length + self.history.samples(steps))
+        recorder = None
+        if record:
+            view = self.visualization or SimulationVisualization(None, None, self.regions, self.cars, self.config, self.streams, self.router)
+            recorder = ReplayRecorder(record, view, self.config)
         try:
-            for step in range(steps):
+            for step in range(self.current_step, self.current_step + steps):
                 if not self.running:
                     break
                 self.checkTimeOfDay(step)
                 self.run_step(step)
-                time.sleep(1 / 60)
+                self.current_step = step + 1
+                if recorder:
+                    recorder.record(step, self.time_of_day)
+                if self.visualization:
+                    time.sleep(1 / 60)
+            if snapshot and self.running:
+                self.save_snapshot(snapshot)
+                print(f"\nSnapshot saved to {snapshot}")
             print("\nSimulation completed.")
         except KeyboardInterrupt:
             print("\nSimulation interrupted.")
         finally:
-            for region in self.regions:
-                region.save_history()
-            self.visualization.signal_end()
+            Logger.flush()
+            self.history.save(json_export=self.config.history_json)
+            save_region_stats(self.regions, OUTPUT_FOLDER)
+            if recorder:
+                recorder.close()
+                print(f"\nReplay saved to {record}")
+            if self.visualization:
+                self.visualization.update_visualization(self.current_step - 1, self.time_of_day, force=True)
+                self.visualization.signal_end()
             
 # -------------------------------------------------------------------------------------------------------------
 
@@ -108,86 +244,121 @@ class SimulationVisualization:
         regions (list): A list of region objects involved in the simulation.
         displayed_cars (list): A list of car objects selected for display.
         steps_per_day (int): Number of simulation steps per day.
+        streams (RandomStreams): The random streams used to pick the displayed cars.
+        router (Router): The routes along which the positions of travelling cars are interpolated.
+        encoder (FrameEncoder): The delta encoder of the frames.
+        frame_interval (float): The minimum time between two frames in seconds.
+        last_frame (float): The time the last frame was sent, from time.perf_counter.
     """
-    def __init__(self, app, socketio, regions, cars):
+    def __init__(self, app, socketio, regions, cars, config, streams=None, router=None):
         self.app = app
         self.socketio = socketio
         self.regions = regions
-        self.select_cars_for_display(cars)
-        self.steps_per_day = int(os.getenv("STEPS_PER_DAY"))
-        print(f"Visualization running at http://localhost:8000")
+        self.streams = streams if streams is not None else RandomStreams()
+        self.router = router if router is not None else Router(regions, config)
+        self.select_cars_for_display(cars, config.displayed_cars_per_region)
+        self.steps_per_day = config.steps_per_day
+        self.encoder = FrameEncoder(len(regions), len(self.displayed_cars))
+        self.frame_interval = 1 / config.frame_rate
+        self.last_frame = -self.frame_interval
+        if socketio is not None:
+            self.socketio.on_event('connect', lambda auth=None: self.encoder.request_keyframe())
+            print(f"Visualization running at http://localhost:8000")
         
     # ---------------------------------------------------------------------------------------------------------
         
-    def select_cars_for_display(self, cars):
+    def select_cars_for_display(self, cars, count=2):
         """
         Selects cars for display based on their region prefix and marks them as displayed.
 
         Args:
             cars (list): A list of car objects to be filtered and selected for display.
+            count (int): The number of cars displayed per region.
 
         Returns:
             None
         """
         def get_random_cars(cars, prefix, count=2):
             filtered_cars = [car for car in cars if car.id.startswith(prefix)]
-            return random.sample(filtered_cars, min(len(filtered_cars), count))
+            rng = self.streams.generator("display", prefix)
+            return [filtered_cars[i] for i in rng.choice(len(filtered_cars), min(len(filtered_cars), count), replace=False)]
         region_names = [region.id for region in self.regions]
         self.displayed_cars = []
         for name in region_names:
-            selected_cars = get_random_cars(cars, name)
+            selected_cars = get_random_cars(cars, name, count)
             for car in selected_cars:
                 car.displayed = True
             self.displayed_cars.extend(selected_cars)
             
     # ---------------------------------------------------------------------------------------------------------
 
-    def update_visualization(self, step, time_of_day):
+    def update_visualization(self, step, time_of_day, force=False):
+        """
+        Publishes the state of the map, at most frame_rate times per second whatever the speed of the
+        simulation: the steps in between are skipped without building anything.
+
+        Args:
+            step (int): The current simulation step.
+            time_of_day (str): The current time of day in the simulation.
+            force (bool): Whether to publish the state even if the previous one is too recent, e.g. the last one.
+        """
+        now = time.perf_counter()
+        if not force and now - self.last_frame < self.frame_interval:
+            return
+        self.last_frame = now
+        self.publish(step, time_of_day, *self.map_state())
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def map_state(self):
         """
-        Updates the visualization by emitting the current state of regions and cars to the client.
+        Reads the state shown on the map. The positions of the travelling cars are interpolated along
+        their routes from their trip progress, all at once.
+
+        Returns:
+            tuple: The (regions x fields) values of the regions, in the order of frame_stream.REGION_FIELDS,
+                   and the (cars x 2) latitude and longitude of the displayed cars.
+        """
+        rows = []
+        for region in self.regions:
+            region.update_metrics()
+            wait_time = region.wait_time_stats.overall.summary()
+            rows.append((
+                region.cars_present, region.cars_home_charging, region.available_chargers, len(region.queue),
+                region.cars_charged, region.average_autonomy, region.average_home_time, region.charger_utilization,
+                region.average_queue_size, region.stress_metric, region.average_wait_time, region.average_charging_time,
+                wait_time["p95"], wait_time["p99"], region.charging_time_stats.overall.summary()["p95"]
+            ))
+        region_values = np.array(rows, dtype=np.float64)
+        positions = np.array([(car.latitude, car.longitude) for car in self.displayed_cars], dtype=np.float64).reshape(-1, 2)
+        travelling = [i for i, car in enumerate(self.displayed_cars) if car.state == TRAVELING]
+        trips = []
+        for i in travelling:
+            car = self.displayed_cars[i]
+            trips.append((car.current_region, car.next_region, car.currentTripSteps / car.stepsToTravel if car.stepsToTravel else 0))
+        trip_latitudes, trip_longitudes = self.router.positions(trips)
+        positions[travelling, 0] = trip_latitudes
+        positions[travelling, 1] = trip_longitudes
+        return region_values, positions
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def publish(self, step, time_of_day, region_values, car_positions):
+        """
+        Sends a frame of the map to the clients. A frame only holds the region fields and car positions
+        that changed since the previous one (see FrameEncoder).
 
         Args:
             step (int): The current simulation step.
             time_of_day (str): The current time of day in the simulation.
+            region_values (np.ndarray): The (regions x fields) values of the regions.
+            car_positions (np.ndarray): The (cars x 2) latitude and longitude of the displayed cars.
         """
-        regions_data = [
-            {
-                'name': region.id,
-                'lat': region.latitude,
-                'lng': region.longitude,
-                'cars_present': region.cars_present,
-                'home_charging': region.cars_home_charging,
-                'available_chargers': region.available_chargers,
-                'queued_cars': region.queue.qsize(),
-                'cars_charged': region.cars_charged,
-                'autonomy': round(region.average_autonomy),
-                'home_time': round(region.average_home_time),
-                'charger_utilization': round(region.charger_utilization),
-                'queue_size': round(region.average_queue_size),
-                'stress_metric': round(region.stress_metric, 1),
-                'wait_time': round(region.average_wait_time),
-                'charging_time': round(region.average_charging_time)
-            }
-            for region in self.regions
-        ]
-        cars_data = [
-            {
-                'name': car.id,
-                'lat': car.latitude,
-                'lng': car.longitude
-            }
-            for car in self.displayed_cars
-        ]
-        self.socketio.emit(
-            'map_updated',
-            {
-                'step': step,
-                'region_data': regions_data,
-                'car_data': cars_data,
-                'time': stepsToTime(step, self.steps_per_day),
-                'rush_hour': time_of_day
-            }
-        )
+        if self.encoder.keyframe:
+            self.socketio.emit('map_init', FrameEncoder.init_message(self.regions, self.displayed_cars))
+        frame = self.encoder.encode(region_values, car_positions)
+        frame.update(step=step, time=stepsToTime(step, self.steps_per_day), rush_hour=time_of_day)
+        self.socketio.emit('map_frame', frame)
 
     # ---------------------------------------------------------------------------------------------------------
 
@@ -196,6 +367,46 @@ class SimulationVisualization:
         Emit a 'simulation_end' signal and terminate the program.
         """
         self.socketio.emit('simulation_end', {})
+        Logger.close()
         os._exit(0)
-            
+
+# -------------------------------------------------------------------------------------------------------------
+
+class SharedStateVisualization(SimulationVisualization):
+    """
+    Visualization of a simulation that runs in its own process: the state of the map is published
+    to shared memory (see SharedState), from where the web process reads, encodes and sends the
+    frames, so the simulation never serializes nor competes with the server for the GIL.
+
+    Attributes:
+        state (SharedState): The shared memory block, created by this process.
+    """
+    def __init__(self, regions, cars, config, streams=None, router=None):
+        super().__init__(None, None, regions, cars, config, streams, router)
+        self.state = SharedState(len(regions), len(self.displayed_cars))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def publish(self, step, time_of_day, region_values, car_positions):
+        """
+        Writes the state of the map to shared memory.
+
+        Args:
+            step (int): The current simulation step.
+            time_of_day (str): The current time of day in the simulation.
+            region_values (np.ndarray): The (regions x fields) values of the regions.
+            car_positions (np.ndarray): The (cars x 2) latitude and longitude of the displayed cars.
+        """
+        self.state.write(step, TIME_LABELS.index(time_of_day), region_values, car_positions)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def signal_end(self):
+        """
+        Tells the web process that the simulation has ended, once its last state was published.
+        """
+        self.state.finish()
+        self.state.close()
+        Logger.close()
+
 # -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,194 @@
+# -------------------------------------------------------------------------------------------------------------
+
+from itertools import repeat
+
+import numpy as np
+
+from entities.car import Car, FleetParameters
+from entities.region import Region
+from entities.states import CHARGING
+from history import METRIC_NAMES
+from charging_queue import create_queue
+from streaming_stats import pack_stats, region_entries, restore_region_stats
+
+# -------------------------------------------------------------------------------------------------------------
+
+CAR_FLOAT_FIELDS = ["full_autonomy", "autonomy", "latitude", "longitude", "distance_travelled", "distanceToTravel"]
+CAR_INT_FIELDS = ["wait_time", "charging_time", "stepsToTravel", "currentTripSteps"]
+CAR_BOOL_FIELDS = ["charge_at_destination", "stuck_at_region", "displayed", "stop_charging_at_home"]
+
+REGION_SPEC_FIELDS = ["latitude", "longitude", "avg_drivers", "avg_income", "chargers", "traffic"]
+REGION_COUNTER_FIELDS = [
+    "total_cars", "cars_present", "cars_home_charging", "home_charged", "available_chargers", "queued_cars",
+    "cars_charged", "total_autonomy", "average_autonomy", "average_home_time", "charger_utilization",
+    "average_queue_size", "stress_metric", "average_wait_time", "average_charging_time"
+]
+
+CAR_RECORD = np.dtype(
+    [("state", np.int8), ("home", np.int32), ("current", np.int32), ("next", np.int32), ("station_region", np.int32),
+     ("key", np.uint64), ("draws", np.int64)]
+    + [(name, np.float64) for name in CAR_FLOAT_FIELDS]
+    + [(name, np.int64) for name in CAR_INT_FIELDS]
+    + [(name, bool) for name in CAR_BOOL_FIELDS]
+)
+
+FORMAT_VERSION = 3
+
+# -------------------------------------------------------------------------------------------------------------
+
+class SimulationSnapshot:
+    """
+    Compact binary snapshot of an object-based simulation, stored as a compressed NumPy archive.
+
+    The state is stored in a few column arrays: one CAR_RECORD per car (regions as indices, with the key and draw count of its random stream),
+    one record per region with its counters, the history and streaming wait and charging time statistics of every region, the charging queues
+    in order (with the keys and bookings of their discipline) and the step counter, with the FORMAT_VERSION of the layout. Keeping the number
+    of arrays small keeps loading fast, since the archive pays a fixed cost per array.
+    Restoring rebuilds the objects straight from these arrays, without running the CarSeeder.
+    """
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def save(simulation, path):
+        """
+        Writes the full state of a simulation to a snapshot file.
+
+        Args:
+            simulation (Simulation): The simulation to save. Its cars must be up to date, which is
+                                     the case for the object engine.
+            path (str): The path of the snapshot file, used as given (numpy would append ".npz" to a path).
+        """
+        cars = simulation.cars
+        regions = simulation.regions
+        region_index = {region.id: r for r, region in enumerate(regions)}
+        car_index = {id(car): i for i, car in enumerate(cars)}
+        data = {
+            "format_version": np.array(FORMAT_VERSION),
+            "step": np.array(simulation.current_step),
+            "seed": np.array([str(simulation.streams.seed)] if simulation.streams is not None else [], dtype=str),
+            "car_id": np.array([car.id for car in cars]),
+            "car_station": np.array([car.station.id if car.station else "" for car in cars], dtype=str),
+            "region_id": np.array([region.id for region in regions])
+        }
+        records = np.zeros(len(cars), dtype=CAR_RECORD)
+        records["state"] = [car.state for car in cars]
+        records["home"] = [region_index[car.home_region.id] for car in cars]
+        records["current"] = [region_index[car.current_region.id] for car in cars]
+        records["next"] = [region_index[car.next_region.id] if car.next_region else -1 for car in cars]
+        records["station_region"] = [region_index[car.station.region.id] if car.station else -1 for car in cars]
+        records["key"] = [car.key for car in cars]
+        records["draws"] = [car.draws for car in cars]
+        for name in CAR_FLOAT_FIELDS + CAR_INT_FIELDS + CAR_BOOL_FIELDS:
+            records[name] = [getattr(car, name) for car in cars]
+        data["cars"] = records
+        region_fields = REGION_SPEC_FIELDS + REGION_COUNTER_FIELDS
+        data["regions"] = np.rec.fromarrays([np.array([getattr(region, name) for region in regions]) for name in region_fields], names=region_fields)
+        queues = [region.queue.items() for region in regions]
+        data["queue_size"] = np.array([len(queue) for queue in queues], dtype=np.int32)
+        data["queue_cars"] = np.array([car_index[id(car)] for queue in queues for car, _ in queue], dtype=np.int32)
+        data["queue_keys"] = np.array([key for queue in queues for _, key in queue], dtype=np.float64)
+        data["queue_clock"] = np.array([region.queue.clock for region in regions], dtype=np.int64)
+        data["queue_discipline"] = np.array(simulation.config.queue_discipline)
+        bookings = [(r, slot, booked) for r, region in enumerate(regions) for slot, booked in getattr(region.queue, "bookings", {}).items()]
+        data["queue_bookings"] = np.array(bookings, dtype=np.int64).reshape(len(bookings), 3)
+        data["history"] = np.stack([simulation.history.metric(metric).T for metric in METRIC_NAMES])
+        data["history_step"] = simulation.history.steps[:simulation.history.length]
+        data.update(pack_stats(region_entries(regions)))
+        with open(path, "wb") as file:
+            np.savez_compressed(file, **data)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def load(path, config, regions=None):
+        """
+        Reads a snapshot file and rebuilds its cars and regions.
+
+        When regions are given (e.g. freshly read for another scenario), they are matched by ID and
+        keep their own chargers and traffic, while the counters, queues and history come from the
+        snapshot; chargers that were busy stay busy, so a region with fewer chargers may start with
+        a negative number of available chargers until its sessions end. Cars keep their station if
+        the given regions have a station with the same ID, and charging cars otherwise take a
+        charging point of the nearest free station of their region. Queued cars keep their place
+        when the configuration has the queue discipline of the snapshot, and are queued again in
+        their saved order otherwise.
+
+        Args:
+            path (str): The path of the snapshot file.
+            config (SimulationConfig): The configuration the restored cars follow.
+            regions (list): The regions to restore into, or None to rebuild those of the snapshot.
+
+        Returns:
+            tuple: The list of cars, the list of regions, the step to resume from, the master seed
+                   of the run that produced the snapshot (or None) and the history, which maps each
+                   metric to its (samples x regions) values and "step" to the step of each sample.
+
+        Raises:
+            ValueError: If the snapshot has another format version, or its regions do not match the given ones.
+        """
+        with np.load(path) as archive:
+            data = {name: archive[name] for name in archive.files}
+        if "format_version" not in data or int(data["format_version"]) != FORMAT_VERSION:
+            raise ValueError(f"The snapshot {path} was not written in snapshot format version {FORMAT_VERSION}")
+        region_ids = data["region_id"].tolist()
+        region_columns = {name: data["regions"][name].tolist() for name in REGION_SPEC_FIELDS + REGION_COUNTER_FIELDS}
+        if regions is None:
+            specs = zip(region_ids, *(region_columns[name] for name in REGION_SPEC_FIELDS))
+            regions = [Region(*spec) for spec in specs]
+        else:
+            by_id = {region.id: region for region in regions}
+            missing = [region_id for region_id in region_ids if region_id not in by_id]
+            if missing or len(regions) != len(region_ids):
+                raise ValueError(f"The snapshot regions do not match the given regions: {', '.join(missing)}")
+            regions = [by_id[region_id] for region_id in region_ids]
+        for r, region in enumerate(regions):
+            busy = region_columns["chargers"][r] - region_columns["available_chargers"][r]
+            for name in REGION_COUNTER_FIELDS:
+                setattr(region, name, region_columns[name][r])
+            region.available_chargers = region.chargers - busy
+        restore_region_stats(regions, data)
+        history = {metric: values.T for metric, values in zip(METRIC_NAMES, data["history"])}
+        history["step"] = data["history_step"]
+
+        records = data["cars"]
+        fleet = FleetParameters(regions, config)
+        cars = list(map(
+            Car.restore, repeat(fleet), data["car_id"].tolist(), records["key"].tolist(), records["draws"].tolist(),
+            records["state"].tolist(), map(regions.__getitem__, records["home"].tolist()),
+            map(regions.__getitem__, records["current"].tolist()), [regions[r] if r >= 0 else None for r in records["next"].tolist()],
+            *(records[name].tolist() for name in CAR_FLOAT_FIELDS + CAR_INT_FIELDS + CAR_BOOL_FIELDS)
+        ))
+
+        stations = [{station.id: station for station in region.stations} for region in regions]
+        for region in regions:
+            for station in region.stations:
+                station.available = station.capacity
+        station_regions = records["station_region"].tolist()
+        station_ids = data["car_station"].tolist()
+        for i in np.flatnonzero((records["station_region"] >= 0) | (records["state"] == CHARGING)).tolist():
+            car = cars[i]
+            car.station = stations[station_regions[i]].get(station_ids[i]) if station_regions[i] >= 0 else None
+            if car.state == CHARGING:
+                car.station = car.current_region.take_station(car.station)
+
+        queue_cars = data["queue_cars"].tolist()
+        same_discipline = str(data["queue_discipline"]) == config.queue_discipline
+        queue_keys = data["queue_keys"].tolist() if same_discipline else [None] * len(queue_cars)
+        start = 0
+        for region, size, clock in zip(regions, data["queue_size"].tolist(), data["queue_clock"].tolist()):
+            region.queue = create_queue(config, region.chargers)
+            region.queue.clock = clock
+            for i, key in zip(queue_cars[start:start + size], queue_keys[start:start + size]):
+                region.queue.put(cars[i], key)
+            start += size
+        if same_discipline:
+            for region in regions:
+                if hasattr(region.queue, "bookings"):
+                    region.queue.bookings = {}
+            for r, slot, booked in data["queue_bookings"].tolist():
+                regions[r].queue.bookings[slot] = booked
+        seed = int(data["seed"][0]) if len(data["seed"]) else None
+        return cars, regions, int(data["step"]), seed, history
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
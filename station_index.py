@@ -0,0 +1,140 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import heapq
+
+from math import cos, radians, floor, hypot, inf
+
+# -------------------------------------------------------------------------------------------------------------
+
+KM_PER_DEGREE = 111.2
+
+# -------------------------------------------------------------------------------------------------------------
+
+class StationIndex:
+    """
+    Uniform grid index of the charging stations of the city, for nearest-station queries.
+
+    Station coordinates are projected to kilometers (an equirectangular projection around the mean
+    latitude, accurate at city scale) and bucketed in square cells of cell_size kilometers. A query
+    visits the cells ring by ring outwards from the query point and stops as soon as the next ring
+    is farther than the k-th best station found or than the maximum distance, so it only looks at
+    the stations around the point instead of scanning all of them.
+
+    Attributes:
+        stations (list): The indexed stations.
+        cell_size (float): The side of a grid cell in kilometers.
+        reference_latitude (float): The latitude of the projection.
+        longitude_scale (float): Kilometers per degree of longitude at the reference latitude.
+        cells (dict): Maps (column, row) to the (x, y, station) entries of the cell.
+        bounds (tuple): The smallest and largest column and row of the cells with stations.
+    """
+    __slots__ = ("stations", "cell_size", "reference_latitude", "longitude_scale", "cells", "bounds")
+
+    def __init__(self, stations, cell_size=1.0):
+        self.stations = list(stations)
+        self.cell_size = cell_size
+        self.reference_latitude = sum(s.latitude for s in self.stations) / len(self.stations) if self.stations else 0.0
+        self.longitude_scale = KM_PER_DEGREE * cos(radians(self.reference_latitude))
+        self.cells = {}
+        for station in self.stations:
+            x, y = self.project(station.latitude, station.longitude)
+            self.cells.setdefault(self.cell(x, y), []).append((x, y, station))
+        columns = [c for c, _ in self.cells] or [0]
+        rows = [r for _, r in self.cells] or [0]
+        self.bounds = (min(columns), max(columns), min(rows), max(rows))
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def project(self, latitude, longitude):
+        """
+        Projects a position to kilometers.
+
+        Args:
+            latitude (float): The latitude of the position.
+            longitude (float): The longitude of the position.
+
+        Returns:
+            tuple: The x and y coordinates in kilometers.
+        """
+        return longitude * self.longitude_scale, latitude * KM_PER_DEGREE
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def cell(self, x, y):
+        """
+        Gets the grid cell of a projected position.
+
+        Args:
+            x (float): The x coordinate in kilometers.
+            y (float): The y coordinate in kilometers.
+
+        Returns:
+            tuple: The column and row of the cell.
+        """
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def nearest(self, latitude, longitude, k=1, max_distance=inf, accept=None):
+        """
+        Finds the k stations nearest to a position, e.g. the stations with free charging points
+        within a car's remaining autonomy.
+
+        Args:
+            latitude (float): The latitude of the position.
+            longitude (float): The longitude of the position.
+            k (int): The maximum number of stations to return.
+            max_distance (float): Stations at this distance in kilometers or farther are ignored.
+            accept (callable): A predicate that stations must satisfy, or None to accept them all.
+
+        Returns:
+            list: The (distance, station) pairs of the nearest stations, nearest first.
+        """
+        if k <= 0:
+            return []
+        x, y = self.project(latitude, longitude)
+        column, row = self.cell(x, y)
+        min_column, max_column, min_row, max_row = self.bounds
+        reach = max(column - min_column, max_column - column, row - min_row, max_row - row, 0)
+        best = []  # max-heap of (-distance, sequence, station)
+        sequence = 0
+        for ring in range(reach + 1):
+            bound = (ring - 1) * self.cell_size
+            if bound >= max_distance or (len(best) == k and bound > -best[0][0]):
+                break
+            for cell in self.ring(column, row, ring):
+                for sx, sy, station in self.cells.get(cell, ()):
+                    distance = hypot(sx - x, sy - y)
+                    if distance >= max_distance or (len(best) == k and distance >= -best[0][0]):
+                        continue
+                    if accept is not None and not accept(station):
+                        continue
+                    sequence += 1
+                    if len(best) == k:
+                        heapq.heapreplace(best, (-distance, sequence, station))
+                    else:
+                        heapq.heappush(best, (-distance, sequence, station))
+        return [(-distance, station) for distance, _, station in sorted(best, reverse=True)]
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def ring(column, row, ring):
+        """
+        Lists the cells at a given Chebyshev distance from a cell.
+
+        Args:
+            column (int): The column of the center cell.
+            row (int): The row of the center cell.
+            ring (int): The distance in cells.
+
+        Returns:
+            list: The (column, row) cells of the ring.
+        """
+        if ring == 0:
+            return [(column, row)]
+        cells = [(column + dx, row + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+        cells += [(column + dx, row + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+        return cells
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,484 @@
+# -------------------------------------------------------------------------------------------------------------
+
+import os
+
+from math import asin, sin, pi, sqrt, inf
+
+import numpy as np
+
+# -------------------------------------------------------------------------------------------------------------
+
+COMPRESSION = 100
+BUFFER_FACTOR = 5
+QUANTILES = (0.5, 0.95, 0.99)
+STAT_NAMES = ("wait_time", "charging_time", "home_time")
+STATS_FILE = "stats.npz"
+
+# -------------------------------------------------------------------------------------------------------------
+
+class RunningMoments:
+    """
+    Count, mean and variance of a stream of values, updated with Welford's algorithm and merged
+    with Chan's parallel formula, so partial results from regions or replications add up exactly.
+
+    Attributes:
+        count (int): The number of values.
+        mean (float): The mean of the values.
+        m2 (float): The sum of the squared deviations from the mean.
+    """
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def add(self, value):
+        """
+        Adds a value to the stream.
+
+        Args:
+            value (float): The value.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def merge(self, other):
+        """
+        Adds the values of another stream.
+
+        Args:
+            other (RunningMoments): The other stream.
+        """
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def variance(self):
+        """
+        float: The sample variance of the values, or 0 with fewer than two values.
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    @property
+    def std(self):
+        """
+        float: The sample standard deviation of the values.
+        """
+        return sqrt(self.variance)
+
+# -------------------------------------------------------------------------------------------------------------
+
+class TDigest:
+    """
+    Merging t-digest (Dunning and Ertl) of a stream of values, for quantile estimates in constant
+    memory. Values are buffered and, when the buffer is full, merged with the centroids into at
+    most about compression centroids, sized by the k1 scale function so that the centroids near
+    the tails stay small and the extreme quantiles (P95, P99) stay accurate. Digests of different
+    streams merge by pooling their centroids.
+
+    Attributes:
+        compression (float): The compression parameter (delta).
+        means (list): The means of the centroids, in ascending order.
+        weights (list): The weights of the centroids.
+        buffer (list): The (value, weight) points not yet merged into the centroids.
+        total (float): The total weight of the digest.
+        minimum (float): The smallest value.
+        maximum (float): The largest value.
+    """
+    __slots__ = ("compression", "means", "weights", "buffer", "total", "minimum", "maximum")
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.buffer = []
+        self.total = 0.0
+        self.minimum = inf
+        self.maximum = -inf
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def add(self, value, weight=1.0):
+        """
+        Adds a value to the digest.
+
+        Args:
+            value (float): The value.
+            weight (float): The weight of the value.
+        """
+        self.buffer.append((value, weight))
+        self.total += weight
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        if len(self.buffer) >= BUFFER_FACTOR * self.compression:
+            self.compress()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def merge(self, other):
+        """
+        Adds the values of another digest.
+
+        Args:
+            other (TDigest): The other digest.
+        """
+        self.buffer.extend(zip(other.means, other.weights))
+        self.buffer.extend(other.buffer)
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.compress()
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def limit(self, q):
+        """
+        Gets the largest quantile a centroid starting at quantile q may reach, one unit of the
+        k1 scale function further.
+
+        Args:
+            q (float): The quantile where the centroid starts.
+
+        Returns:
+            float: The quantile where the centroid must end.
+        """
+        k = self.compression / (2 * pi) * asin(2 * min(max(q, 0.0), 1.0) - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (sin(k * 2 * pi / self.compression) + 1) / 2
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def compress(self):
+        """
+        Merges the buffered points into the centroids.
+        """
+        if not self.buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self.buffer)
+        self.buffer = []
+        means, weights = [], []
+        mean, weight = points[0]
+        done = 0.0
+        limit = self.limit(0.0) * self.total
+        for value, extra in points[1:]:
+            if done + weight + extra <= limit:
+                weight += extra
+                mean += (value - mean) * extra / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                done += weight
+                limit = self.limit(done / self.total) * self.total
+                mean, weight = value, extra
+        means.append(mean)
+        weights.append(weight)
+        self.means = means
+        self.weights = weights
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def quantiles(self, qs):
+        """
+        Estimates quantiles of the values, interpolating between the centers of the centroids and
+        towards the smallest and largest values at the ends.
+
+        Args:
+            qs (tuple): The quantiles, between 0 and 1.
+
+        Returns:
+            list: The estimate of each quantile, or 0 for an empty digest.
+        """
+        self.compress()
+        if not self.means:
+            return [0.0] * len(qs)
+        centers = []
+        done = 0.0
+        for weight in self.weights:
+            centers.append(done + weight / 2)
+            done += weight
+        points = [(0.0, self.minimum)] + list(zip(centers, self.means)) + [(self.total, self.maximum)]
+        estimates = []
+        for q in qs:
+            target = q * self.total
+            i = 1
+            while i < len(points) - 1 and points[i][0] <= target:
+                i += 1
+            (left, low), (right, high) = points[i - 1], points[i]
+            estimates.append(low + (high - low) * (target - left) / (right - left) if right > left else high)
+        return estimates
+
+# -------------------------------------------------------------------------------------------------------------
+
+class StreamingStats:
+    """
+    Streaming summary of a duration (e.g. the wait times of a region): exact count, mean and
+    standard deviation, and the P50, P95 and P99 estimated by a t-digest. The summary is cached
+    until the next value arrives, so reading it on every step is cheap.
+
+    Attributes:
+        moments (RunningMoments): The count, mean and variance.
+        digest (TDigest): The quantile sketch.
+        cached (dict): The last summary, or None if values arrived since.
+    """
+    __slots__ = ("moments", "digest", "cached")
+
+    def __init__(self):
+        self.moments = RunningMoments()
+        self.digest = TDigest()
+        self.cached = None
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def add(self, value):
+        """
+        Adds a value.
+
+        Args:
+            value (float): The value.
+        """
+        self.moments.add(value)
+        self.digest.add(value)
+        self.cached = None
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def merge(self, other):
+        """
+        Adds the values of another summary.
+
+        Args:
+            other (StreamingStats): The other summary.
+        """
+        self.moments.merge(other.moments)
+        self.digest.merge(other.digest)
+        self.cached = None
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def summary(self):
+        """
+        Gets the statistics of the values.
+
+        Returns:
+            dict: The count, mean, std, p50, p95 and p99.
+        """
+        if self.cached is None:
+            p50, p95, p99 = self.digest.quantiles(QUANTILES)
+            self.cached = {"count": self.moments.count, "mean": self.moments.mean, "std": self.moments.std, "p50": p50, "p95": p95, "p99": p99}
+        return self.cached
+
+# -------------------------------------------------------------------------------------------------------------
+
+class BandedStats:
+    """
+    Streaming summaries of a duration over the whole run and per time of day band.
+
+    Attributes:
+        overall (StreamingStats): The summary of every value.
+        bands (dict): Maps each time of day label to the summary of its values.
+    """
+    __slots__ = ("overall", "bands")
+
+    def __init__(self):
+        self.overall = StreamingStats()
+        self.bands = {}
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def add(self, value, band):
+        """
+        Adds a value.
+
+        Args:
+            value (float): The value.
+            band (str): The time of day label when the value was measured.
+        """
+        self.overall.add(value)
+        stats = self.bands.get(band)
+        if stats is None:
+            stats = self.bands[band] = StreamingStats()
+        stats.add(value)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def merge(self, other):
+        """
+        Adds the values of other summaries, e.g. of another region or replication.
+
+        Args:
+            other (BandedStats): The other summaries.
+        """
+        self.overall.merge(other.overall)
+        for band, stats in other.bands.items():
+            self.bands.setdefault(band, StreamingStats()).merge(stats)
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def summary(self):
+        """
+        Gets the statistics of the values, overall and per band.
+
+        Returns:
+            dict: Maps "all" and each time of day label to the statistics of StreamingStats.summary.
+        """
+        return {"all": self.overall.summary(), **{band: stats.summary() for band, stats in sorted(self.bands.items())}}
+
+    # ---------------------------------------------------------------------------------------------------------
+
+    def entries(self):
+        """
+        Lists the summaries, keyed by band ("" for the overall one).
+
+        Returns:
+            list: The (band, StreamingStats) pairs.
+        """
+        return [("", self.overall)] + sorted(self.bands.items())
+
+# -------------------------------------------------------------------------------------------------------------
+
+def pack_stats(entries):
+    """
+    Packs streaming summaries into flat NumPy arrays, for snapshots and output files.
+
+    Args:
+        entries (list): The (key, StreamingStats) pairs, where keys are strings.
+
+    Returns:
+        dict: The arrays, by name.
+    """
+    digests = [stats.digest for _, stats in entries]
+    return {
+        "stats_key": np.array([key for key, _ in entries], dtype=str),
+        "stats_moments": np.array([(s.moments.count, s.moments.mean, s.moments.m2) for _, s in entries], dtype=np.float64).reshape(len(entries), 3),
+        "stats_digest": np.array([(d.compression, d.total, d.minimum, d.maximum) for d in digests], dtype=np.float64).reshape(len(entries), 4),
+        "stats_sizes": np.array([(len(d.means), len(d.buffer)) for d in digests], dtype=np.int64).reshape(len(entries), 2),
+        "stats_points": np.array([point for d in digests for point in list(zip(d.means, d.weights)) + d.buffer], dtype=np.float64).reshape(-1, 2)
+    }
+
+# -------------------------------------------------------------------------------------------------------------
+
+def unpack_stats(data):
+    """
+    Rebuilds the streaming summaries packed by pack_stats.
+
+    Args:
+        data (dict): The arrays, by name.
+
+    Returns:
+        dict: Maps each key to its StreamingStats.
+    """
+    points = data["stats_points"].tolist()
+    start = 0
+    result = {}
+    for key, (count, mean, m2), (compression, total, minimum, maximum), (centroids, buffered) in zip(
+            data["stats_key"].tolist(), data["stats_moments"].tolist(), data["stats_digest"].tolist(), data["stats_sizes"].tolist()):
+        stats = StreamingStats()
+        stats.moments = RunningMoments(int(count), mean, m2)
+        digest = stats.digest
+        digest.compression, digest.total, digest.minimum, digest.maximum = compression, total, minimum, maximum
+        digest.means = [point[0] for point in points[start:start + centroids]]
+        digest.weights = [point[1] for point in points[start:start + centroids]]
+        digest.buffer = [tuple(point) for point in points[start + centroids:start + centroids + buffered]]
+        start += centroids + buffered
+        result[key] = stats
+    return result
+
+# -------------------------------------------------------------------------------------------------------------
+
+def region_entries(regions):
+    """
+    Lists the streaming summaries of the durations of regions, keyed by "region/duration/band".
+
+    Args:
+        regions (list): The regions.
+
+    Returns:
+        list: The (key, StreamingStats) pairs.
+    """
+    return [
+        (f"{region.id}/{name}/{band}", stats)
+        for region in regions for name in STAT_NAMES for band, stats in getattr(region, name + "_stats").entries()
+    ]
+
+# -------------------------------------------------------------------------------------------------------------
+
+def restore_region_stats(regions, data):
+    """
+    Restores the streaming summaries of the durations of regions from packed arrays.
+
+    Args:
+        regions (list): The regions.
+        data (dict): The arrays written by pack_stats for region_entries.
+    """
+    entries = unpack_stats(data)
+    for region in regions:
+        for name in STAT_NAMES:
+            banded = BandedStats()
+            for key, stats in entries.items():
+                region_id, stat_name, band = key.split("/", 2)
+                if region_id == region.id and stat_name == name:
+                    if band:
+                        banded.bands[band] = stats
+                    else:
+                        banded.overall = stats
+            setattr(region, name + "_stats", banded)
+
+# -------------------------------------------------------------------------------------------------------------
+
+def save_region_stats(regions, folder):
+    """
+    Writes the streaming summaries of the durations of regions to folder/stats.npz, next to the
+    history, so that they can be merged across regions and runs later.
+
+    Args:
+        regions (list): The regions.
+        folder (str): The output folder.
+    """
+    os.makedirs(folder, exist_ok=True)
+    np.savez_compressed(os.path.join(folder, STATS_FILE), **pack_stats(region_entries(regions)))
+
+# -------------------------------------------------------------------------------------------------------------
+
+def load_region_stats(path):
+    """
+    Reads the streaming summaries saved with the history of a run, e.g. to merge the summaries
+    of several runs or regions with BandedStats.merge.
+
+    Args:
+        path (str): The path of the stats file.
+
+    Returns:
+        dict: Maps each region ID to {duration name: BandedStats}.
+    """
+    with np.load(path) as archive:
+        entries = unpack_stats({name: archive[name] for name in archive.files})
+    result = {}
+    for key, stats in entries.items():
+        region_id, name, band = key.split("/", 2)
+        banded = result.setdefault(region_id, {}).setdefault(name, BandedStats())
+        if band:
+            banded.bands[band] = stats
+        else:
+            banded.overall = stats
+    return result
+
+# -------------------------------------------------------------------------------------------------------------
\ No newline at end of file